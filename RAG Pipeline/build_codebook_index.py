@@ -0,0 +1,153 @@
+# build_codebook_index.py
+"""
+Build the fars_codebook_faiss store that orchestration.py retrieves codebook
+context from, straight from fars_codebook.csv.
+
+The codebook has one row per (variable, code). Embedding rows one by one makes
+retrieval return scattered code lines; instead each variable becomes:
+
+- one "variable" document: label, definition, additional information and the
+  years the variable exists in
+- one "values" document per group of value labels (long code lists such as
+  MAK_MOD are split into groups), with codes that only exist in some years
+  marked with those years
+
+Every document carries {"table", "variable"} metadata using the same keys as
+load_fars_codebook ("accident", "WEATHER"), so a hit maps directly onto the
+backend's column metadata. Documents and ids are generated in sorted order,
+so rebuilding from the same CSV gives the same index.
+
+    python build_codebook_index.py [--csv ../fars_codebook.csv] [--out ../fars_codebook_faiss]
+"""
+
+import argparse
+import os
+import sys
+import time
+from typing import List
+
+import pandas as pd
+from langchain_core.documents import Document
+from langchain_community.vectorstores import FAISS
+
+from embedding_cache import CachedEmbeddings
+from embedding_engine import ParallelEmbeddings
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "User Interface", "Backend"))
+from vector_store import save_docstore
+from sparse_index import build_for_vectorstore as build_sparse_index
+from metadata_loader import read_codebook, codebook_years
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+CODEBOOK_PATH = os.path.join(ROOT, "fars_codebook.csv")
+CODEBOOK_FAISS_PATH = os.path.join(ROOT, "fars_codebook_faiss")
+# Must match the backend's query embeddings (orchestration.EMBEDDING_MODEL)
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+VALUES_PER_DOC = 40
+
+
+# ----------------- Year availability -----------------
+def year_span(years: List[int]) -> str:
+    """[2014, 2015, 2016, 2019] -> "2014-2016, 2019"."""
+    if not years:
+        return "none"
+    ranges, start, prev = [], years[0], years[0]
+    for year in years[1:] + [None]:
+        if year is not None and year == prev + 1:
+            prev = year
+            continue
+        ranges.append(str(start) if start == prev else f"{start}-{prev}")
+        if year is not None:
+            start = prev = year
+    return ", ".join(ranges)
+
+def _text(value) -> str:
+    return str(value).strip() if pd.notna(value) else ""
+
+
+# ----------------- Documents -----------------
+def codebook_documents(df: pd.DataFrame, values_per_doc: int = VALUES_PER_DOC):
+    """(documents, ids) for every variable of a read_codebook frame, in sorted order."""
+    years = codebook_years(df)
+    # Years each codebook row (variable, code) is valid in
+    flags = df[[str(y) for y in years]].notna().to_numpy()
+    df = df.assign(_years=[[y for y, flag in zip(years, row) if flag] for row in flags])
+
+    docs, ids = [], []
+    for (table, column), group in df.groupby(["table", "column"], sort=True):
+        var_years = sorted({y for row_years in group["_years"] for y in row_years})
+        first = group.iloc[0]
+        base = {"table": table, "variable": column}
+        if var_years:
+            base.update(first_year=var_years[0], last_year=var_years[-1])
+        header = f"Variable: {column} ({table} table)"
+
+        lines = [header, f"Label: {_text(first.get('label'))}"]
+        for field, title in (("definition", "Definition"), ("additional information", "Additional Information")):
+            text = next((_text(v) for v in group.get(field, []) if _text(v)), "")
+            if text:
+                lines.append(f"{title}: {text}")
+        lines.append(f"Available in: {year_span(var_years)}")
+        docs.append(Document(page_content="\n".join(lines), metadata={**base, "kind": "variable"}))
+        ids.append(f"{table}.{column}")
+
+        # The CSV repeats a code per coding era; one line per (code, label) with its years
+        value_years = {}
+        for code, label, row_years in zip(group["code"], group["value_label"], group["_years"]):
+            if pd.isna(code) or pd.isna(label):
+                continue
+            value_years.setdefault((code, _text(label)), set()).update(row_years)
+
+        values = []
+        for (code, label), code_years in value_years.items():
+            code_years = sorted(code_years)
+            line = f"{code} = {label}"
+            if code_years and code_years != var_years:
+                line += f" ({year_span(code_years)})"
+            values.append(line)
+
+        for i in range(0, len(values), values_per_doc):
+            chunk = values[i:i + values_per_doc]
+            group_no = i // values_per_doc
+            docs.append(Document(
+                page_content="\n".join([f"{header} values:"] + chunk),
+                metadata={**base, "kind": "values", "group": group_no},
+            ))
+            ids.append(f"{table}.{column}.values.{group_no}")
+
+    return docs, ids
+
+
+# ----------------- Build -----------------
+def build_codebook_index(
+    csv_path: str = CODEBOOK_PATH,
+    save_path: str = CODEBOOK_FAISS_PATH,
+    embedding_model: str = EMBEDDING_MODEL,
+    values_per_doc: int = VALUES_PER_DOC,
+):
+    start = time.perf_counter()
+    docs, ids = codebook_documents(read_codebook(csv_path), values_per_doc)
+    variables = sum(1 for d in docs if d.metadata["kind"] == "variable")
+    print(f"Built {len(docs)} documents for {variables} codebook variables")
+
+    with CachedEmbeddings(
+        ParallelEmbeddings("huggingface", embedding_model), model_name=embedding_model
+    ) as embeddings:
+        vectorstore = FAISS.from_documents(docs, embeddings, ids=ids)
+        print(embeddings.report())
+
+    vectorstore.save_local(save_path)
+    save_docstore(vectorstore, save_path)
+    build_sparse_index(vectorstore, save_path)
+    print(f"Codebook FAISS index saved to {save_path} in {time.perf_counter() - start:.1f}s")
+    return vectorstore
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the FARS codebook FAISS index")
+    parser.add_argument("--csv", default=CODEBOOK_PATH)
+    parser.add_argument("--out", default=CODEBOOK_FAISS_PATH)
+    parser.add_argument("--values-per-doc", type=int, default=VALUES_PER_DOC)
+    args = parser.parse_args()
+
+    build_codebook_index(args.csv, args.out, values_per_doc=args.values_per_doc)
@@ -1,21 +1,44 @@
 # build_vectorstore.py
 """
-Script to load Databricks tables, convert to Documents, embed with Ollama,
-and save FAISS vectorstore to disk for sharing.
+Script to load Databricks tables, convert to Documents, embed them in parallel
+(HuggingFace, the backend's query model), and save FAISS vectorstore to disk
+for sharing.
 """
 
 import os
-from typing import List, Optional
+import queue
+import sys
+import threading
+import uuid
+from typing import Iterator, List, Optional
+import faiss
+import numpy as np
 import pandas as pd
 from langchain_core.documents import Document
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_community.vectorstores import FAISS
-from langchain_ollama import OllamaEmbeddings
+from embedding_engine import ParallelEmbeddings
+from embedding_cache import CachedEmbeddings
+from index_types import build_index, compress_vectorstore
 from dotenv import load_dotenv
 from databricks import sql
 
+# The serving-side docstore format lives with the backend modules
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "User Interface", "Backend"))
+from vector_store import INDEX_FILE, DocstoreWriter, load_vectorstore, save_docstore
+from sparse_index import build_for_vectorstore as build_sparse_index
+from metadata_loader import YearCodebook, load_fars_codebook, load_year_codebook
+
 load_dotenv("../config/.env")
 
+CODEBOOK_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "fars_codebook.csv")
+
+# Must match the backend's query embeddings (orchestration.EMBEDDING_MODEL).
+# "huggingface" runs one model per CPU worker; "ollama" is one local server
+# and does not get faster with more workers (see embedding_engine.py).
+EMBEDDING_BACKEND = "huggingface"
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
 # ----------------- Databricks SQL connection -----------------
 def get_databricks_connection():
     return sql.connect(
@@ -28,34 +51,204 @@ def load_table_as_documents(
     table_name: str,
     text_cols: Optional[List[str]] = None,
     id_col: Optional[str] = None,
+    compact: bool = True,
 ) -> List[Document]:
     with get_databricks_connection() as connection:
         with connection.cursor() as cursor:
             cursor.execute(f"SELECT * FROM {table_name}")
             arrow_table = cursor.fetchall_arrow()
-            df = arrow_table.to_pandas()
-
-    if text_cols is None:
-        text_cols = list(df.columns)
-
-    # Use list comprehension + itertuples
-    docs = [
-        Document(
-            page_content="\n".join(f"{col}: {getattr(row, col)}" for col in text_cols),
-            metadata={"id": getattr(row, id_col)} if id_col else {}
-        )
-        for row in df.itertuples(index=False)
+
+    serializer = RowSerializer.for_table(table_name) if compact else None
+    return arrow_to_documents(arrow_table, text_cols, id_col, serializer)
+
+def iter_table_batches(table_name: str, batch_size: int = 5000, where: Optional[str] = None):
+    """
+    Stream a table from Databricks as Arrow batches of at most batch_size rows,
+    optionally restricted by a WHERE clause (e.g. "YEAR = 2023").
+    """
+    query = f"SELECT * FROM {table_name}"
+    if where:
+        query += f" WHERE {where}"
+
+    with get_databricks_connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute(query)
+            while True:
+                batch = cursor.fetchmany_arrow(batch_size)
+                if batch.num_rows == 0:
+                    break
+                yield batch
+
+# Columns copied into Document metadata so indexes can be partitioned and filtered
+# (the coded fields match query_filters.FILTER_COLUMNS in the backend)
+METADATA_COLS = ["YEAR", "STATE", "ST_CASE", "MONTH", "DAY_WEEK", "WEATHER", "LGT_COND", "RUR_URB", "SCH_BUS"]
+
+def frame_metadata(df: pd.DataFrame, id_col: Optional[str] = None) -> List[dict]:
+    """Metadata dict per row: the METADATA_COLS present (as int, nulls dropped) plus an optional id."""
+    cols = [c for c in METADATA_COLS if c in df.columns]
+    if not cols:
+        # A frame without columns iterates zero rows; keep one record per row
+        records = [{} for _ in range(len(df))]
+    else:
+        values = df[cols].apply(pd.to_numeric, errors="coerce").astype("Int64")
+        records = [
+            {col: int(v) for col, v in zip(cols, row) if v is not pd.NA}
+            for row in values.itertuples(index=False, name=None)
+        ]
+    if id_col:
+        for record, value in zip(records, df[id_col].tolist()):
+            record["id"] = value
+    return records
+
+# ----------------- Compact, codebook-decoded rows -----------------
+# Values that say nothing about the crash; the field is left out entirely
+DROP_LABELS = {"Not Reported", "Reported as Unknown", "Unknown", "Not Applicable"}
+
+# Identity fields first, then the table's own column order
+LEADING_COLS = ["ST_CASE", "YEAR", "STATE"]
+
+class RowSerializer:
+    """
+    Vectorized row -> text serializer.
+
+    Coded columns are decoded with the FARS codebook ("WEATHER: Rain (2)"; the
+    code is kept so exact-code lookups still work), null and not-reported
+    fields are dropped, and each row becomes one short "COL: value" document
+    with a fixed column order, small enough to be embedded as a single chunk.
+
+    Codes are decoded with the code map of the row's own YEAR (codes change
+    between coding eras); rows whose year the codebook does not cover use the
+    all-years map.
+    """
+
+    def __init__(
+        self,
+        codebook_table: str,
+        column_metadata: Optional[dict] = None,
+        year_codebook: Optional[YearCodebook] = None,
+    ):
+        if column_metadata is None:
+            column_metadata = load_fars_codebook(CODEBOOK_PATH)
+        if year_codebook is None:
+            year_codebook = load_year_codebook(CODEBOOK_PATH)
+        self.table = codebook_table
+        self.year_codebook = year_codebook
+        self.code_maps = {}
+        self._year_maps = {}
+        for column, info in column_metadata.get(codebook_table, {}).items():
+            code_map = self._clean_codes(info.get("codes", {}))
+            if code_map:
+                self.code_maps[column] = code_map
+
+    @staticmethod
+    def _clean_codes(codes: dict) -> dict:
+        code_map = {}
+        for code, label in codes.items():
+            # Self-labelled codes ("10" -> "10", "(Self-evident)") are left as values
+            if not code.lstrip("-").isdigit() or label == code or label.startswith("("):
+                continue
+            code_map[int(code)] = label
+        return code_map
+
+    def code_map(self, column: str, year=None) -> Optional[dict]:
+        """Code map of a column in `year`, or the all-years map when that year is not covered."""
+        if year is None:
+            return self.code_maps.get(column)
+        key = (column, year)
+        if key not in self._year_maps:
+            codes = self.year_codebook.codes(self.table, column, year)
+            self._year_maps[key] = self.code_maps.get(column) if codes is None else self._clean_codes(codes)
+        return self._year_maps[key]
+
+    @classmethod
+    def for_table(cls, table_name: str) -> "RowSerializer":
+        # workspace.fars_database.accident_master -> accident
+        return cls(table_name.split(".")[-1].lower().replace("_master", ""))
+
+    def columns(self, df: pd.DataFrame, text_cols: Optional[List[str]] = None) -> List[str]:
+        cols = list(text_cols or df.columns)
+        # STATE decodes to the state name, so STATENAME is redundant; COUNTY has
+        # no codebook labels, so COUNTYNAME replaces it
+        for col in list(cols):
+            name_col = f"{col}NAME"
+            if name_col in cols:
+                cols.remove(name_col if col in self.code_maps else col)
+        return [c for c in LEADING_COLS if c in cols] + [c for c in cols if c not in LEADING_COLS]
+
+    def decode(self, series: pd.Series, column: str, years: Optional[pd.Series] = None) -> pd.Series:
+        """Text value per row, or NA when the field should be dropped."""
+        # Integral floats from Arrow ("12.0") read as plain numbers
+        numeric = pd.to_numeric(series, errors="coerce")
+        integral = numeric.notna() & (numeric % 1 == 0)
+        codes = numeric.where(integral).astype("Int64")
+        text = series.astype("string").str.strip().mask(integral, codes.astype("string"))
+
+        if column in self.code_maps:
+            labels = pd.Series(pd.NA, index=series.index, dtype="string")
+            if years is None:
+                groups = [(None, slice(None))]
+            else:
+                groups = [(year, (years == year).fillna(False)) for year in years.dropna().unique()]
+                groups.append((None, years.isna()))
+            for year, rows in groups:
+                code_map = self.code_map(column, None if year is None else int(year))
+                if code_map:
+                    labels[rows] = codes[rows].map(code_map).astype("string")
+            text = (labels + " (" + codes.astype("string") + ")").fillna(text)
+            dropped = labels.isin(DROP_LABELS) | labels.str.startswith("Unknown")
+            text = text.mask(dropped.fillna(False))
+        empty = text.isin(DROP_LABELS) | (text == "") | (text.str.lower() == "nan")
+        return text.mask(empty.fillna(False))
+
+    def serialize(self, df: pd.DataFrame, text_cols: Optional[List[str]] = None) -> pd.Series:
+        out = pd.Series("", index=df.index, dtype="string")
+        years = pd.to_numeric(df["YEAR"], errors="coerce").astype("Int64") if "YEAR" in df.columns else None
+        for col in self.columns(df, text_cols):
+            out = out + (col + ": " + self.decode(df[col], col, years) + "\n").fillna("")
+        return out.str.rstrip("\n")
+
+def arrow_to_documents(
+    arrow_table,
+    text_cols: Optional[List[str]] = None,
+    id_col: Optional[str] = None,
+    serializer: Optional[RowSerializer] = None,
+) -> List[Document]:
+    """
+    Convert an Arrow table (or batch) into one Document per row. With a
+    RowSerializer rows are compact and codebook-decoded; otherwise every column
+    is rendered raw.
+    """
+    df = arrow_table.to_pandas()
+
+    if serializer is not None:
+        texts = serializer.serialize(df, text_cols).tolist()
+    else:
+        cols = list(text_cols or df.columns)
+        texts = ["\n".join(f"{col}: {value}" for col, value in zip(cols, row))
+                 for row in df[cols].itertuples(index=False, name=None)]
+
+    return [
+        Document(page_content=text, metadata=metadata)
+        for text, metadata in zip(texts, frame_metadata(df, id_col))
     ]
-    return docs
 
 def build_faiss_vectorstore(
     docs: List[Document],
     chunk_size: int = 3000,
     chunk_overlap: int = 300,
-    embedding_model: str = "nomic-embed-text",
-    save_path: str = "vectorstore.faiss"
+    embedding_model: str = EMBEDDING_MODEL,
+    embedding_backend: str = EMBEDDING_BACKEND,
+    save_path: str = "vectorstore.faiss",
+    embedding_workers: Optional[int] = None,
+    index_type: str = "flat",
+    index_params: Optional[dict] = None,
 ):
-    """Chunk documents, embed them, and store in FAISS."""
+    """
+    Chunk documents, embed them in parallel length-sorted batches, and store in FAISS.
+    Chunks already embedded by an earlier build are read from the embedding cache.
+    index_type "hnsw" or "ivfpq" replaces the exact index with an approximate one
+    (see index_types.py) and prints its recall-vs-latency report.
+    """
     splitter = RecursiveCharacterTextSplitter(
         chunk_size=chunk_size,
         chunk_overlap=chunk_overlap,
@@ -63,12 +256,157 @@ def build_faiss_vectorstore(
     )
     split_docs = splitter.split_documents(docs)
 
-    embeddings = OllamaEmbeddings(model=embedding_model)
-    vectorstore = FAISS.from_documents(split_docs, embeddings, batch_size=32)
+    engine = ParallelEmbeddings(embedding_backend, embedding_model, workers=embedding_workers)
+    with CachedEmbeddings(engine, model_name=embedding_model) as embeddings:
+        vectorstore = FAISS.from_documents(split_docs, embeddings)
+        print(embeddings.report())
+        print(f"Embedding throughput: {engine.throughput():.1f} texts/s")
+
+    vectorstore = compress_vectorstore(vectorstore, index_type, **(index_params or {}))
 
     # Save to disk
     vectorstore.save_local(save_path)
+    save_docstore(vectorstore, save_path)
+    build_sparse_index(vectorstore, save_path)
+    print(f"FAISS vectorstore saved to {save_path}")
+
+def build_faiss_vectorstore_streaming(
+    table_name: str,
+    batch_size: int = 5000,
+    chunk_size: int = 3000,
+    chunk_overlap: int = 300,
+    embedding_model: str = EMBEDDING_MODEL,
+    embedding_backend: str = EMBEDDING_BACKEND,
+    save_path: str = "vectorstore.faiss",
+    prefetch: int = 2,
+    text_cols: Optional[List[str]] = None,
+    id_col: Optional[str] = None,
+    embedding_workers: Optional[int] = None,
+    index_type: str = "flat",
+    index_params: Optional[dict] = None,
+    compact: bool = True,
+) -> FAISS:
+    """
+    Build a FAISS vectorstore from a Databricks table in constant memory.
+
+    A background thread fetches Arrow batches with fetchmany_arrow and turns
+    them into split documents, while the main thread embeds the previous batch.
+    At most `prefetch` batches wait in between. Each embedded batch is written
+    out at once: its documents to docs.sqlite and its vectors to a float32
+    spill file in `save_path`, so memory stays bounded by the batch size
+    however large the table is.
+
+    The index is built once at the end from the memory-mapped spill file:
+    IVF-PQ is trained on a sample of the whole table rather than the first
+    batch, and only the finished index is held in memory (the compressed PQ
+    codes for "ivfpq"; "flat" and "hnsw" keep every vector, 4 x dim bytes per
+    chunk). No exact index is kept alongside, so no recall report is printed.
+
+    Returns the saved store opened with load_vectorstore (memory-mapped,
+    read-only docstore), or None for an empty table.
+    """
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        length_function=len,
+    )
+    engine = ParallelEmbeddings(embedding_backend, embedding_model, workers=embedding_workers)
+    embeddings = CachedEmbeddings(engine, model_name=embedding_model)
+
+    serializer = RowSerializer.for_table(table_name) if compact else None
+
+    batches: queue.Queue = queue.Queue(maxsize=prefetch)
+    done = object()
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        # Never block for good on a full queue: the consumer may have given up
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        table_batches = iter_table_batches(table_name, batch_size)
+        try:
+            for arrow_batch in table_batches:
+                docs = arrow_to_documents(arrow_batch, text_cols, id_col, serializer)
+                if not put(splitter.split_documents(docs)):
+                    break
+        except Exception as e:
+            put(e)
+        finally:
+            # Closes the Databricks cursor and connection even when stopped early
+            table_batches.close()
+            put(done)
+
+    os.makedirs(save_path, exist_ok=True)
+    spill_path = os.path.join(save_path, "vectors.f32.tmp")
+    writer = DocstoreWriter(save_path)
+
+    producer = threading.Thread(target=produce, name="databricks-fetch", daemon=True)
+    producer.start()
+
+    dim = None
+    total_chunks = 0
+    batch_no = 0
+    finished = False
+    try:
+        with open(spill_path, "wb") as spill:
+            while True:
+                item = batches.get()
+                if item is done:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+
+                vectors = np.asarray(embeddings.embed_documents([doc.page_content for doc in item]), dtype=np.float32)
+                dim = vectors.shape[1]
+                spill.write(vectors.tobytes())
+                writer.add((str(uuid.uuid4()), doc) for doc in item)
+
+                batch_no += 1
+                total_chunks += len(item)
+                print(f"Batch {batch_no}: embedded {len(item)} chunks ({total_chunks} total)")
+
+        print(embeddings.report())
+        print(f"Embedding throughput: {engine.throughput():.1f} texts/s")
+        if total_chunks == 0:
+            print(f"No rows returned from {table_name}; nothing to save.")
+            return None
+
+        # Read back in chunks by build_index; only the finished index is in memory
+        vectors = np.memmap(spill_path, dtype=np.float32, mode="r", shape=(total_chunks, dim))
+        index = build_index(vectors, index_type, metric=faiss.METRIC_L2, **(index_params or {}))
+        del vectors
+        faiss.write_index(index, os.path.join(save_path, INDEX_FILE))
+        del index
+        # Same settings FAISS.from_embeddings would have used
+        writer.finish()
+        finished = True
+        # An index.pkl from an earlier build would no longer match
+        stale_pickle = os.path.join(save_path, "index.pkl")
+        if os.path.exists(stale_pickle):
+            os.remove(stale_pickle)
+    finally:
+        # On an error the producer stops at its next put and releases the cursor
+        stop.set()
+        producer.join()
+        embeddings.close()
+        if not finished:
+            writer.abort()
+        if os.path.exists(spill_path):
+            os.remove(spill_path)
+
+    # The cache (and its SQLite connection) is closed; the returned store
+    # embeds later queries through the engine
+    vectorstore = load_vectorstore(save_path, engine)
+    build_sparse_index(vectorstore, save_path)
     print(f"FAISS vectorstore saved to {save_path}")
+    return vectorstore
 
 if __name__ == "__main__":
     print("Choose a table to load:")
@@ -83,8 +421,11 @@ if __name__ == "__main__":
         print("Invalid table name. Exiting.")
         exit(1)
 
-    print(f"Loading documents from {TABLE_NAME}...")
-    docs = load_table_as_documents(TABLE_NAME)
+    INDEX_TYPE = input("Index type [flat/hnsw/ivfpq] (default flat): ").strip() or "flat"
 
-    print("Building FAISS vectorstore...")
-    build_faiss_vectorstore(docs, save_path=f"{TABLE_NAME.replace('.', '_')}_vectorstore")
\ No newline at end of file
+    print(f"Streaming {TABLE_NAME} into a {INDEX_TYPE} FAISS vectorstore...")
+    build_faiss_vectorstore_streaming(
+        TABLE_NAME,
+        save_path=f"{TABLE_NAME.replace('.', '_')}_vectorstore",
+        index_type=INDEX_TYPE,
+    )
\ No newline at end of file
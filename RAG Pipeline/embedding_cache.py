@@ -0,0 +1,170 @@
+# embedding_cache.py
+"""
+Persistent content-hash embedding cache shared across index builds.
+
+Vectors are keyed by SHA-256 of the text and stored per embedding model as:
+
+    <cache_dir>/<model>/vectors.f32   append-only float32 matrix (memory-mapped)
+    <cache_dir>/<model>/keys.sqlite   text hash -> row number
+    <cache_dir>/<model>/meta.json     model name and dimension
+
+CachedEmbeddings wraps any LangChain Embeddings object. Rebuilding an index
+(new chunking, new index type, one changed YEAR of accident_master) only
+embeds texts that were never seen before with that model.
+"""
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+from typing import Dict, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+DEFAULT_CACHE_DIR = os.getenv(
+    "FARS_EMBEDDING_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".cache", "embeddings"),
+)
+
+
+class EmbeddingCache:
+    def __init__(self, model_name: str, cache_dir: str = DEFAULT_CACHE_DIR):
+        self.model_name = model_name
+        self.path = os.path.join(cache_dir, re.sub(r"[^\w.-]+", "_", model_name))
+        os.makedirs(self.path, exist_ok=True)
+
+        self.vectors_path = os.path.join(self.path, "vectors.f32")
+        self.meta_path = os.path.join(self.path, "meta.json")
+
+        self.dim: Optional[int] = None
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path) as f:
+                meta = json.load(f)
+            if meta.get("model") != model_name:
+                raise ValueError(f"Embedding cache at {self.path} belongs to model {meta.get('model')}")
+            self.dim = meta["dim"]
+
+        self._conn = sqlite3.connect(os.path.join(self.path, "keys.sqlite"))
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS keys (key BLOB PRIMARY KEY, row INTEGER NOT NULL) WITHOUT ROWID"
+        )
+        self._conn.commit()
+        self._matrix = None
+
+    @staticmethod
+    def text_key(text: str) -> bytes:
+        return hashlib.sha256(text.encode("utf-8")).digest()
+
+    # ----------------- matrix -----------------
+    def __len__(self) -> int:
+        if self.dim is None or not os.path.exists(self.vectors_path):
+            return 0
+        return os.path.getsize(self.vectors_path) // (4 * self.dim)
+
+    def _get_matrix(self):
+        rows = len(self)
+        if self._matrix is None or self._matrix.shape[0] != rows:
+            self._matrix = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(rows, self.dim))
+        return self._matrix
+
+    # ----------------- lookup / insert -----------------
+    def lookup(self, keys: List[bytes]) -> Dict[bytes, int]:
+        """Map each cached key to its row number (missing keys are omitted)."""
+        found = {}
+        for start in range(0, len(keys), 500):  # stay under SQLite's variable limit
+            chunk = keys[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            for key, row in self._conn.execute(
+                f"SELECT key, row FROM keys WHERE key IN ({placeholders})", chunk
+            ):
+                found[bytes(key)] = row
+        return found
+
+    def add(self, keys: List[bytes], vectors) -> Dict[bytes, int]:
+        """Append vectors to the matrix and index their keys."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim != 2 or len(vectors) != len(keys):
+            raise ValueError("keys and vectors must have the same length")
+
+        if self.dim is None:
+            self.dim = int(vectors.shape[1])
+            with open(self.meta_path, "w") as f:
+                json.dump({"model": self.model_name, "dim": self.dim}, f)
+        elif vectors.shape[1] != self.dim:
+            raise ValueError(f"Expected {self.dim}-dim vectors, got {vectors.shape[1]}")
+
+        first_row = len(self)
+        # Vectors are written before their keys, so an interrupted build can
+        # only leave unreferenced rows behind, never keys pointing at nothing.
+        # A partially written last row is cut off first, so new rows start
+        # exactly at first_row.
+        mode = "r+b" if os.path.exists(self.vectors_path) else "wb"
+        with open(self.vectors_path, mode) as f:
+            f.truncate(first_row * 4 * self.dim)
+            f.seek(first_row * 4 * self.dim)
+            f.write(vectors.tobytes())
+        self._matrix = None
+
+        rows = {key: first_row + i for i, key in enumerate(keys)}
+        self._conn.executemany("INSERT OR REPLACE INTO keys (key, row) VALUES (?, ?)", rows.items())
+        self._conn.commit()
+        return rows
+
+    def get(self, rows: List[int]) -> np.ndarray:
+        return np.asarray(self._get_matrix()[rows])
+
+    def close(self):
+        self._matrix = None
+        self._conn.close()
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that only computes vectors for unseen texts."""
+
+    def __init__(self, underlying: Embeddings, model_name: str, cache_dir: str = DEFAULT_CACHE_DIR):
+        self.underlying = underlying
+        self.cache = EmbeddingCache(model_name, cache_dir)
+        self.hits = 0
+        self.misses = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+
+        keys = [EmbeddingCache.text_key(t) for t in texts]
+        rows = self.cache.lookup(list(set(keys)))
+
+        # Embed each unseen text once, even if it repeats within the batch
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in rows and key not in missing:
+                missing[key] = text
+
+        if missing:
+            new_vectors = self.underlying.embed_documents(list(missing.values()))
+            rows.update(self.cache.add(list(missing.keys()), new_vectors))
+
+        self.misses += len(missing)
+        self.hits += len(texts) - len(missing)
+        return self.cache.get([rows[k] for k in keys]).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.underlying.embed_query(text)
+
+    def close(self):
+        if hasattr(self.underlying, "close"):
+            self.underlying.close()
+        self.cache.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def report(self) -> str:
+        total = self.hits + self.misses
+        rate = self.hits / total if total else 0.0
+        return f"Embedding cache: {self.hits} hits, {self.misses} new ({rate:.0%} reused, {len(self.cache)} cached)"
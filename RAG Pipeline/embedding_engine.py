@@ -0,0 +1,170 @@
+# embedding_engine.py
+"""
+Parallel, length-bucketed embedding engine for index builds.
+
+ParallelEmbeddings is a drop-in LangChain `Embeddings` implementation
+(usable with FAISS.from_documents / add_embeddings) that:
+- sorts texts by length and packs them into dynamic batches under a padded
+  character budget, so short rows are not padded up to the longest chunk
+- runs batches on several workers in parallel:
+    * "huggingface": one SentenceTransformer per worker process
+    * "ollama": concurrent HTTP requests to the Ollama server (threads)
+- restores the original order and reports throughput in texts/second
+
+Only the "huggingface" backend actually parallelizes the model across CPU
+cores. With "ollama" every worker thread talks to the same local server,
+which runs at most OLLAMA_NUM_PARALLEL requests at a time (often 1), so the
+pool mostly overlaps HTTP round trips and length sorting saves little; use
+it for its batching and throughput reporting, not for speed-ups.
+
+The process/thread pool lives until close() (or the end of a `with` block);
+it is created again on the next embed_documents() call.
+"""
+
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import multiprocessing as mp
+from typing import List, Optional
+
+from langchain_core.embeddings import Embeddings
+
+# ------------------------------------------------------------------------
+# Worker-side model (one per process)
+# ------------------------------------------------------------------------
+_worker_model = None
+
+def _init_hf_worker(model_name: str, threads: int):
+    global _worker_model
+    import torch
+    torch.set_num_threads(threads)  # avoid oversubscribing cores across workers
+
+    from langchain_huggingface import HuggingFaceEmbeddings
+    _worker_model = HuggingFaceEmbeddings(model_name=model_name)
+
+def _embed_hf_batch(texts: List[str]) -> List[List[float]]:
+    return _worker_model.embed_documents(texts)
+
+
+# ------------------------------------------------------------------------
+# Engine
+# ------------------------------------------------------------------------
+class ParallelEmbeddings(Embeddings):
+    def __init__(
+        self,
+        backend: str = "huggingface",
+        model_name: str = "sentence-transformers/all-MiniLM-L6-v2",
+        workers: Optional[int] = None,
+        max_batch_chars: int = 64_000,
+        max_batch_size: int = 256,
+        verbose: bool = True,
+    ):
+        if backend not in {"huggingface", "ollama"}:
+            raise ValueError(f"Unknown embedding backend: {backend}")
+
+        self.backend = backend
+        self.model_name = model_name
+        self.workers = workers or max(1, (os.cpu_count() or 2) // 2)
+        self.max_batch_chars = max_batch_chars
+        self.max_batch_size = max_batch_size
+        self.verbose = verbose
+
+        self.total_texts = 0
+        self.total_seconds = 0.0
+        self._pool = None
+        self._local_model = None
+
+    # ----------------- pool / local model -----------------
+    def _get_pool(self):
+        if self._pool is None:
+            if self.backend == "huggingface":
+                threads = max(1, (os.cpu_count() or 1) // self.workers)
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=mp.get_context("spawn"),
+                    initializer=_init_hf_worker,
+                    initargs=(self.model_name, threads),
+                )
+            else:
+                self._pool = ThreadPoolExecutor(max_workers=self.workers)
+        return self._pool
+
+    def _get_local_model(self):
+        if self._local_model is None:
+            if self.backend == "huggingface":
+                from langchain_huggingface import HuggingFaceEmbeddings
+                self._local_model = HuggingFaceEmbeddings(model_name=self.model_name)
+            else:
+                from langchain_ollama import OllamaEmbeddings
+                self._local_model = OllamaEmbeddings(model=self.model_name)
+        return self._local_model
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # ----------------- batching -----------------
+    def make_batches(self, texts: List[str]) -> List[List[int]]:
+        """
+        Group text indices into batches sorted by length. A batch is closed when
+        its padded size (count x longest text) would exceed max_batch_chars.
+        """
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        batches, current, longest = [], [], 0
+        for i in order:
+            length = max(1, len(texts[i]))
+            padded = (len(current) + 1) * max(longest, length)
+            if current and (padded > self.max_batch_chars or len(current) >= self.max_batch_size):
+                batches.append(current)
+                current, longest = [], 0
+            current.append(i)
+            longest = max(longest, length)
+        if current:
+            batches.append(current)
+        return batches
+
+    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        # Thread-pool path (Ollama): the client is thread-safe
+        return self._get_local_model().embed_documents(texts)
+
+    # ----------------- Embeddings API -----------------
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+
+        start = time.perf_counter()
+        batches = self.make_batches(texts)
+        pool = self._get_pool()
+        fn = _embed_hf_batch if self.backend == "huggingface" else self._embed_batch
+
+        futures = [pool.submit(fn, [texts[i] for i in batch]) for batch in batches]
+
+        results: List[Optional[List[float]]] = [None] * len(texts)
+        for batch, future in zip(batches, futures):
+            for i, vector in zip(batch, future.result()):
+                results[i] = vector
+
+        elapsed = time.perf_counter() - start
+        self.total_texts += len(texts)
+        self.total_seconds += elapsed
+        if self.verbose:
+            print(
+                f"Embedded {len(texts)} texts in {elapsed:.1f}s "
+                f"({len(texts) / max(elapsed, 1e-9):.1f} texts/s, "
+                f"{len(batches)} batches, {self.workers} workers)"
+            )
+        return results
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._get_local_model().embed_query(text)
+
+    def throughput(self) -> float:
+        """Average texts/second over every embed_documents() call so far."""
+        return self.total_texts / self.total_seconds if self.total_seconds else 0.0
@@ -2,7 +2,7 @@
 
 """
 RAG pipeline using:
-- Ollama embeddings + FAISS as vector store
+- Parallel HuggingFace embeddings (or Ollama) + FAISS as vector store
 - Ollama (local, free) as the LLM
 - A simple custom Retrieval-QA function
 
@@ -16,7 +16,8 @@ import pandas as pd
 from langchain_core.documents import Document
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_community.vectorstores import FAISS
-from langchain_ollama import ChatOllama, OllamaEmbeddings
+from langchain_ollama import ChatOllama
+from embedding_engine import ParallelEmbeddings
 
 from dotenv import load_dotenv
 load_dotenv("../config/.env")
@@ -100,7 +101,9 @@ def build_faiss_vectorstore(
     docs: List[Document],
     chunk_size: int = 1000,
     chunk_overlap: int = 200,
-    embedding_model: str = "nomic-embed-text",
+    embedding_model: str = "sentence-transformers/all-MiniLM-L6-v2",
+    embedding_workers: Optional[int] = None,
+    embedding_backend: str = "huggingface",
 ) -> FAISS:
     splitter = RecursiveCharacterTextSplitter(
         chunk_size=chunk_size,
@@ -109,8 +112,15 @@ def build_faiss_vectorstore(
     )
     split_docs = splitter.split_documents(docs)
 
-    embeddings = OllamaEmbeddings(model=embedding_model)
-    vectorstore = FAISS.from_documents(split_docs, embeddings)
+    # Length-sorted batches; the same object embeds queries later on. Queries
+    # use its single client, so the worker pool is shut down once the index
+    # is built (it is recreated if more documents are added).
+    embeddings = ParallelEmbeddings(embedding_backend, embedding_model, workers=embedding_workers)
+    try:
+        vectorstore = FAISS.from_documents(split_docs, embeddings)
+    finally:
+        embeddings.close()
+    print(f"Embedding throughput: {embeddings.throughput():.1f} texts/s")
     return vectorstore
 
 
@@ -192,7 +202,7 @@ def interactive_chat(rag_qa: SimpleRAGQA):
 # Main entry
 # ------------------------------------------------------------------------
 if __name__ == "__main__":
-    EMBEDDING_MODEL = "nomic-embed-text"
+    EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
     LLM_MODEL = "llama3"
 
     # Let the user choose the table
@@ -6,9 +6,13 @@ This version:
 - Uses SentenceTransformer embeddings (all-MiniLM-L6-v2)
 - Uses retriever.invoke() instead of get_relevant_documents()
 - Supports SQL, RAG, or BOTH routing
+- Runs the SQL and RAG branches of a BOTH answer concurrently
 """
 
 import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
 from typing import Literal
 from dotenv import load_dotenv
 load_dotenv("../config/.env")
@@ -18,9 +22,16 @@ load_dotenv("../config/.env")
 # ----------------------------------------------
 from sql_query_chain import ask_fars_database
 from langchain_ollama import ChatOllama
-from langchain_community.vectorstores import FAISS
 from langchain_huggingface import HuggingFaceEmbeddings
 
+# Memory-mapped FAISS loading and filtered retrieval live with the backend modules
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "User Interface", "Backend"))
+from vector_store import load_vectorstore
+from retrievers import FanOutRetriever
+from sparse_index import load_sparse_index
+from query_filters import ConstraintParser
+from metadata_loader import load_fars_codebook
+
 # ----------------------------------------------
 # 2) LOAD PREBUILT FAISS INDEX (accident table only)
 # ----------------------------------------------
@@ -31,14 +42,19 @@ print(f"Loading FAISS vectorstore from: {FAISS_PATH}")
 
 embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
 
-vectorstore = FAISS.load_local(
-    FAISS_PATH,
+vectorstore = load_vectorstore(FAISS_PATH, embeddings)
+
+# YEAR/STATE/coded-field constraints in the question restrict the search;
+# BM25 hits (exact codes, ST_CASE numbers) are fused with the dense ones
+accident_retriever = FanOutRetriever(
+    {"accident": vectorstore},
     embeddings=embeddings,
-    allow_dangerous_deserialization=True
+    k=4,
+    fetch_k=4,
+    constraint_parser=ConstraintParser(load_fars_codebook("../fars_codebook.csv")),
+    sparse_indexes={"accident": load_sparse_index(FAISS_PATH)},
 )
 
-accident_retriever = vectorstore.as_retriever(search_kwargs={"k": 4})
-
 # ----------------------------------------------
 # 3) SIMPLE RAG QA
 # ----------------------------------------------
@@ -110,7 +126,91 @@ def route(question: str) -> Literal["sql", "rag", "both"]:
     return label if label in {"sql", "rag", "both"} else "sql"
 
 # ----------------------------------------------
-# 5) ORCHESTRATION LAYER
+# 5) HYBRID (BOTH) EXECUTION
+# ----------------------------------------------
+# Per-branch time budgets in seconds, measured from the moment both
+# branches are submitted.
+SQL_TIMEOUT = float(os.getenv("HYBRID_SQL_TIMEOUT", "120"))
+RAG_TIMEOUT = float(os.getenv("HYBRID_RAG_TIMEOUT", "60"))
+
+# Shared pool so a timed-out branch never blocks the caller: the worker keeps
+# running in the background and its result is simply discarded.
+_hybrid_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="hybrid")
+
+
+def _collect_branch(future, deadline: float) -> dict:
+    """Wait for one branch until its deadline and describe the outcome."""
+    try:
+        value = future.result(timeout=max(0.0, deadline - time.monotonic()))
+        return {"status": "ok", "value": value}
+    except FutureTimeout:
+        return {"status": "timeout", "value": None}
+    except Exception as e:
+        return {"status": "error", "value": None, "error": str(e)}
+
+
+def run_hybrid(
+    question: str,
+    sql_timeout: float = SQL_TIMEOUT,
+    rag_timeout: float = RAG_TIMEOUT,
+) -> dict:
+    """
+    Run SQL generation/execution and retrieval/RAG answering at the same time.
+
+    Returns a structured response that keeps whatever finished in time:
+        {
+            "route": "both",
+            "results": <DataFrame or None>,
+            "answer": <RAG answer or None>,
+            "status": {"sql": "ok|timeout|error", "rag": "ok|timeout|error"},
+            "errors": {<branch>: <message>},
+            "elapsed": <seconds>,
+        }
+    """
+    start = time.monotonic()
+    sql_future = _hybrid_executor.submit(ask_fars_database, question)
+    rag_future = _hybrid_executor.submit(run_rag, question)
+
+    sql_branch = _collect_branch(sql_future, start + sql_timeout)
+    rag_branch = _collect_branch(rag_future, start + rag_timeout)
+
+    errors = {}
+    for name, branch, timeout in (("sql", sql_branch, sql_timeout), ("rag", rag_branch, rag_timeout)):
+        if branch["status"] == "timeout":
+            errors[name] = f"{name.upper()} branch timed out after {timeout:.0f}s"
+        elif branch["status"] == "error":
+            errors[name] = branch["error"]
+
+    return {
+        "route": "both",
+        "results": sql_branch["value"],
+        "answer": rag_branch["value"],
+        "status": {"sql": sql_branch["status"], "rag": rag_branch["status"]},
+        "errors": errors,
+        "elapsed": time.monotonic() - start,
+    }
+
+
+def format_hybrid(result: dict, max_rows: int = 20) -> str:
+    """Render a run_hybrid() response for the CLI without dumping whole tables."""
+    df = result.get("results")
+    if df is None:
+        sql_text = f"[unavailable: {result['errors'].get('sql', 'no result')}]"
+    elif df.empty:
+        sql_text = "[No rows returned]"
+    else:
+        sql_text = df.head(max_rows).to_string(index=False)
+        if len(df) > max_rows:
+            sql_text += f"\n... ({len(df) - max_rows} more rows)"
+
+    answer = result.get("answer")
+    if answer is None:
+        answer = f"[unavailable: {result['errors'].get('rag', 'no result')}]"
+
+    return f"SQL Result:\n{sql_text}\n\nExplanation:\n{answer}"
+
+# ----------------------------------------------
+# 6) ORCHESTRATION LAYER
 # ----------------------------------------------
 def answer_question(question: str):
     choice = route(question)
@@ -122,13 +222,10 @@ def answer_question(question: str):
         return run_rag(question)
 
     else:  # both
-        return (
-            f"SQL Result:\n{ask_fars_database(question)}\n\n"
-            f"Explanation:\n{run_rag(question)}"
-        )
+        return run_hybrid(question)
 
 # ----------------------------------------------
-# 6) CLI
+# 7) CLI
 # ----------------------------------------------
 if __name__ == "__main__":
     print("Hybrid SQL + RAG Assistant Ready (Ollama + FAISS Accident Index + Databricks)")
@@ -138,4 +235,7 @@ if __name__ == "__main__":
         q = input("You: ").strip()
         if q.lower() in ("quit", "exit"):
             break
-        print("\nAssistant:", answer_question(q), "\n")
\ No newline at end of file
+        answer = answer_question(q)
+        if isinstance(answer, dict):
+            answer = format_hybrid(answer)
+        print("\nAssistant:", answer, "\n")
\ No newline at end of file
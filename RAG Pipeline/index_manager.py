@@ -0,0 +1,278 @@
+# index_manager.py
+"""
+Incremental, YEAR-partitioned FAISS index management.
+
+Instead of rebuilding a whole vectorstore when a new FARS release lands, the
+manager tracks which YEAR partitions each index contains and adds, replaces or
+removes the vectors and docstore entries of a single partition.
+
+On-disk layout (a directory per index):
+
+    <index>/CURRENT                 name of the live version, e.g. "v000007"
+    <index>/versions/v000007/       save_local output + docs.sqlite + sparse/ + manifest.json
+    <index>/versions/v000006/       previous version (kept for rollback)
+
+Every save writes a complete new version directory and then atomically
+replaces CURRENT, so readers never see a half-written index. The backend
+(orchestration.py) polls CURRENT and hot-reloads when the version changes.
+Directories without CURRENT (the old monolithic save_local output) are still
+readable and are upgraded on the first save.
+
+The embeddings must be the ones the index was built with: the manifest
+records the model, and loading fails early on a different model or vector
+dimension. build_vectorstore.py embeds with the defaults below (HuggingFace
+all-MiniLM-L6-v2); indexes built earlier with Ollama nomic-embed-text need
+"--backend ollama --embedding-model nomic-embed-text".
+
+CLI:
+    python index_manager.py ../accident_master_faiss list
+    python index_manager.py ../accident_master_faiss add 2023 [--table workspace.fars_database.accident_master]
+    python index_manager.py ../accident_master_faiss remove 2019
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+from typing import Dict, List, Optional
+
+from langchain_core.documents import Document
+from langchain_community.vectorstores import FAISS
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from embedding_cache import CachedEmbeddings
+from embedding_engine import ParallelEmbeddings
+from index_types import supports_remove
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "User Interface", "Backend"))
+from vector_store import load_editable_vectorstore, save_docstore
+from sparse_index import build_for_vectorstore as build_sparse_index
+
+DEFAULT_EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+KEEP_VERSIONS = 2
+
+
+# ------------------------------------------------------------------------
+# Version resolution (also used by readers)
+# ------------------------------------------------------------------------
+def read_current_version(index_path: str) -> Optional[str]:
+    try:
+        with open(os.path.join(index_path, "CURRENT")) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def resolve_index_path(index_path: str) -> str:
+    """Directory holding the live index.faiss / index.pkl for an index."""
+    version = read_current_version(index_path)
+    return os.path.join(index_path, "versions", version) if version else index_path
+
+
+# ------------------------------------------------------------------------
+# Manager
+# ------------------------------------------------------------------------
+class PartitionedIndexManager:
+    def __init__(
+        self,
+        index_path: str,
+        embeddings=None,
+        embedding_model: str = DEFAULT_EMBEDDING_MODEL,
+        chunk_size: int = 3000,
+        chunk_overlap: int = 300,
+        embedding_backend: str = "huggingface",
+        check_embeddings: bool = True,
+    ):
+        self.index_path = index_path
+        self.check_embeddings = check_embeddings
+        self.embedding_model = embedding_model
+        self.embeddings = embeddings or CachedEmbeddings(
+            ParallelEmbeddings(embedding_backend, embedding_model), model_name=embedding_model
+        )
+        self.splitter = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            length_function=len,
+        )
+        self.vectorstore: Optional[FAISS] = None
+        self.manifest = {"version": 0, "embedding_model": embedding_model, "partitions": {}}
+        self._load()
+
+    # ----------------- load / save -----------------
+    def _load(self):
+        live_path = resolve_index_path(self.index_path)
+        if not os.path.exists(os.path.join(live_path, "index.faiss")):
+            return
+
+        if os.path.exists(os.path.join(live_path, "index.pkl")):
+            self.vectorstore = FAISS.load_local(
+                live_path, embeddings=self.embeddings, allow_dangerous_deserialization=True
+            )
+        else:
+            # Streamed builds write only index.faiss and docs.sqlite
+            self.vectorstore = load_editable_vectorstore(live_path, self.embeddings)
+        manifest_path = os.path.join(live_path, "manifest.json")
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                self.manifest = json.load(f)
+        else:
+            print(f"{self.index_path} has no manifest; existing vectors are not tracked by partition.")
+        if self.check_embeddings:
+            self._check_embeddings()
+
+    def _check_embeddings(self):
+        """Fail before any FAISS call when the index was built with other embeddings."""
+        built_with = self.manifest.get("embedding_model")
+        if built_with and built_with != self.embedding_model:
+            raise ValueError(
+                f"{self.index_path} was built with embedding model '{built_with}', "
+                f"not '{self.embedding_model}'; pass the same model (and backend)"
+            )
+        dim = len(self.embeddings.embed_query("dimension check"))
+        if self.vectorstore.index.d != dim:
+            raise ValueError(
+                f"{self.index_path} holds {self.vectorstore.index.d}-dim vectors but "
+                f"'{self.embedding_model}' produces {dim}-dim vectors; pass the model the index was built with"
+            )
+
+    def untracked_vectors(self) -> int:
+        """Vectors in the index that no partition accounts for (legacy, pre-manifest builds)."""
+        if self.vectorstore is None:
+            return 0
+        tracked = sum(len(info["ids"]) for info in self.manifest["partitions"].values())
+        return self.vectorstore.index.ntotal - tracked
+
+    def save(self) -> str:
+        """Write a new version and atomically make it live. Returns the version name."""
+        if self.vectorstore is None:
+            raise ValueError("Nothing to save: the index is empty")
+
+        self.manifest["version"] += 1
+        self.manifest["updated"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+        version = f"v{self.manifest['version']:06d}"
+
+        versions_dir = os.path.join(self.index_path, "versions")
+        final_dir = os.path.join(versions_dir, version)
+        tmp_dir = final_dir + ".tmp"
+        os.makedirs(versions_dir, exist_ok=True)
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        # index.pkl keeps the version editable here; docs.sqlite and sparse/ are what the backend serves
+        self.vectorstore.save_local(tmp_dir)
+        save_docstore(self.vectorstore, tmp_dir)
+        build_sparse_index(self.vectorstore, tmp_dir)
+        with open(os.path.join(tmp_dir, "manifest.json"), "w") as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(tmp_dir, final_dir)
+
+        # Flip the pointer last: readers switch to the new version in one step
+        current_tmp = os.path.join(self.index_path, "CURRENT.tmp")
+        with open(current_tmp, "w") as f:
+            f.write(version)
+        os.replace(current_tmp, os.path.join(self.index_path, "CURRENT"))
+
+        self._prune(versions_dir, version)
+        print(f"Saved {self.index_path} as {version}")
+        return version
+
+    def _prune(self, versions_dir: str, live: str):
+        old = sorted(d for d in os.listdir(versions_dir) if d.startswith("v") and not d.endswith(".tmp"))
+        for name in old[:-KEEP_VERSIONS]:
+            if name != live:
+                shutil.rmtree(os.path.join(versions_dir, name), ignore_errors=True)
+
+    # ----------------- partitions -----------------
+    def partitions(self) -> Dict[str, int]:
+        return {year: len(info["ids"]) for year, info in sorted(self.manifest["partitions"].items())}
+
+    def remove_partition(self, year) -> int:
+        year = str(year)
+        info = self.manifest["partitions"].get(year)
+        if not info or self.vectorstore is None:
+            return 0
+        if not supports_remove(self.vectorstore.index):
+            raise ValueError(
+                f"{self.index_path} is an HNSW index, which cannot remove vectors; "
+                f"rebuild it with index_type 'flat' or 'ivfpq' to update YEAR {year}"
+            )
+        self.vectorstore.delete(info["ids"])
+        del self.manifest["partitions"][year]
+        print(f"Removed {len(info['ids'])} vectors for YEAR {year}")
+        return len(info["ids"])
+
+    def add_partition(self, year, docs: List[Document], allow_untracked: bool = False) -> int:
+        """
+        Add (or replace) one YEAR partition. Refused while the index holds
+        vectors outside any partition (a legacy build that already contains
+        every year), since the year would then be indexed twice, unless
+        allow_untracked is set.
+        """
+        year = str(year)
+        untracked = self.untracked_vectors()
+        if untracked and not allow_untracked:
+            raise ValueError(
+                f"{self.index_path} has {untracked} vectors not tracked by partition (built before the "
+                f"manifest existed) and may already contain YEAR {year}; rebuild it with partitions, "
+                f"or pass allow_untracked=True (--allow-untracked) to add anyway"
+            )
+        self.remove_partition(year)
+
+        chunks = self.splitter.split_documents(docs)
+        if not chunks:
+            return 0
+        for chunk in chunks:
+            chunk.metadata.setdefault("YEAR", int(year))
+        ids = [f"{year}:{i}" for i in range(len(chunks))]
+
+        if self.vectorstore is None:
+            self.vectorstore = FAISS.from_documents(chunks, self.embeddings, ids=ids)
+        else:
+            self.vectorstore.add_documents(chunks, ids=ids)
+
+        self.manifest["partitions"][year] = {"ids": ids, "added": time.strftime("%Y-%m-%dT%H:%M:%S")}
+        print(f"Added {len(ids)} vectors for YEAR {year}")
+        return len(ids)
+
+
+# ------------------------------------------------------------------------
+# CLI
+# ------------------------------------------------------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage YEAR partitions of a FARS FAISS index")
+    parser.add_argument("index_path")
+    parser.add_argument("action", choices=["list", "add", "remove"])
+    parser.add_argument("years", nargs="*", type=int)
+    parser.add_argument("--table", default="workspace.fars_database.accident_master")
+    parser.add_argument("--backend", choices=["huggingface", "ollama"], default="huggingface")
+    parser.add_argument("--embedding-model", default=DEFAULT_EMBEDDING_MODEL)
+    parser.add_argument("--allow-untracked", action="store_true",
+                        help="add partitions to an index that has vectors outside any partition")
+    args = parser.parse_args()
+
+    # Listing never embeds, so it works without knowing the index's model
+    manager = PartitionedIndexManager(
+        args.index_path, embedding_model=args.embedding_model, embedding_backend=args.backend,
+        check_embeddings=args.action != "list",
+    )
+
+    if args.action == "list":
+        print(f"Version: {manager.manifest['version']}")
+        for year, count in manager.partitions().items():
+            print(f"  {year}: {count} vectors")
+        if manager.untracked_vectors():
+            print(f"  untracked: {manager.untracked_vectors()} vectors (no partition)")
+
+    else:
+        for year in args.years:
+            if args.action == "add":
+                from build_vectorstore import iter_table_batches, arrow_to_documents, RowSerializer
+
+                serializer = RowSerializer.for_table(args.table)
+                docs = []
+                for batch in iter_table_batches(args.table, where=f"YEAR = {year}"):
+                    docs.extend(arrow_to_documents(batch, serializer=serializer))
+                manager.add_partition(year, docs, allow_untracked=args.allow_untracked)
+            else:
+                manager.remove_partition(year)
+        manager.save()
@@ -0,0 +1,280 @@
+# index_types.py
+"""
+Approximate FAISS index types for the crash vectorstores.
+
+LangChain's FAISS.from_documents always builds an exact flat index, whose
+query time and memory grow linearly with the corpus. This module converts a
+built (flat) vectorstore into a compressed approximate index:
+
+- "hnsw":  IndexHNSWFlat  - graph search, millisecond queries, full vectors kept
+- "ivfpq": IndexIVFPQ     - inverted lists + product quantization, trained on a
+                            random sample; typically 20-30x smaller than flat
+
+The docstore and id mapping are untouched, so the converted vectorstore is
+saved and loaded exactly as before (the CLI copies docs.sqlite and sparse/
+next to the new index.faiss, or writes them for save_local output), and search
+parameters (efSearch, nprobe) are stored inside index.faiss. The converted
+index keeps the exact index's metric (L2, or inner product for stores built
+with DistanceStrategy.MAX_INNER_PRODUCT).
+
+Limits:
+- HNSW graphs cannot remove vectors (faiss has no remove_ids for them), so
+  vectorstore.delete() fails; index_manager refuses to remove or replace a
+  YEAR partition of an HNSW index. Use "flat" or "ivfpq" for indexes that
+  are updated by partition.
+- IVF-PQ needs at least 2**nbits training vectors; with fewer vectors nbits
+  is lowered to fit (PQ codes get coarser, which hardly matters at that size).
+
+CLI (convert a saved index and print a recall-vs-latency report):
+    python index_types.py ../accident_master_faiss ../accident_master_ivfpq --type ivfpq --nlist 1024
+"""
+
+import argparse
+import math
+import os
+import shutil
+import time
+from typing import Dict, List, Optional
+
+import faiss
+import numpy as np
+
+INDEX_TYPES = ("flat", "hnsw", "ivfpq")
+
+# Defaults per index type; anything here can be overridden by keyword
+DEFAULT_PARAMS: Dict[str, dict] = {
+    "flat": {},
+    "hnsw": {"M": 32, "ef_construction": 200, "ef_search": 64},
+    "ivfpq": {"nlist": None, "m": None, "nbits": 8, "nprobe": 16, "train_size": 100_000},
+}
+
+# Search-time settings swept by the recall report
+SWEEPS = {
+    "hnsw": ("ef_search", [16, 32, 64, 128, 256]),
+    "ivfpq": ("nprobe", [1, 4, 8, 16, 32, 64]),
+}
+
+
+# ------------------------------------------------------------------------
+# Vector access
+# ------------------------------------------------------------------------
+def index_vectors(index) -> np.ndarray:
+    """All vectors stored in an exact (flat) index, in id order."""
+    return index.reconstruct_n(0, index.ntotal)
+
+def set_search_param(index, index_type: str, value: int):
+    if index_type == "hnsw":
+        index.hnsw.efSearch = value
+    elif index_type == "ivfpq":
+        index.nprobe = value
+
+def index_size_bytes(index) -> int:
+    return len(faiss.serialize_index(index))
+
+def supports_remove(index) -> bool:
+    """Whether index.remove_ids works (vectorstore.delete relies on it)."""
+    return not isinstance(faiss.downcast_index(index), faiss.IndexHNSW)
+
+
+# ------------------------------------------------------------------------
+# Building
+# ------------------------------------------------------------------------
+def build_index(vectors: np.ndarray, index_type: str = "flat", metric: int = faiss.METRIC_L2, **params):
+    """
+    Build (and train, if needed) a FAISS index over `vectors`. `metric` is
+    faiss.METRIC_L2 or faiss.METRIC_INNER_PRODUCT.
+    """
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type '{index_type}', expected one of {INDEX_TYPES}")
+
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    n, dim = vectors.shape
+    p = {**DEFAULT_PARAMS[index_type], **params}
+
+    if index_type == "flat":
+        index = faiss.IndexFlatIP(dim) if metric == faiss.METRIC_INNER_PRODUCT else faiss.IndexFlatL2(dim)
+
+    elif index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, p["M"], metric)
+        index.hnsw.efConstruction = p["ef_construction"]
+        index.hnsw.efSearch = p["ef_search"]
+
+    else:  # ivfpq
+        # FAISS wants roughly 39 training points per centroid
+        nlist = p["nlist"] or max(1, min(int(4 * math.sqrt(n)), n // 39))
+        m = p["m"] or max(1, dim // 8)
+        if dim % m:
+            raise ValueError(f"PQ sub-quantizers (m={m}) must divide the vector dimension ({dim})")
+
+        # Each PQ codebook has 2**nbits centroids and needs as many training vectors
+        nbits = p["nbits"]
+        if n < 2 ** nbits:
+            nbits = max(1, int(math.log2(max(n, 2))))
+            print(f"Only {n} vectors: using nbits={nbits} instead of {p['nbits']}")
+
+        quantizer = faiss.IndexFlatIP(dim) if metric == faiss.METRIC_INNER_PRODUCT else faiss.IndexFlatL2(dim)
+        index = faiss.IndexIVFPQ(quantizer, dim, nlist, m, nbits, metric)
+
+        train_size = min(n, max(p["train_size"], nlist * 39, 2 ** nbits))
+        sample = vectors[np.random.default_rng(0).choice(n, size=train_size, replace=False)]
+        print(f"Training IVF-PQ (nlist={nlist}, m={m}, nbits={nbits}) on {train_size} vectors...")
+        start = time.perf_counter()
+        index.train(sample)
+        print(f"Trained in {time.perf_counter() - start:.1f}s")
+        index.nprobe = min(p["nprobe"], nlist)
+
+    start = time.perf_counter()
+    for i in range(0, n, 100_000):
+        index.add(vectors[i:i + 100_000])
+    print(f"Added {n} vectors to {index_type} index in {time.perf_counter() - start:.1f}s")
+    return index
+
+def compress_vectorstore(vectorstore, index_type: str = "flat", report: bool = True, **params):
+    """
+    Replace a LangChain FAISS vectorstore's exact index with `index_type`.
+    Positions are preserved, so index_to_docstore_id stays valid.
+    """
+    if index_type == "flat":
+        return vectorstore
+
+    exact = vectorstore.index
+    vectors = index_vectors(exact)
+    # Same metric as the exact index LangChain built for the store's distance_strategy
+    approx = build_index(vectors, index_type, metric=exact.metric_type, **params)
+    if report:
+        print(format_recall_report(recall_report(exact, approx, index_type, vectors)))
+
+    vectorstore.index = approx
+    return vectorstore
+
+
+# ------------------------------------------------------------------------
+# Recall vs latency
+# ------------------------------------------------------------------------
+def recall_report(
+    exact,
+    approx,
+    index_type: str,
+    vectors: Optional[np.ndarray] = None,
+    queries: Optional[np.ndarray] = None,
+    num_queries: int = 500,
+    k: int = 10,
+    sweep: Optional[List[int]] = None,
+) -> dict:
+    """
+    Compare `approx` against the exact index: recall@k and mean query latency
+    for each search setting in the sweep, plus both index sizes.
+    Queries default to a random sample of the indexed vectors.
+    """
+    if queries is None:
+        if vectors is None:
+            vectors = index_vectors(exact)
+        rng = np.random.default_rng(1)
+        queries = vectors[rng.choice(len(vectors), size=min(num_queries, len(vectors)), replace=False)]
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+
+    start = time.perf_counter()
+    _, truth = exact.search(queries, k)
+    exact_ms = (time.perf_counter() - start) * 1000.0 / len(queries)
+
+    param, values = SWEEPS.get(index_type, (None, [None]))
+    values = sweep or values
+    original = approx.hnsw.efSearch if index_type == "hnsw" else getattr(approx, "nprobe", None)
+
+    rows = []
+    for value in values:
+        if param:
+            set_search_param(approx, index_type, value)
+        start = time.perf_counter()
+        _, found = approx.search(queries, k)
+        ms = (time.perf_counter() - start) * 1000.0 / len(queries)
+
+        hits = sum(len(set(f[f >= 0]) & set(t[t >= 0])) for f, t in zip(found, truth))
+        rows.append({param or "setting": value, "recall": hits / truth.size, "ms_per_query": ms})
+
+    if param:
+        set_search_param(approx, index_type, original)
+
+    return {
+        "index_type": index_type,
+        "k": k,
+        "queries": len(queries),
+        "exact_ms_per_query": exact_ms,
+        "exact_bytes": index_size_bytes(exact),
+        "approx_bytes": index_size_bytes(approx),
+        "param": param,
+        "rows": rows,
+    }
+
+def format_recall_report(report: dict) -> str:
+    param = report["param"] or "setting"
+    ratio = report["approx_bytes"] / max(report["exact_bytes"], 1)
+    lines = [
+        f"Recall vs latency: {report['index_type']} (k={report['k']}, {report['queries']} queries)",
+        f"  exact:  {report['exact_ms_per_query']:.3f} ms/query, {report['exact_bytes'] / 1e6:.1f} MB",
+        f"  approx: {report['approx_bytes'] / 1e6:.1f} MB ({ratio:.0%} of exact)",
+        f"  {param:>10} {'recall@k':>9} {'ms/query':>9} {'speedup':>8}",
+    ]
+    for row in report["rows"]:
+        speedup = report["exact_ms_per_query"] / max(row["ms_per_query"], 1e-9)
+        lines.append(f"  {str(row[param]):>10} {row['recall']:>9.3f} {row['ms_per_query']:>9.3f} {speedup:>7.1f}x")
+    return "\n".join(lines)
+
+
+# ------------------------------------------------------------------------
+# CLI: convert a saved LangChain FAISS directory
+# ------------------------------------------------------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert a saved FAISS vectorstore to an approximate index")
+    parser.add_argument("source")
+    parser.add_argument("dest")
+    parser.add_argument("--type", choices=INDEX_TYPES[1:], default="ivfpq")
+    parser.add_argument("--M", type=int)
+    parser.add_argument("--ef-construction", type=int)
+    parser.add_argument("--ef-search", type=int)
+    parser.add_argument("--nlist", type=int)
+    parser.add_argument("--m", type=int)
+    parser.add_argument("--nbits", type=int)
+    parser.add_argument("--nprobe", type=int)
+    parser.add_argument("--train-size", type=int)
+    args = parser.parse_args()
+
+    params = {
+        name: value for name, value in vars(args).items()
+        if name in DEFAULT_PARAMS[args.type] and value is not None
+    }
+
+    exact = faiss.read_index(os.path.join(args.source, "index.faiss"))
+    vectors = index_vectors(exact)
+    approx = build_index(vectors, args.type, metric=exact.metric_type, **params)
+    print(format_recall_report(recall_report(exact, approx, args.type, vectors)))
+
+    import sys
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "User Interface", "Backend"))
+    from vector_store import DOCSTORE_FILE, load_vectorstore, save_docstore
+    from sparse_index import SPARSE_DIR, build_for_vectorstore as build_sparse_index
+
+    # The docstore and BM25 index are keyed by position and do not change
+    os.makedirs(args.dest, exist_ok=True)
+    faiss.write_index(approx, os.path.join(args.dest, "index.faiss"))
+    source_pkl = os.path.join(args.source, "index.pkl")
+    if os.path.exists(source_pkl):
+        shutil.copy(source_pkl, os.path.join(args.dest, "index.pkl"))
+
+    source_db = os.path.join(args.source, DOCSTORE_FILE)
+    source_sparse = os.path.join(args.source, SPARSE_DIR)
+    if os.path.exists(source_db):
+        shutil.copy(source_db, os.path.join(args.dest, DOCSTORE_FILE))
+    if os.path.isdir(source_sparse):
+        shutil.copytree(source_sparse, os.path.join(args.dest, SPARSE_DIR), dirs_exist_ok=True)
+    if not os.path.exists(source_db) or not os.path.isdir(source_sparse):
+        # save_local output (or no BM25 yet): write the missing files from the source docstore
+        class _NoEmbeddings:
+            pass
+
+        vectorstore = load_vectorstore(args.source, _NoEmbeddings())
+        if not os.path.exists(source_db):
+            save_docstore(vectorstore, args.dest)
+        if not os.path.isdir(source_sparse):
+            build_sparse_index(vectorstore, args.dest)
+    print(f"Saved {args.type} index to {args.dest}")
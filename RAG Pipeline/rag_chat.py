@@ -4,12 +4,18 @@ Interactive RAG QA using pre-built FAISS vectorstore and a local Ollama LLM.
 Uses SentenceTransformers 'all-MiniLM-L6-v2' embeddings for FAISS loading.
 """
 
-from langchain_community.vectorstores import FAISS
+import os
+import sys
 from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain_ollama import ChatOllama
 from langchain_core.documents import Document
 from typing import List, Tuple
 
+# Shared persistent LLM response cache and FAISS loading live with the backend modules
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "User Interface", "Backend"))
+from llm_cache import get_llm_cache
+from vector_store import load_vectorstore
+
 
 class SimpleRAGQA:
     def __init__(self, retriever, llm: ChatOllama):
@@ -51,12 +57,8 @@ def build_simple_rag_qa(
         model_name="sentence-transformers/all-MiniLM-L6-v2"
     )
 
-    # Load FAISS index with embeddings
-    vectorstore = FAISS.load_local(
-        vectorstore_path,
-        embeddings=embeddings,
-        allow_dangerous_deserialization=True   # needed for FAISS
-    )
+    # Load FAISS index (memory-mapped, documents fetched from docs.sqlite on demand)
+    vectorstore = load_vectorstore(vectorstore_path, embeddings)
 
     # Build retriever
     retriever = vectorstore.as_retriever(
@@ -65,7 +67,9 @@ def build_simple_rag_qa(
     )
 
     # Load Ollama LLM
-    llm = ChatOllama(model=llm_model, temperature=temperature)
+    # Deterministic at temperature 0, so repeated questions are served from cache
+    cache = get_llm_cache() if temperature == 0 else None
+    llm = ChatOllama(model=llm_model, temperature=temperature, cache=cache)
 
     return SimpleRAGQA(retriever=retriever, llm=llm)
 
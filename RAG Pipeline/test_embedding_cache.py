@@ -0,0 +1,38 @@
+import os
+
+import numpy as np
+
+from embedding_cache import EmbeddingCache
+
+
+def test_append_after_partial_row(tmp_path):
+    cache = EmbeddingCache("test-model", cache_dir=str(tmp_path))
+    first = np.arange(6, dtype=np.float32).reshape(2, 3)
+    rows = cache.add([b"a", b"b"], first)
+
+    # An interrupted write leaves half a row at the end of the matrix
+    with open(cache.vectors_path, "ab") as f:
+        f.write(np.float32([99, 99]).tobytes())
+    assert len(cache) == 2
+
+    second = np.float32([[10, 11, 12], [13, 14, 15]])
+    rows.update(cache.add([b"c", b"d"], second))
+
+    assert os.path.getsize(cache.vectors_path) == 4 * 3 * 4
+    assert rows == {b"a": 0, b"b": 1, b"c": 2, b"d": 3}
+    np.testing.assert_array_equal(cache.get([rows[k] for k in (b"a", b"b")]), first)
+    np.testing.assert_array_equal(cache.get([rows[k] for k in (b"c", b"d")]), second)
+    cache.close()
+
+
+def test_reopen_reads_same_vectors(tmp_path):
+    cache = EmbeddingCache("test-model", cache_dir=str(tmp_path))
+    vectors = np.random.default_rng(0).random((5, 4), dtype=np.float32)
+    keys = [EmbeddingCache.text_key(f"text {i}") for i in range(5)]
+    cache.add(keys, vectors)
+    cache.close()
+
+    reopened = EmbeddingCache("test-model", cache_dir=str(tmp_path))
+    rows = reopened.lookup(keys)
+    np.testing.assert_array_equal(reopened.get([rows[k] for k in keys]), vectors)
+    reopened.close()
@@ -0,0 +1,38 @@
+import pandas as pd
+import pyarrow as pa
+
+from build_vectorstore import RowSerializer, arrow_to_documents, frame_metadata
+from metadata_loader import YearCodebook
+
+# WEATHER 0 was "No Additional Atmospheric Conditions" until 2019 and is unused afterwards
+CODEBOOK = pd.DataFrame({
+    "table": ["accident"] * 3,
+    "column": ["WEATHER"] * 3,
+    "code": ["0", "0", "2"],
+    "value_label": ["No Additional Atmospheric Conditions", "Clear Later", "Rain"],
+    "2019": [1, None, 1],
+    "2020": [None, 1, 1],
+})
+COLUMN_METADATA = {"accident": {"WEATHER": {"codes": {"0": "Clear Later", "2": "Rain"}}}}
+
+
+def serializer():
+    return RowSerializer("accident", COLUMN_METADATA, YearCodebook(CODEBOOK))
+
+
+def test_codes_decode_with_the_rows_year():
+    df = pd.DataFrame({"YEAR": [2019, 2020, 2010], "WEATHER": [0, 0, 2]})
+    texts = serializer().serialize(df).tolist()
+    assert "WEATHER: No Additional Atmospheric Conditions (0)" in texts[0]
+    assert "WEATHER: Clear Later (0)" in texts[1]
+    # Years outside the codebook fall back to the all-years map
+    assert "WEATHER: Rain (2)" in texts[2]
+
+
+def test_rows_without_metadata_columns_still_become_documents():
+    df = pd.DataFrame({"COUNTYNAME": ["TRAVIS", "HARRIS"]})
+    assert frame_metadata(df) == [{}, {}]
+    assert frame_metadata(df, id_col="COUNTYNAME") == [{"id": "TRAVIS"}, {"id": "HARRIS"}]
+
+    docs = arrow_to_documents(pa.Table.from_pandas(df), serializer=serializer())
+    assert [d.page_content for d in docs] == ["COUNTYNAME: TRAVIS", "COUNTYNAME: HARRIS"]
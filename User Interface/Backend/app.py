@@ -1,11 +1,23 @@
-from flask import Flask, request
+import json
+import time
+from flask import Flask, Response, request, stream_with_context
 from flask.json import jsonify
 from flask_cors import CORS
 import logging
 import pandas as pd
-from orchestration import answer_question
+from orchestration import answer_question, answer_question_stream
+from registry import registry
+from tracing import start_trace, span, export_trace
+from llm_gateway import gateway
+from llm_cache import get_llm_cache
+from model_tiers import tier_stats
 
-def create_app():
+def create_app(warm_up: bool = False):
+    """
+    Build the Flask app. Models and indexes load lazily on first request;
+    pass warm_up=True to start loading them in the background right away
+    (readiness is reported on /health).
+    """
     app = Flask(__name__)
     CORS(app, resources={r"/*": {"origins": "*"}})
     
@@ -16,56 +28,90 @@ def create_app():
     )
     logger = logging.getLogger(__name__)
 
+    if warm_up:
+        registry.warm_up_async()
+
     @app.route("/health", methods=["GET"])
     def health():
-        return {"status": "ok", "backend": "databricks-sql"}, 200
+        return {
+            "status": "ok",
+            "backend": "databricks-sql",
+            "ready": registry.is_ready(),
+            "resources": registry.status(),
+        }, 200
+
+    def build_response(result):
+        """Convert an orchestration result into the JSON body sent to the frontend."""
+        # If SQL-only or BOTH, `ask_fars_database()` returns a dict
+        if isinstance(result, dict):
+            df = result.get("results", pd.DataFrame())
+            return {
+                "query": result.get("query", ""),
+                "columns": list(df.columns),
+                "rows": df.fillna("").astype(str).values.tolist(),
+                "answer": result.get("answer", ""),
+                "row_count": len(df),
+            }
+
+        # If RAG-only or a text explanation, it's a plain string
+        if isinstance(result, str):
+            return {
+                "query": None,
+                "columns": [],
+                "rows": [],
+                "answer": result,
+                "row_count": 0
+            }
+
+        return None
+
+    @app.route("/metrics", methods=["GET"])
+    def metrics():
+        # Per-model Ollama queue depth, queue time and coalescing counters
+        cache = get_llm_cache()
+        return {
+            "llm": gateway.metrics(),
+            "llm_cache": cache.stats() if cache else None,
+            "tiers": tier_stats.summary(),
+        }, 200
 
     @app.route("/query", methods=["POST"])
     def query():
         try:
             payload = request.get_json(force=True)
             question = payload.get("query") or payload.get("question")
+            debug = bool(payload.get("debug"))
 
             if not question:
                 return jsonify({"error": "Missing 'query' field"}), 400
 
             logger.info(f"Received question: {question}")
 
-            # NEW: run hybrid SQL+RAG orchestration
-            result = answer_question(question)
-
-            # Handle different output shapes
-            # If SQL-only or BOTH, `ask_fars_database()` returns a dict
-            if isinstance(result, dict):
-                sql_query = result.get("query", "")
-                df = result.get("results", pd.DataFrame())
-                nl_answer = result.get("answer", "")
-
-                # Convert dataframe to JSON
-                json_output = {
-                    "query": sql_query,
-                    "columns": list(df.columns),
-                    "rows": df.fillna("").astype(str).values.tolist(),
-                    "answer": nl_answer,
-                    "row_count": len(df),
-                }
-                return jsonify(json_output), 200
-
-            # If RAG-only or a text explanation, it's a plain string
-            if isinstance(result, str):
+            with start_trace("query") as trace:
+                # NEW: run hybrid SQL+RAG orchestration
+                result = answer_question(question)
+
+                with span("json_serialization"):
+                    json_output = build_response(result)
+                    if json_output is not None:
+                        response = jsonify(json_output)
+
+            export_trace(trace)
+            logger.info(f"Answered in {trace.root.duration_ms:.0f} ms")
+
+            if json_output is None:
                 return jsonify({
-                    "query": None,
-                    "columns": [],
-                    "rows": [],
-                    "answer": result,
-                    "row_count": 0
-                }), 200
-
-            # Fallback
-            return jsonify({
-                "error": "Unexpected result type",
-                "details": str(type(result))
-            }), 500
+                    "error": "Unexpected result type",
+                    "details": str(type(result))
+                }), 500
+
+            # Optional span tree for latency debugging; rebuilt so the
+            # serialization span itself is included
+            if debug:
+                json_output["debug"] = {"trace": trace.to_dict()}
+                response = jsonify(json_output)
+
+            return response, 200
 
         except Exception as e:
             logger.exception("Unexpected server error")
@@ -74,11 +120,52 @@ def create_app():
                 "details": str(e)
             }), 500
 
+    @app.route("/query/stream", methods=["GET", "POST"])
+    def query_stream():
+        """
+        Server-sent events version of /query. Emits, in order:
+          route -> sql -> rows -> token* -> answer   (SQL route)
+          route -> token* -> answer                  (RAG route)
+        or an `error` event, then a final `done` event. Each payload carries
+        `elapsed_ms` since the request arrived. GET takes ?query=..., POST takes
+        the same JSON body as /query.
+        """
+        if request.method == "GET":
+            question = request.args.get("query") or request.args.get("question")
+        else:
+            payload = request.get_json(force=True, silent=True) or {}
+            question = payload.get("query") or payload.get("question")
+
+        if not question:
+            return jsonify({"error": "Missing 'query' field"}), 400
+
+        logger.info(f"Received streaming question: {question}")
+        start = time.perf_counter()
+
+        def sse(event, data):
+            data = dict(data, elapsed_ms=round((time.perf_counter() - start) * 1000))
+            return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+        def generate():
+            try:
+                for event, data in answer_question_stream(question):
+                    yield sse(event, data)
+            except Exception as e:
+                logger.exception("Unexpected streaming error")
+                yield sse("error", {"error": "Internal server error", "details": str(e)})
+            yield sse("done", {})
+
+        return Response(
+            stream_with_context(generate()),
+            mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
     return app
 
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)
-    app = create_app()
+    app = create_app(warm_up=True)
     # Disable reloader to avoid double LLM initialization
     app.run(host="0.0.0.0", port=5000, debug=True, use_reloader=False)
\ No newline at end of file
@@ -0,0 +1,111 @@
+"""
+Embedding retrieval of relevant columns from codebook definitions.
+
+KEYWORD_MAPPINGS (metadata_extractor) covers a few dozen hand-picked columns;
+a question about travel speed, automated driving or license status matches
+none of them and gets no metadata. ColumnRetriever embeds one short text per
+queryable column (name, codebook label/definition and a few value labels) and
+returns the columns closest to the question:
+
+    "how fast were vehicles going before the crash" -> TRAV_SP, VSPD_LIM, ...
+
+The column vectors are computed once and cached as a codebook snapshot
+(metadata_loader.load_snapshot), so a worker start only embeds them again when
+the codebook, the schema or the embedding model changes. A lookup is one query
+embedding plus a matrix-vector product over ~200 rows.
+"""
+
+import hashlib
+import logging
+import re
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from metadata_loader import load_snapshot
+
+logger = logging.getLogger(__name__)
+
+MAX_LABELS_PER_COLUMN = 8
+MAX_DESCRIPTION_CHARS = 300
+
+
+def column_text(column: str, table: str, info: Dict) -> str:
+    """Text embedded for one column: its label, the start of its definition and a few values."""
+    # Definitions run to several paragraphs; the first sentences carry the meaning
+    description = info.get("description", "")[:MAX_DESCRIPTION_CHARS]
+    values = [label for label in info.get("codes", {}).values()
+              if "unknown" not in label.lower() and "not reported" not in label.lower()]
+    text = f"{info.get('label', column)} ({table} {column}). {description}"
+    if values:
+        text = f"{text.rstrip('. ')}. Values: {', '.join(values[:MAX_LABELS_PER_COLUMN])}"
+    return text
+
+
+class ColumnRetriever:
+    def __init__(
+        self,
+        column_metadata: Dict[str, Dict[str, Dict]],
+        embeddings,
+        schema: Optional[Dict[str, Iterable[str]]] = None,
+        csv_path: Optional[str] = None,
+        model_name: Optional[str] = None,
+    ):
+        """
+        column_metadata: load_fars_codebook output
+        embeddings: LangChain embeddings (the backend's registry "embeddings")
+        schema: SQL table name -> queryable columns; defaults to every codebook column
+        csv_path: codebook CSV, enables the cached vector snapshot
+        """
+        self.embeddings = embeddings
+        self.keys: List[Tuple[str, str]] = []
+        texts = []
+        for table, columns in self._columns(column_metadata, schema):
+            for column in columns:
+                info = column_metadata.get(table, {}).get(column)
+                if info is None:
+                    continue
+                self.keys.append((table, column))
+                texts.append(column_text(column, table, info))
+
+        if csv_path:
+            model = model_name or getattr(embeddings, "model_name", type(embeddings).__name__)
+            digest = hashlib.sha256("\n".join([model] + texts).encode("utf-8")).hexdigest()[:12]
+            slug = re.sub(r"[^\w.-]+", "_", model)
+            name = f"column_vectors-{slug}-{digest}"
+            vectors = load_snapshot(
+                csv_path, name, lambda: self._embed(texts),
+                encode=lambda vectors: (None, {"vectors": vectors}),
+                decode=lambda payload, arrays: arrays["vectors"],
+            )
+        else:
+            vectors = self._embed(texts)
+        self.vectors = vectors
+        logger.info(f"Column retriever ready for {len(self.keys)} columns")
+
+    @staticmethod
+    def _columns(column_metadata, schema):
+        if schema is None:
+            return [(table, list(columns)) for table, columns in column_metadata.items()]
+        # "workspace.fars_database.accident_master" -> codebook table "accident"
+        return [(name.rsplit(".", 1)[-1].replace("_master", ""), list(columns)) for name, columns in schema.items()]
+
+    def _embed(self, texts: List[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        vectors = np.asarray(self.embeddings.embed_documents(texts), dtype=np.float32)
+        # Unit length, so a dot product is the cosine similarity
+        return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+    def top_columns(self, question: str, k: int = 5, min_score: float = 0.35) -> List[Tuple[str, str, float]]:
+        """Up to k (table, column, cosine score) most related to the question, best first."""
+        if not len(self.keys) or not question.strip():
+            return []
+        query = np.asarray(self.embeddings.embed_query(question), dtype=np.float32)
+        query /= max(float(np.linalg.norm(query)), 1e-12)
+        scores = self.vectors @ query
+
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(*self.keys[i], float(scores[i])) for i in top if scores[i] >= min_score]
@@ -0,0 +1,368 @@
+"""
+Reverse codebook index: value labels -> (table, column, code).
+
+The SQL prompt used to list up to 20 code/label pairs per matched column and
+leave it to the LLM to work out that "rainy" means WEATHER = 2. LabelIndex
+resolves such phrases up front:
+
+    "fatal crashes on rainy nights in Virginia"
+        -> 'rainy'    accident_master.WEATHER = 2          (Rain)
+           'Virginia' accident_master.STATE = 51           (Virginia)
+
+Labels are normalized (lowercase, light suffix stemming; adjectives such as
+"rainy" / "foggy" fall back to "rain" / "fog" on the question side) and stored in a
+token trie, both whole ("Dark - Not Lighted") and split into their parts
+("dark", "not lighted", which resolves to every code containing it). Question
+tokens missing from the label vocabulary are corrected through a character
+trigram index ("pedestrain" -> "pedestrian"). A lookup is one walk over the
+question's tokens, a few microseconds per token.
+"""
+
+import logging
+import re
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from query_filters import GENERIC_LABELS, CASE_SENSITIVE_LABELS
+
+logger = logging.getLogger(__name__)
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+# Separators between the parts of a compound label: "Fog, Smog, Smoke", "Sleet or Hail",
+# "Dark - Not Lighted", "Fatal Injury (K)"
+PART_SPLIT_RE = re.compile(r",|;|/|\(|\)|\s-\s|\bor\b")
+
+# Single words that are too common in questions to stand for a coded value
+STOP_WORDS = {
+    "a", "an", "and", "are", "as", "at", "by", "for", "from", "how", "in", "is", "it", "many",
+    "not", "of", "on", "the", "to", "was", "were", "what", "when", "where", "which", "with",
+    "accident", "crash", "death", "driver", "fatal", "fatality", "injury", "involved",
+    "number", "occupant", "person", "road", "state", "total", "type", "vehicle", "year",
+}
+
+# Typo correction: edit distance 1 from 6 characters, 2 from 9
+FUZZY_DISTANCES = ((9, 2), (6, 1))
+
+TABLE_PRIORITY = {"accident": 0.3, "person": 0.2, "vehicle": 0.1}
+
+
+# ---------------- Normalization ----------------
+def stem(token: str) -> str:
+    """Light suffix stripping, applied identically to labels and questions."""
+    if token.endswith("ies") and len(token) > 4:
+        token = token[:-3] + "y"
+    elif re.search(r"(sh|ch|x|ss|us)es$", token):
+        token = token[:-2]
+    elif token.endswith("s") and not token.endswith(("ss", "us", "is")) and len(token) > 3:
+        token = token[:-1]
+
+    for suffix in ("ing", "ed"):
+        if token.endswith(suffix) and len(token) - len(suffix) >= 3:
+            token = _undouble(token[:-len(suffix)])
+            break
+    return token
+
+def _undouble(token: str) -> str:
+    # "runn" (running) -> "run"
+    if len(token) > 3 and token[-1] == token[-2] and token[-1] not in "aeiosl":
+        return token[:-1]
+    return token
+
+def stems(text: str) -> Tuple[str, ...]:
+    return tuple(stem(t) for t in TOKEN_RE.findall(text.lower()))
+
+def _trigrams(token: str) -> Set[str]:
+    padded = f"#{token}#"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def _max_distance(token: str) -> int:
+    return next((d for length, d in FUZZY_DISTANCES if len(token) >= length), 0)
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """Damerau-Levenshtein (optimal string alignment) distance, capped at limit + 1."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    prev2, prev = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        row = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            row[j] = min(prev[j] + 1, row[j - 1] + 1, prev[j - 1] + (a[i - 1] != b[j - 1]))
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                row[j] = min(row[j], prev2[j - 2] + 1)
+        if min(row) > limit:
+            return limit + 1
+        prev2, prev = prev, row
+    return prev[-1]
+
+def _is_proper_noun(question: str, start: int) -> bool:
+    """Capitalized and not the first word of a sentence: "crashes in Virginia"."""
+    if not question[start].isupper():
+        return False
+    before = question[:start].rstrip()
+    return bool(before) and before[-1] not in ".!?:"
+
+
+# ---------------- Results ----------------
+class Predicate(NamedTuple):
+    table: str            # SQL table, e.g. "accident_master"
+    column: str
+    codes: Tuple[str, ...]
+    labels: Tuple[str, ...]
+    score: float
+    whole: bool = True    # matched a whole label, not one part of a compound label
+    quoted: bool = False  # string column: values are SQL string literals
+
+    def sql(self) -> str:
+        values = [f"'{code}'" for code in self.codes] if self.quoted else list(self.codes)
+        if len(values) == 1:
+            return f"{self.table}.{self.column} = {values[0]}"
+        return f"{self.table}.{self.column} IN ({', '.join(values)})"
+
+
+class ValueMatch(NamedTuple):
+    phrase: str           # text of the question that matched
+    start: int
+    end: int
+    fuzzy: bool
+    candidates: List[Predicate]
+    proper_noun: bool = False  # capitalized mid-sentence ("in Virginia")
+
+
+# ---------------- Index ----------------
+class LabelIndex:
+    def __init__(
+        self,
+        column_metadata: Dict[str, Dict[str, Dict]],
+        schema: Dict[str, Iterable[str]],
+        string_columns: Optional[Dict[str, Iterable[str]]] = None,
+    ):
+        """
+        column_metadata: load_fars_codebook output
+        schema: SQL table name -> queryable columns (only those can be resolved)
+        string_columns: SQL table name -> columns compared as strings (quoted in Predicate.sql)
+        """
+        self.trie: Dict = {}
+        self._string_columns = {
+            (table.rsplit(".", 1)[-1], column)
+            for table, columns in (string_columns or {}).items() for column in columns
+        }
+        self.vocabulary: Set[str] = set()
+        self._case_sensitive = {stem(label.lower()) for label in CASE_SENSITIVE_LABELS}
+        entries = 0
+
+        for sql_table, columns in schema.items():
+            short_table = sql_table.rsplit(".", 1)[-1]
+            codebook_table = short_table.replace("_master", "")
+            table_meta = column_metadata.get(codebook_table, {})
+            for column in columns:
+                for code, label in table_meta.get(column, {}).get("codes", {}).items():
+                    for phrase, whole in self._phrases(label):
+                        self._insert(phrase, (short_table, codebook_table, column, code, label.strip(), whole))
+                        entries += 1
+
+        self.trigrams: Dict[str, Set[str]] = {}
+        for token in self.vocabulary:
+            if _max_distance(token):
+                for gram in _trigrams(token):
+                    self.trigrams.setdefault(gram, set()).add(token)
+
+        logger.info(f"Label index built with {entries} label phrases ({len(self.vocabulary)} distinct tokens)")
+
+    @staticmethod
+    def _phrases(label: str):
+        """(stems, is_whole_label) for a label and each of its parts."""
+        clean = label.strip()
+        lowered = clean.lower()
+        if lowered in GENERIC_LABELS or "unknown" in lowered or "not reported" in lowered:
+            return
+        parts = [stems(p) for p in PART_SPLIT_RE.split(clean)]
+        parts = [p for p in parts if p]
+        # A lone trailing word of a longer label ("Zone" in "In Parking Lane/Zone")
+        # says little; single-word parts count as the label's head ("Dark" in
+        # "Dark - Lighted") or when the label is a list of words ("Fog, Smog, Smoke")
+        word_list = all(len(p) == 1 for p in parts)
+        seen = set()
+        for k, (phrase, is_whole) in enumerate([(stems(clean), True)] + [(p, False) for p in parts]):
+            if not phrase or phrase in seen:
+                continue
+            seen.add(phrase)
+            if not is_whole and len(phrase) == 1 and k > 1 and not word_list:
+                continue
+            # Measurements and model variants ("0.08 % BAC", "182 lbs.") are not question values
+            if any(t.isdigit() or any(ch.isdigit() for ch in t) for t in phrase):
+                continue
+            if len(phrase) == 1 and (len(phrase[0]) < 3 or phrase[0] in STOP_WORDS):
+                continue
+            if " ".join(phrase) in GENERIC_LABELS:
+                continue
+            yield phrase, is_whole
+
+    def _insert(self, phrase: Tuple[str, ...], entry: tuple):
+        node = self.trie
+        for token in phrase:
+            node = node.setdefault(token, {})
+            self.vocabulary.add(token)
+        node.setdefault("", []).append(entry)
+
+    # ----------------- lookup -----------------
+    def _correct(self, token: str) -> Optional[str]:
+        """
+        Vocabulary token within the allowed edit distance ("pedestrain" ->
+        "pedestrian"). The trigram index shortlists tokens sharing at least a
+        third of the trigrams, so only a handful are compared.
+        """
+        limit = _max_distance(token)
+        grams = _trigrams(token)
+        counts: Dict[str, int] = {}
+        for gram in grams:
+            for candidate in self.trigrams.get(gram, ()):
+                counts[candidate] = counts.get(candidate, 0) + 1
+        best, best_distance = None, limit + 1
+        for candidate, shared in counts.items():
+            if 3 * shared < len(grams):
+                continue
+            distance = edit_distance(token, candidate, limit)
+            if distance < best_distance:
+                best, best_distance = candidate, distance
+        return best
+
+    def resolve(self, question: str, relevant_columns: Optional[Set[str]] = None) -> List[ValueMatch]:
+        """Label phrases found in the question, each with its candidate predicates (best first)."""
+        tokens = []
+        for match in TOKEN_RE.finditer(question.lower()):
+            token, fuzzy = stem(match.group(0)), False
+            if token in self._case_sensitive and question[match.start():match.end()] not in CASE_SENSITIVE_LABELS:
+                token = None  # "may" the verb, not May the month
+            elif token not in self.vocabulary and token.endswith("y") and _undouble(token[:-1]) in self.vocabulary:
+                token = _undouble(token[:-1])  # "rainy" -> "rain", "foggy" -> "fog"
+            elif token not in self.vocabulary and token not in STOP_WORDS and _max_distance(token):
+                corrected = self._correct(token)
+                if corrected:
+                    token, fuzzy = corrected, True
+            tokens.append((token, match.start(), match.end(), fuzzy))
+
+        matches = []
+        i = 0
+        while i < len(tokens):
+            # Longest label starting at token i ("west virginia" before "virginia")
+            node, last = self.trie, None
+            for j in range(i, len(tokens)):
+                node = node.get(tokens[j][0])
+                if node is None:
+                    break
+                if "" in node:
+                    last = (j, node[""])
+            if last is None:
+                i += 1
+                continue
+
+            j, entries = last
+            start, end = tokens[i][1], tokens[j][2]
+            fuzzy = any(t[3] for t in tokens[i:j + 1])
+            matches.append(ValueMatch(
+                question[start:end], start, end, fuzzy,
+                self._candidates(entries, fuzzy, relevant_columns or set()),
+                _is_proper_noun(question, start),
+            ))
+            i = j + 1
+        return matches
+
+    def _candidates(self, entries, fuzzy: bool, relevant_columns: Set[str]) -> List[Predicate]:
+        grouped: Dict[Tuple[str, str], dict] = {}
+        for short_table, codebook_table, column, code, label, whole in entries:
+            group = grouped.setdefault((short_table, column), {
+                "codebook_table": codebook_table, "codes": {}, "whole": False,
+            })
+            group["codes"].setdefault(code, label)
+            group["whole"] = group["whole"] or whole
+
+        predicates = []
+        for (table, column), group in grouped.items():
+            score = 2.0 if group["whole"] else 1.0
+            if fuzzy:
+                score *= 0.8
+            if column in relevant_columns:
+                score += 1.0
+            score += TABLE_PRIORITY.get(group["codebook_table"], 0.0)
+            score -= 0.05 * (len(group["codes"]) - 1)
+            predicates.append(Predicate(
+                table, column, tuple(group["codes"]), tuple(group["codes"].values()), round(score, 3),
+                group["whole"], (table, column) in self._string_columns,
+            ))
+        return sorted(predicates, key=lambda p: -p.score)
+
+
+# ---------------- Filtering ----------------
+def is_confident(match: ValueMatch, predicate: Predicate, relevant_columns: Optional[Set[str]] = None) -> bool:
+    """
+    Whether a candidate is safe to hand to the LLM as a predicate. Parts of
+    compound labels are not ("lighting" is a part of both "Dark - Lighted"
+    and "Dark - Not Lighted"), and neither are one-word labels that are also
+    common words ("top" is IMPACT1 "Top") unless a keyword confirmed the
+    column or the word is a proper noun ("Virginia").
+    """
+    if not predicate.whole:
+        return False
+    if len(TOKEN_RE.findall(match.phrase.lower())) > 1:
+        return True
+    return predicate.column in (relevant_columns or set()) or match.proper_noun
+
+def filter_years(matches: List[ValueMatch], year_codebook, years: Iterable[int]) -> List[ValueMatch]:
+    """
+    Drop codes not valid in any of `years` (metadata_loader.YearCodebook);
+    candidates left without codes are dropped. Columns the year codebook does
+    not know, and years it does not cover, leave candidates as they are.
+    """
+    if year_codebook is None:
+        return matches
+    # Years outside the codebook's coverage leave the codes as they are
+    years = [y for y in (years or ()) if y in year_codebook.years]
+    if not years:
+        return matches
+    filtered = []
+    for match in matches:
+        candidates = []
+        for predicate in match.candidates:
+            table = predicate.table.replace("_master", "")
+            valid = year_codebook.codes_for_years(table, predicate.column, years)
+            if valid is None:
+                if not year_codebook.available_years(table, predicate.column):
+                    candidates.append(predicate)
+                continue
+            keep = [i for i, code in enumerate(predicate.codes) if code in valid]
+            if keep:
+                candidates.append(predicate._replace(
+                    codes=tuple(predicate.codes[i] for i in keep),
+                    labels=tuple(predicate.labels[i] for i in keep),
+                ))
+        filtered.append(match._replace(candidates=candidates))
+    return filtered
+
+
+# ---------------- Prompt helpers ----------------
+def format_predicate_hints(
+    matches: List[ValueMatch], relevant_columns: Optional[Set[str]] = None, max_per_phrase: int = 2
+) -> str:
+    """Prompt section listing the confident predicates for each matched phrase."""
+    lines = []
+    for match in matches:
+        confident = [p for p in match.candidates if is_confident(match, p, relevant_columns)]
+        for predicate in confident[:max_per_phrase]:
+            note = " (approximate match)" if match.fuzzy else ""
+            lines.append(f"'{match.phrase}' -> {predicate.sql()}  -- {' / '.join(predicate.labels)}{note}")
+    if not lines:
+        return ""
+    return "\n".join(
+        ["\n=== VALUES RESOLVED FROM THE CODEBOOK (hints) ==="]
+        + lines
+        + ["If the question filters on these values, these predicates are likely what it means; "
+           "check them against the code lists below.\n"]
+    )
+
+def resolved_codes(matches: List[ValueMatch], relevant_columns: Optional[Set[str]] = None) -> Dict[str, Dict[str, str]]:
+    """{column: {code: label}} of the best confident predicate per phrase."""
+    codes: Dict[str, Dict[str, str]] = {}
+    for match in matches:
+        best = next((p for p in match.candidates if is_confident(match, p, relevant_columns)), None)
+        if best is not None:
+            codes.setdefault(best.column, {}).update(zip(best.codes, best.labels))
+    return codes
@@ -0,0 +1,237 @@
+"""
+Persistent on-disk cache for LLM responses.
+
+Every ChatOllama client in the backend runs at temperature 0, so a response is
+fully determined by the model, its parameters and the prompt. This cache plugs
+into LangChain's cache hook (`ChatOllama(..., cache=get_llm_cache())`) and
+stores generations in SQLite:
+
+- key: SHA-256 of LangChain's serialized model parameters plus the prompt
+- size-bounded LRU eviction (entry count and total bytes)
+- invalidation when the local Ollama model digest changes (model re-pulled
+  or replaced under the same tag)
+
+Set FARS_LLM_CACHE=0 to disable, FARS_LLM_CACHE_PATH to move the database.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional, Sequence
+
+from langchain_core.caches import BaseCache
+from langchain_core.load import dumps, loads
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_PATH = os.path.normpath(os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "..", ".cache", "llm_responses.sqlite"
+))
+
+# Model name inside LangChain's llm_string (JSON form or sorted-params form)
+_MODEL_RE = re.compile(r'"model":\s*"([^"]+)"|\(\'model\', \'([^\']+)\'\)')
+
+
+class PersistentLLMCache(BaseCache):
+    def __init__(
+        self,
+        path: str = DEFAULT_CACHE_PATH,
+        max_entries: int = 50_000,
+        max_bytes: int = 512 * 1024 * 1024,
+        digest_ttl: float = 300.0,
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.digest_ttl = digest_ttl
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._digests: Dict[str, str] = {}
+        self._digests_at = 0.0
+
+        self._conn = None
+        self._conn_pid = None
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db()
+
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self) -> None:
+        # A lock held by another thread at fork time would never be released
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._conn = None
+
+    def _db(self) -> sqlite3.Connection:
+        """Connection for the current process (SQLite handles must not cross a fork)."""
+        if self._conn is not None and self._conn_pid == os.getpid():
+            return self._conn
+
+        conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        # WAL lets several worker processes read while one writes
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                model TEXT,
+                digest TEXT,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_access ON llm_cache(last_access)")
+        conn.commit()
+        self._conn, self._conn_pid = conn, os.getpid()
+        return conn
+
+    # ------------------------ model digests ------------------------
+    def _refresh_digests(self) -> None:
+        """
+        Ask the local Ollama server for the digest of every installed model.
+        If the server cannot be reached, the last known digests are kept.
+        """
+        try:
+            from ollama import Client
+
+            response = Client(host=os.getenv("OLLAMA_HOST")).list()
+            models = response["models"] if isinstance(response, dict) else response.models
+            digests = {}
+            for m in models:
+                name = m.get("model") or m.get("name")
+                if name:
+                    digests[name] = m.get("digest") or ""
+            self._digests = digests
+        except Exception as e:
+            logger.warning(f"Could not read Ollama model digests: {str(e)}")
+        self._digests_at = time.time()
+
+    def model_digest(self, model: str) -> Optional[str]:
+        """
+        Current digest of a model, or None when it is unknown (Ollama not
+        reachable yet, model not listed). Called outside self._lock: the
+        refresh is an HTTP call, and only one thread makes it while the others
+        use the last known digests.
+        """
+        if time.time() - self._digests_at > self.digest_ttl and self._refresh_lock.acquire(blocking=False):
+            try:
+                self._refresh_digests()
+            finally:
+                self._refresh_lock.release()
+        if ":" not in model:
+            model = f"{model}:latest"
+        return self._digests.get(model) or None
+
+    # ------------------------ BaseCache API ------------------------
+    @staticmethod
+    def _key(prompt: str, llm_string: str) -> str:
+        return hashlib.sha256(f"{llm_string}\x00{prompt}".encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _model(llm_string: str) -> str:
+        match = _MODEL_RE.search(llm_string)
+        return (match.group(1) or match.group(2)) if match else ""
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[Sequence[Any]]:
+        key = self._key(prompt, llm_string)
+        current = self.model_digest(self._model(llm_string))
+        with self._lock:
+            conn = self._db()
+            row = conn.execute(
+                "SELECT model, digest, value FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            model, digest, value = row
+            if current and digest and digest != current:
+                # The model changed under the same name: stored answers are stale
+                conn.execute("DELETE FROM llm_cache WHERE model = ? AND digest = ?", (model, digest))
+                conn.commit()
+                self.misses += 1
+                logger.info(f"Invalidated cached responses for model '{model}' (digest changed)")
+                return None
+            if current and not digest:
+                # Stored while the digest was unknown: can't tell whether it is
+                # stale, so recompute (update() overwrites it with the digest)
+                self.misses += 1
+                return None
+
+            conn.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (time.time(), key))
+            conn.commit()
+            self.hits += 1
+
+        return [loads(gen) for gen in json.loads(value)]
+
+    def update(self, prompt: str, llm_string: str, return_val: Sequence[Any]) -> None:
+        key = self._key(prompt, llm_string)
+        model = self._model(llm_string)
+        digest = self.model_digest(model) or ""
+        value = json.dumps([dumps(gen) for gen in return_val])
+        with self._lock:
+            conn = self._db()
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, model, digest, value, size, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, digest, value, len(value), time.time()),
+            )
+            self._evict(conn)
+            conn.commit()
+
+    def clear(self, **kwargs: Any) -> None:
+        with self._lock:
+            conn = self._db()
+            conn.execute("DELETE FROM llm_cache")
+            conn.commit()
+
+    # ------------------------ eviction ------------------------
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        """Drop least-recently-used entries until both size bounds hold."""
+        count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache").fetchone()
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+
+        rows = conn.execute("SELECT key, size FROM llm_cache ORDER BY last_access").fetchall()
+        stale = []
+        for key, size in rows:
+            if count <= self.max_entries and total <= self.max_bytes:
+                break
+            stale.append((key,))
+            count -= 1
+            total -= size
+        conn.executemany("DELETE FROM llm_cache WHERE key = ?", stale)
+        logger.info(f"Evicted {len(stale)} cached LLM responses")
+
+    def stats(self) -> dict:
+        with self._lock:
+            count, total = self._db().execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache"
+            ).fetchone()
+        return {"entries": count, "bytes": total, "hits": self.hits, "misses": self.misses}
+
+
+_cache: Optional[PersistentLLMCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_llm_cache() -> Optional[PersistentLLMCache]:
+    """Shared cache instance for this process (None when disabled)."""
+    global _cache
+    if os.getenv("FARS_LLM_CACHE", "1") == "0":
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = PersistentLLMCache(os.getenv("FARS_LLM_CACHE_PATH", DEFAULT_CACHE_PATH))
+    return _cache
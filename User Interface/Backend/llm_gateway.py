@@ -0,0 +1,208 @@
+"""
+Shared gateway for every call to the local Ollama server.
+
+- Bounded concurrency per model (OLLAMA_MAX_CONCURRENCY, default 2), so
+  concurrent Flask requests queue instead of thrashing the model.
+- Priority queue: routing and SQL generation go ahead of long explanations.
+- Request coalescing: identical in-flight prompts for the same model and
+  parameters share one generation.
+- Queue-time metrics per model, exposed through `gateway.metrics()`.
+
+Wrap an LLM once with `gateway.bind(llm, priority)`; the wrapper has the same
+`invoke()` / `stream()` surface the pipeline already uses.
+"""
+
+import hashlib
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Dict, Optional
+
+from tracing import current_span
+
+logger = logging.getLogger(__name__)
+
+# Lower value = served first
+PRIORITY_ROUTING = 0
+PRIORITY_SQL = 1
+PRIORITY_EXPLANATION = 2
+
+
+class _ModelSlots:
+    """Concurrency slots and waiting queue for one model."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+        self.waiting = []  # heap of (priority, seq)
+        self.cond = threading.Condition()
+        self.queue_ms = deque(maxlen=1000)
+        self.calls = 0
+        self.coalesced = 0
+
+
+class LLMGateway:
+    def __init__(self, default_limit: Optional[int] = None, limits: Optional[Dict[str, int]] = None):
+        self.default_limit = default_limit or int(os.getenv("OLLAMA_MAX_CONCURRENCY", "2"))
+        self.limits = dict(limits or {})
+        self._slots: Dict[str, _ModelSlots] = {}
+        self._slots_lock = threading.Lock()
+        self._inflight: Dict[str, Future] = {}
+        self._inflight_lock = threading.Lock()
+        self._seq = itertools.count()
+
+    # ------------------------ slots ------------------------
+    def _model_slots(self, model: str) -> _ModelSlots:
+        with self._slots_lock:
+            if model not in self._slots:
+                self._slots[model] = _ModelSlots(self.limits.get(model, self.default_limit))
+            return self._slots[model]
+
+    def _acquire(self, model: str, priority: int) -> float:
+        """Block until a slot is free and this caller is first in line. Returns queue ms."""
+        slots = self._model_slots(model)
+        entry = (priority, next(self._seq))
+        start = time.perf_counter()
+        with slots.cond:
+            heapq.heappush(slots.waiting, entry)
+            try:
+                while slots.active >= slots.limit or slots.waiting[0] != entry:
+                    slots.cond.wait()
+            except BaseException:
+                # Interrupted while queued: leave the line, or everyone behind
+                # this entry would wait for it forever
+                slots.waiting.remove(entry)
+                heapq.heapify(slots.waiting)
+                slots.cond.notify_all()
+                raise
+            heapq.heappop(slots.waiting)
+            slots.active += 1
+            # Let the next waiter proceed too if there is still a free slot
+            slots.cond.notify_all()
+
+            queue_ms = (time.perf_counter() - start) * 1000.0
+            slots.queue_ms.append(queue_ms)
+            slots.calls += 1
+
+        s = current_span()
+        if s is not None:
+            s.set(queue_ms=round(queue_ms, 3), model=model)
+        return queue_ms
+
+    def _release(self, model: str) -> None:
+        slots = self._model_slots(model)
+        with slots.cond:
+            slots.active -= 1
+            slots.cond.notify_all()
+
+    # ------------------------ calls ------------------------
+    @staticmethod
+    def model_name(llm) -> str:
+        return getattr(llm, "model", None) or getattr(llm, "model_name", None) or type(llm).__name__
+
+    def _prompt_key(self, llm, prompt) -> str:
+        params = (self.model_name(llm), getattr(llm, "temperature", None), str(prompt))
+        return hashlib.sha256(repr(params).encode("utf-8")).hexdigest()
+
+    def invoke(self, llm, prompt, priority: int = PRIORITY_SQL, **kwargs):
+        """Queued, coalesced `llm.invoke(prompt)`."""
+        model = self.model_name(llm)
+        key = self._prompt_key(llm, prompt)
+
+        with self._inflight_lock:
+            leader = key not in self._inflight
+            if leader:
+                self._inflight[key] = Future()
+            future = self._inflight[key]
+
+        if not leader:
+            slots = self._model_slots(model)
+            with slots.cond:
+                slots.coalesced += 1
+            logger.info(f"Coalesced identical in-flight prompt for model '{model}'")
+            return future.result()
+
+        try:
+            self._acquire(model, priority)
+            try:
+                response = llm.invoke(prompt, **kwargs)
+            finally:
+                self._release(model)
+            future.set_result(response)
+            return response
+        except BaseException as e:
+            # Followers are waiting on this future: resolve it whatever happened
+            # (KeyboardInterrupt, SystemExit, worker timeouts included)
+            if not future.done():
+                future.set_exception(
+                    e if isinstance(e, Exception) else RuntimeError(f"LLM call interrupted: {e!r}")
+                )
+            raise
+        finally:
+            with self._inflight_lock:
+                self._inflight.pop(key, None)
+
+    def stream(self, llm, prompt, priority: int = PRIORITY_EXPLANATION, **kwargs):
+        """Queued `llm.stream(prompt)`; the slot is held until the stream ends."""
+        model = self.model_name(llm)
+        self._acquire(model, priority)
+        try:
+            yield from llm.stream(prompt, **kwargs)
+        finally:
+            self._release(model)
+
+    def bind(self, llm, priority: int) -> "GatewayLLM":
+        return GatewayLLM(self, llm, priority)
+
+    # ------------------------ metrics ------------------------
+    def metrics(self) -> Dict[str, dict]:
+        report = {}
+        with self._slots_lock:
+            items = list(self._slots.items())
+        for model, slots in items:
+            # Snapshot under the condition lock; workers append to queue_ms
+            with slots.cond:
+                waits = list(slots.queue_ms)
+                counters = {
+                    "limit": slots.limit,
+                    "active": slots.active,
+                    "queued": len(slots.waiting),
+                    "calls": slots.calls,
+                    "coalesced": slots.coalesced,
+                }
+            waits.sort()
+            report[model] = {
+                **counters,
+                "queue_ms_avg": round(sum(waits) / len(waits), 3) if waits else 0.0,
+                "queue_ms_p95": round(waits[int(0.95 * (len(waits) - 1))], 3) if waits else 0.0,
+                "queue_ms_max": round(waits[-1], 3) if waits else 0.0,
+            }
+        return report
+
+
+class GatewayLLM:
+    """An LLM bound to the gateway with a fixed priority."""
+
+    def __init__(self, gateway: LLMGateway, llm, priority: int):
+        self.gateway = gateway
+        self.llm = llm
+        self.priority = priority
+
+    @property
+    def model(self) -> str:
+        return self.gateway.model_name(self.llm)
+
+    def invoke(self, prompt, **kwargs):
+        return self.gateway.invoke(self.llm, prompt, priority=self.priority, **kwargs)
+
+    def stream(self, prompt, **kwargs):
+        return self.gateway.stream(self.llm, prompt, priority=self.priority, **kwargs)
+
+
+# Single gateway shared by the whole process
+gateway = LLMGateway()
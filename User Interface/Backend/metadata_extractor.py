@@ -4,7 +4,11 @@ Extracts relevant column metadata based on keywords in natural language question
 """
 
 import logging
-from typing import Dict, Set, List, Tuple
+import re
+from collections import deque
+from typing import Dict, NamedTuple, Set, List, Optional, Tuple
+
+from metadata_loader import ColumnIndex
 
 logger = logging.getLogger(__name__)
 
@@ -217,10 +221,168 @@ KEYWORD_MAPPINGS = {
 }
 
 
+# "X and Y" is only a range after "between"; "in 2015 and 2022" is two years
+YEAR_RANGE_RE = re.compile(
+    r"\bbetween\s+(19[7-9]\d|20[0-4]\d)\s*(?:-|–|to|through|and)\s*(19[7-9]\d|20[0-4]\d)\b"
+    r"|\b(19[7-9]\d|20[0-4]\d)\s*(?:-|–|to|through)\s*(19[7-9]\d|20[0-4]\d)\b",
+    re.IGNORECASE,
+)
+YEAR_RE = re.compile(r"\b(19[7-9]\d|20[0-4]\d)\b")
+
+# Predicates on the YEAR column itself (bare or table-qualified, not MOD_YEAR
+# or DEATH_YR): YEAR = 2021, YEAR IN (2020, 2021), YEAR BETWEEN 2018 AND 2020
+_SQL_YEAR_COL = r"(?<![\w])(?:\w+\.)*YEAR\s*"
+SQL_YEAR_EQ_RE = re.compile(_SQL_YEAR_COL + r"=\s*'?(\d{4})\b", re.IGNORECASE)
+SQL_YEAR_IN_RE = re.compile(_SQL_YEAR_COL + r"IN\s*\(([^)]*)\)", re.IGNORECASE)
+SQL_YEAR_BETWEEN_RE = re.compile(_SQL_YEAR_COL + r"BETWEEN\s+'?(\d{4})'?\s+AND\s+'?(\d{4})\b", re.IGNORECASE)
+
+
 # ============================================================
 # METADATA EXTRACTION FUNCTIONS
 # ============================================================
 
+def extract_years(question: str) -> List[int]:
+    """
+    Years mentioned in the question, in order of appearance.
+    Ranges ("2018-2020", "2018 to 2020", "between 2018 and 2020") are expanded.
+    """
+    years: List[int] = []
+    text = question
+    for match in YEAR_RANGE_RE.finditer(question):
+        first, last = match.group(1) or match.group(3), match.group(2) or match.group(4)
+        start, end = sorted((int(first), int(last)))
+        years.extend(range(start, end + 1))
+        text = text.replace(match.group(0), " ")
+    years.extend(int(m.group(1)) for m in YEAR_RE.finditer(text))
+    return list(dict.fromkeys(years))
+
+
+def extract_sql_years(sql_query: str) -> List[int]:
+    """
+    Years a query filters YEAR on, in order of appearance. Other 4-digit
+    literals (MOD_YEAR >= 2015, LIMIT 2000) are not data years.
+    """
+    years: List[int] = []
+    for match in SQL_YEAR_EQ_RE.finditer(sql_query):
+        years.append(int(match.group(1)))
+    for match in SQL_YEAR_IN_RE.finditer(sql_query):
+        years.extend(int(y) for y in re.findall(r"\b(\d{4})\b", match.group(1)))
+    for match in SQL_YEAR_BETWEEN_RE.finditer(sql_query):
+        start, end = sorted((int(match.group(1)), int(match.group(2))))
+        years.extend(range(start, end + 1))
+    return list(dict.fromkeys(years))
+
+
+# ============================================================
+# KEYWORD MATCHER - all keywords in one pass over the question
+# ============================================================
+
+class KeywordMatch(NamedTuple):
+    column: str
+    keyword: str
+    start: int
+    end: int
+
+
+def _is_word_char(ch: str) -> bool:
+    return ch.isalnum() or ch == "_"
+
+
+class KeywordMatcher:
+    """
+    Aho-Corasick automaton over every keyword in a column -> keywords mapping.
+
+    One scan of the question finds all keyword occurrences, including
+    overlapping ones from different columns ("minor injury" -> INJ_SEV and
+    "minor" -> AGE), so the cost depends on the question length and the
+    number of matches, not on the size of the keyword vocabulary.
+
+    Matching rules are those of the original per-keyword checks: phrases
+    (containing a space or hyphen) match anywhere, single words only on
+    word boundaries (like regex \\b).
+    """
+
+    def __init__(self, mappings: Dict[str, List[str]]):
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        # Per node: (keyword, columns, whole_word) for keywords ending there
+        self.outputs: List[List[Tuple[str, Tuple[str, ...], bool]]] = [[]]
+
+        columns_by_keyword: Dict[str, List[str]] = {}
+        for column, keywords in mappings.items():
+            for keyword in keywords:
+                keyword = keyword.lower()
+                if keyword and column not in columns_by_keyword.setdefault(keyword, []):
+                    columns_by_keyword[keyword].append(column)
+
+        for keyword, columns in columns_by_keyword.items():
+            node = 0
+            for ch in keyword:
+                if ch not in self.goto[node]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.outputs.append([])
+                    self.goto[node][ch] = len(self.goto) - 1
+                node = self.goto[node][ch]
+            whole_word = not (" " in keyword or "-" in keyword)
+            self.outputs[node].append((keyword, tuple(columns), whole_word))
+
+        # Breadth-first failure links; each node also inherits the outputs of
+        # its failure node (keywords that are suffixes of longer ones)
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in self.goto[node].items():
+                queue.append(child)
+                fallback = self.fail[node]
+                while fallback and ch not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(ch, 0)
+                self.outputs[child] = self.outputs[child] + self.outputs[self.fail[child]]
+
+        self.keyword_count = len(columns_by_keyword)
+
+    def find(self, question: str) -> List[KeywordMatch]:
+        """Every keyword occurrence as (column, keyword, start, end) spans of the lowercased question."""
+        text = question.lower()
+        matches: List[KeywordMatch] = []
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(ch, 0)
+            for keyword, columns, whole_word in self.outputs[node]:
+                start, end = i + 1 - len(keyword), i + 1
+                if whole_word:
+                    before = text[start - 1] if start > 0 else ""
+                    after = text[end] if end < len(text) else ""
+                    # Same test as \b on both sides of the keyword
+                    if _is_word_char(before) == _is_word_char(keyword[0]):
+                        continue
+                    if _is_word_char(after) == _is_word_char(keyword[-1]):
+                        continue
+                for column in columns:
+                    matches.append(KeywordMatch(column, keyword, start, end))
+        return matches
+
+
+_keyword_matcher: Optional[KeywordMatcher] = None
+
+
+def get_keyword_matcher() -> KeywordMatcher:
+    """The matcher for KEYWORD_MAPPINGS, built on first use and after add_keyword_mapping()."""
+    global _keyword_matcher
+    if _keyword_matcher is None:
+        _keyword_matcher = KeywordMatcher(KEYWORD_MAPPINGS)
+        logger.debug(f"Built keyword matcher for {_keyword_matcher.keyword_count} keywords")
+    return _keyword_matcher
+
+
+def find_keyword_matches(question: str) -> List[KeywordMatch]:
+    """All KEYWORD_MAPPINGS matches in the question, with their spans."""
+    return get_keyword_matcher().find(question)
+
+
 def extract_relevant_columns(question: str) -> Set[str]:
     """
     Identifies relevant column names based on keywords in the question.
@@ -232,30 +394,11 @@ def extract_relevant_columns(question: str) -> Set[str]:
     Returns:
         Set of column names that are relevant to the question
     """
-    import re
-    
-    question_lower = question.lower()
     relevant_columns = set()
-    
-    # Check each keyword mapping
-    for column, keywords in KEYWORD_MAPPINGS.items():
-        for keyword in keywords:
-            # Use word boundaries for multi-word keywords and single words
-            # For multi-word phrases, check if they exist in the question
-            if ' ' in keyword or '-' in keyword:
-                # Multi-word phrase - simple containment check is fine
-                if keyword in question_lower:
-                    relevant_columns.add(column)
-                    logger.debug(f"Matched keyword '{keyword}' to column '{column}'")
-                    break
-            else:
-                # Single word - use word boundary matching to avoid false positives
-                # \b ensures we match whole words only
-                pattern = r'\b' + re.escape(keyword) + r'\b'
-                if re.search(pattern, question_lower):
-                    relevant_columns.add(column)
-                    logger.debug(f"Matched keyword '{keyword}' to column '{column}'")
-                    break
+    for match in find_keyword_matches(question):
+        if match.column not in relevant_columns:
+            relevant_columns.add(match.column)
+            logger.debug(f"Matched keyword '{match.keyword}' to column '{match.column}' at {match.start}-{match.end}")
     
     logger.info(f"Extracted {len(relevant_columns)} relevant columns from question")
     return relevant_columns
@@ -264,7 +407,12 @@ def extract_relevant_columns(question: str) -> Set[str]:
 def build_metadata_context(
     relevant_columns: Set[str],
     column_metadata: Dict[str, Dict[str, Dict]],
-    max_codes_per_column: int = 20
+    max_codes_per_column: int = 20,
+    years: Optional[List[int]] = None,
+    year_codebook=None,
+    resolved_codes: Optional[Dict[str, Dict[str, str]]] = None,
+    column_index: Optional[ColumnIndex] = None,
+    tables: Optional[List[str]] = None
 ) -> str:
     """
     Builds formatted metadata context string for the LLM prompt.
@@ -273,12 +421,21 @@ def build_metadata_context(
         relevant_columns: Set of column names to include
         column_metadata: The full FARS codebook metadata dictionary
         max_codes_per_column: Maximum number of codes to include per column
+        years: Years the question is about; codes are limited to those years
+        year_codebook: metadata_loader.YearCodebook used for the per-year codes
+        resolved_codes: {column: {code: label}} already resolved from the question
+            (label_index.resolved_codes); listed as a hint above the column's codes
+        column_index: metadata_loader.ColumnIndex over column_metadata; built
+            here when not given (callers keep one to avoid the rebuild)
+        tables: Tables to take columns present in several tables from, in order
         
     Returns:
         Formatted string with column descriptions and code mappings
     """
     if not relevant_columns:
         return ""
+    if column_index is None:
+        column_index = ColumnIndex(column_metadata)
     
     metadata_lines = ["\n" + "="*60]
     metadata_lines.append("RELEVANT COLUMN METADATA AND CODE MAPPINGS")
@@ -287,45 +444,68 @@ def build_metadata_context(
     metadata_lines.append("USE THESE NUMERIC CODES in your SQL WHERE clauses!\n")
     
     columns_found = 0
+
+    # Years outside the codebook's coverage fall back to the all-years codes
+    if years and year_codebook is not None:
+        years = [y for y in years if y in year_codebook.years]
     
     for column in sorted(relevant_columns):
-        # Search for the column in all tables
-        found = False
-        for table_name, table_meta in column_metadata.items():
-            if column in table_meta:
-                col_info = table_meta[column]
-                description = col_info.get("description", "No description available")
-                codes = col_info.get("codes", {})
-                
-                metadata_lines.append(f"\n🔹 Column: {column} (from {table_name} table)")
-                metadata_lines.append(f"   Description: {description}")
-                
-                if codes:
-                    metadata_lines.append(f"   📋 Valid Codes (USE THESE NUMERIC VALUES):")
-                    
-                    # Convert codes dict to sorted list for consistent ordering
-                    code_items = sorted(codes.items(), key=lambda x: str(x[0]))
-                    
-                    # Limit number of codes to avoid overwhelming the prompt
-                    displayed_codes = code_items[:max_codes_per_column]
-                    
-                    for code, label in displayed_codes:
-                        metadata_lines.append(f"      {code} = {label}")
-                    
-                    if len(code_items) > max_codes_per_column:
-                        remaining = len(code_items) - max_codes_per_column
-                        metadata_lines.append(f"      ... ({remaining} more codes available)")
-                else:
-                    metadata_lines.append(f"   ℹ️  No coded values (use direct comparison)")
-                
-                columns_found += 1
-                found = True
-                break  # Found in this table, no need to check others
-        
-        if not found:
+        # One lookup per column; columns in several tables (STATE, YEAR) take
+        # the first of `tables` that has them
+        resolved = column_index.resolve(column, tables or ())
+        if resolved is None:
             logger.warning(f"Column '{column}' matched by keyword but not found in metadata")
             metadata_lines.append(f"\n🔹 Column: {column}")
             metadata_lines.append(f"   ⚠️  Metadata not available")
+            continue
+
+        table_name, col_info = resolved
+        description = col_info.get("description", "No description available")
+        codes = col_info.get("codes", {})
+        year_note = ""
+        recorded = True
+
+        # Only the codes that existed in the years asked about
+        if years and year_codebook is not None:
+            year_codes = year_codebook.codes_for_years(table_name, column, years)
+            year_list = ", ".join(str(y) for y in sorted(years))
+            if year_codes is not None:
+                codes = year_codes
+                year_note = f" for {year_list}"
+            elif year_codebook.available_years(table_name, column):
+                recorded = False
+
+        metadata_lines.append(f"\n🔹 Column: {column} (from {table_name} table)")
+        metadata_lines.append(f"   Description: {description}")
+        columns_found += 1
+
+        if not recorded:
+            metadata_lines.append(f"   ⚠️  Not recorded in {year_list}")
+            continue
+
+        # Codes the question's wording resolved to, as a hint on top of the full list
+        matched = {c: l for c, l in (resolved_codes or {}).get(column, {}).items() if not codes or c in codes}
+        if matched:
+            metadata_lines.append(f"   🔎 Likely matching the question: "
+                                  + ", ".join(f"{code} = {label}" for code, label in matched.items()))
+
+        if codes:
+            metadata_lines.append(f"   📋 Valid Codes{year_note} (USE THESE NUMERIC VALUES):")
+
+            # Convert codes dict to sorted list for consistent ordering
+            code_items = sorted(codes.items(), key=lambda x: str(x[0]))
+
+            # Limit number of codes to avoid overwhelming the prompt
+            displayed_codes = code_items[:max_codes_per_column]
+
+            for code, label in displayed_codes:
+                metadata_lines.append(f"      {code} = {label}")
+
+            if len(code_items) > max_codes_per_column:
+                remaining = len(code_items) - max_codes_per_column
+                metadata_lines.append(f"      ... ({remaining} more codes available)")
+        else:
+            metadata_lines.append(f"   ℹ️  No coded values (use direct comparison)")
     
     metadata_lines.append("\n" + "="*60)
     metadata_lines.append("🚨 CRITICAL: Always use the NUMERIC CODE values shown above!")
@@ -340,7 +520,12 @@ def build_metadata_context(
 def extract_relevant_metadata(
     question: str,
     column_metadata: Dict[str, Dict[str, Dict]],
-    max_codes_per_column: int = 20
+    max_codes_per_column: int = 20,
+    year_codebook=None,
+    resolved_codes: Optional[Dict[str, Dict[str, str]]] = None,
+    retrieved_columns: Optional[Set[str]] = None,
+    column_index: Optional[ColumnIndex] = None,
+    tables: Optional[List[str]] = None
 ) -> str:
     """
     Main function: Extract relevant metadata based on question keywords.
@@ -351,13 +536,22 @@ def extract_relevant_metadata(
         question: Natural language question from user
         column_metadata: The full FARS codebook metadata dictionary
         max_codes_per_column: Maximum number of codes to include per column
+        year_codebook: Optional metadata_loader.YearCodebook; when the question
+            names years, only codes valid in those years are listed
+        resolved_codes: Optional {column: {code: label}} resolved from the question;
+            shown as hints next to the full code lists
+        retrieved_columns: Optional columns found by embedding similarity
+            (column_retriever.ColumnRetriever), added to the keyword matches
+        column_index: Optional prebuilt metadata_loader.ColumnIndex
+        tables: Optional tables, in order, for columns present in several tables
         
     Returns:
         Formatted metadata context string for inclusion in LLM prompt
     """
     try:
-        # Step 1: Identify relevant columns
-        relevant_columns = extract_relevant_columns(question)
+        # Step 1: Identify relevant columns (keywords, plus embedding matches
+        # for the columns KEYWORD_MAPPINGS does not cover)
+        relevant_columns = extract_relevant_columns(question) | set(retrieved_columns or ())
         
         if not relevant_columns:
             logger.info("No relevant columns identified from question")
@@ -367,7 +561,12 @@ def extract_relevant_metadata(
         metadata_context = build_metadata_context(
             relevant_columns,
             column_metadata,
-            max_codes_per_column
+            max_codes_per_column,
+            years=extract_years(question),
+            year_codebook=year_codebook,
+            resolved_codes=resolved_codes,
+            column_index=column_index,
+            tables=tables
         )
         
         return metadata_context
@@ -407,6 +606,10 @@ def add_keyword_mapping(column: str, keywords: List[str]) -> None:
     else:
         # Create new mapping
         KEYWORD_MAPPINGS[column] = keywords
+
+    # Rebuilt with the new keywords on next use
+    global _keyword_matcher
+    _keyword_matcher = None
     
     logger.info(f"Added/updated {len(keywords)} keywords for column '{column}'")
 
@@ -461,9 +664,8 @@ if __name__ == "__main__":
         print(f"\n✅ Matched Columns: {', '.join(sorted(columns)) if columns else 'None'}")
         
         # Show which keywords triggered the match
-        for col in sorted(columns):
-            matching_keywords = [kw for kw in KEYWORD_MAPPINGS[col] if kw in question.lower()]
-            print(f"   - {col}: triggered by '{matching_keywords[0] if matching_keywords else '?'}'")
+        for match in find_keyword_matches(question):
+            print(f"   - {match.column}: triggered by '{match.keyword}' at {match.start}-{match.end}")
     
     print(f"\n{'='*70}")
     print("Test complete!")
@@ -1,11 +1,82 @@
+import numpy as np
 import pandas as pd
 from collections import defaultdict
+import hashlib
+import json
 import logging
+import os
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
 
 # Configure local logger
 logger = logging.getLogger(__name__)
 
-def load_fars_codebook(csv_path: str):
+REQUIRED_COLUMNS = ['name_ncsa', 'value', 'value_label']
+
+def codebook_years(df: pd.DataFrame):
+    """Per-year availability columns of the codebook ("2014" ... "2023"), as ints."""
+    return sorted(int(c) for c in df.columns if str(c).isdigit())
+
+def read_codebook(csv_path: str) -> pd.DataFrame:
+    """
+    Read the RFARS codebook CSV into a normalized frame shared by the metadata
+    loader and the codebook index builder:
+      - headers lowercased ('Definition' -> 'definition')
+      - 'table' / 'column' keys as used in load_fars_codebook ('accident', 'WEATHER')
+      - 'code' as the SQL-comparable string ("1.0" -> "1"), NA where missing
+    """
+    df = pd.read_csv(csv_path, low_memory=False)
+    df.columns = [c.lower().strip() for c in df.columns]
+
+    missing = [c for c in REQUIRED_COLUMNS if c not in df.columns]
+    if missing:
+        raise ValueError(f"Metadata CSV missing required columns: {missing}")
+    if 'file' not in df.columns:
+        df['file'] = 'fars'
+
+    df['table'] = df['file'].astype(str).str.lower().str.strip()
+    df['column'] = df['name_ncsa'].astype(str).str.upper().str.strip()
+
+    # SQL returns integers (1), not floats (1.0)
+    numeric = pd.to_numeric(df['value'], errors='coerce')
+    code = df['value'].astype(str).str.strip()
+    code[numeric.notna()] = numeric[numeric.notna()].astype('int64').astype(str)
+    df['code'] = code.where(df['value'].notna())
+    return df
+
+def build_column_metadata(df: pd.DataFrame) -> dict:
+    """
+    Nested {table: {COLUMN: {"description", "codes"}}} metadata from a
+    read_codebook frame, built column-wise (no per-row pandas access).
+    """
+    # 1. Column Descriptions: first non-null definition of each (table, column)
+    keys = df[['table', 'column']].drop_duplicates().sort_values(['table', 'column'])
+    grouped = df.groupby(['table', 'column'])
+    empty = pd.Series(dtype=object)
+    definitions = grouped['definition'].first() if 'definition' in df.columns else empty
+    # Short variable name, e.g. "Atmospheric Conditions" for WEATHER
+    labels = grouped['label'].first() if 'label' in df.columns else empty
+
+    metadata = defaultdict(dict)
+    for table_key, column_key in zip(keys['table'], keys['column']):
+        description = definitions.get((table_key, column_key))
+        label = labels.get((table_key, column_key))
+        metadata[table_key][column_key] = {
+            "description": str(description).strip() if pd.notna(description) else f"Codes for {column_key}",
+            "label": str(label).strip() if pd.notna(label) else column_key,
+            "codes": {}
+        }
+
+    # 2. Code Maps (Value -> Value Label), e.g. {'98': 'Not Reported', '1': 'Clear'}
+    # Only rows with both a code and a label; a code repeated across coding eras
+    # keeps its first position and its last label
+    coded = df[df['code'].notna() & df['value_label'].notna()]
+    labels = coded['value_label'].astype(str).str.strip()
+    for table_key, column_key, code, label in zip(coded['table'], coded['column'], coded['code'], labels):
+        metadata[table_key][column_key]["codes"][code] = label
+
+    return dict(metadata)
+
+def load_fars_codebook(csv_path: str, use_snapshot: bool = True):
     """
     Loads the RFARS codebook CSV and transforms it into a nested dictionary 
     compatible with the AI Metadata Processor.
@@ -16,74 +87,269 @@ def load_fars_codebook(csv_path: str):
       - value:       The code (e.g., 98)
       - value_label: The meaning (e.g., "Not Reported")
       - definition:  General description of the column
+
+    The result is cached in a snapshot (see load_snapshot), so only the first
+    start after the CSV changes parses it.
     """
     try:
-        # Load CSV with low_memory=False to handle mixed types in 'value' columns
-        df = pd.read_csv(csv_path, low_memory=False)
-        
-        # Normalize CSV headers to lowercase to ensure matching works
-        df.columns = [c.lower().strip() for c in df.columns]
-
-        # Verify critical columns exist
-        required_cols = ['name_ncsa', 'value', 'value_label']
-        if not all(col in df.columns for col in required_cols):
-            missing = [c for c in required_cols if c not in df.columns]
-            logger.error(f"Metadata CSV missing required columns: {missing}")
-            return {}
-
-        metadata = defaultdict(dict)
-
-        # 1. Clean Data: Ensure file exists, fill NA with 'common' or inference
-        if 'file' not in df.columns:
-            df['file'] = 'fars' # Fallback if file is missing
-        
-        # 2. Group by File (Table) and Variable (Column)
-        # We process the dataframe by grouping to build the dictionaries efficiently
-        grouped = df.groupby(['file', 'name_ncsa'])
-
-        for (file_type, var_name), group in grouped:
-            
-            # Normalize Keys
-            # 'accident' -> 'accident', 'WEATHER' -> 'WEATHER'
-            table_key = str(file_type).lower().strip()
-            column_key = str(var_name).upper().strip()
-
-            # 3. Extract Column Description
-            # Use the 'definition' column. Take the first non-null value found.
-            description = f"Codes for {column_key}"
-            if 'definition' in group.columns:
-                desc_vals = group['definition'].dropna()
-                if not desc_vals.empty:
-                    description = str(desc_vals.iloc[0]).strip()
-
-            # 4. Build the Code Map (Value -> Value Label)
-            # Example: {'98': 'Not Reported', '1': 'Clear'}
-            code_map = {}
-            
-            for _, row in group.iterrows():
-                val = row.get('value')
-                label = row.get('value_label')
-
-                # Only add if both value and label are valid
-                if pd.notna(val) and pd.notna(label):
-                    # Convert float-like strings (e.g. "1.0") to integers strings ("1")
-                    # This is crucial because SQL returns integers (1), not floats (1.0)
-                    try:
-                        val_str = str(int(float(val)))
-                    except (ValueError, TypeError):
-                        val_str = str(val).strip()
-                    
-                    code_map[val_str] = str(label).strip()
-
-            # 5. Assign to Metadata Structure
-            metadata[table_key][column_key] = {
-                "description": description,
-                "codes": code_map
-            }
-
+        if use_snapshot:
+            metadata = load_snapshot(csv_path, "column_metadata", lambda: build_column_metadata(read_codebook(csv_path)))
+        else:
+            metadata = build_column_metadata(read_codebook(csv_path))
         logger.info(f"Successfully loaded metadata for {len(metadata)} tables.")
-        return dict(metadata)
+        return metadata
 
     except Exception as e:
         logger.error(f"Failed to load FARS codebook: {str(e)}")
-        return {}
\ No newline at end of file
+        return {}
+
+
+# ---------------- Snapshots ----------------
+# JSON header + numpy arrays in one .npz, read with allow_pickle=False, so a
+# snapshot file can never execute code when loaded
+SNAPSHOT_VERSION = 3
+SNAPSHOT_HEADER = "snapshot"
+DEFAULT_SNAPSHOT_DIR = os.path.normpath(os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "..", ".cache", "codebook"
+))
+
+# encode(data) -> (JSON-serializable payload, {name: array}); decode reverses it
+Encoder = Callable[[Any], Tuple[Any, Dict[str, np.ndarray]]]
+Decoder = Callable[[Any, Dict[str, np.ndarray]], Any]
+
+def _fingerprint(csv_path: str, with_hash: bool = True) -> dict:
+    stat = os.stat(csv_path)
+    fingerprint = {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+    if with_hash:
+        with open(csv_path, "rb") as f:
+            fingerprint["sha256"] = hashlib.sha256(f.read()).hexdigest()
+    return fingerprint
+
+def _snapshot_path(csv_path: str, name: str) -> str:
+    snapshot_dir = os.getenv("FARS_CODEBOOK_SNAPSHOT_DIR", DEFAULT_SNAPSHOT_DIR)
+    source = hashlib.sha256(os.path.abspath(csv_path).encode("utf-8")).hexdigest()[:12]
+    return os.path.join(snapshot_dir, f"{name}-{source}.npz")
+
+def _read_snapshot(path: str) -> Tuple[dict, Dict[str, np.ndarray]]:
+    with np.load(path, allow_pickle=False) as npz:
+        header = json.loads(npz[SNAPSHOT_HEADER].tobytes().decode("utf-8"))
+        arrays = {key: npz[key] for key in npz.files if key != SNAPSHOT_HEADER}
+    return header, arrays
+
+def load_snapshot(
+    csv_path: str,
+    name: str,
+    build: Callable[[], Any],
+    encode: Optional[Encoder] = None,
+    decode: Optional[Decoder] = None,
+) -> Any:
+    """
+    Return `build()`'s result for a codebook CSV, cached as a snapshot.
+
+    Plain JSON data needs no codec; anything else passes encode/decode to
+    split it into a JSON payload and numpy arrays. The snapshot is reused
+    while the CSV's mtime and size are unchanged; if they changed (e.g. a
+    fresh checkout), its SHA-256 decides, so content edits always rebuild.
+    Set FARS_CODEBOOK_SNAPSHOT=0 to disable and FARS_CODEBOOK_SNAPSHOT_DIR to
+    move the snapshots.
+    """
+    if os.getenv("FARS_CODEBOOK_SNAPSHOT", "1") == "0":
+        return build()
+    encode = encode or (lambda data: (data, {}))
+    decode = decode or (lambda payload, arrays: payload)
+
+    path = _snapshot_path(csv_path, name)
+    current = _fingerprint(csv_path, with_hash=False)
+    header, arrays = None, {}
+    try:
+        header, arrays = _read_snapshot(path)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable codebook snapshot {path}: {e}")
+
+    if header and header.get("version") == SNAPSHOT_VERSION:
+        saved = header["fingerprint"]
+        if all(saved.get(k) == v for k, v in current.items()):
+            return decode(header["data"], arrays)
+        current = _fingerprint(csv_path)
+        if saved.get("sha256") == current["sha256"]:
+            # Same content, new mtime: refresh the fingerprint only
+            _write_snapshot(path, current, header["data"], arrays)
+            return decode(header["data"], arrays)
+
+    data = build()
+    payload, arrays = encode(data)
+    _write_snapshot(path, current if "sha256" in current else _fingerprint(csv_path), payload, arrays)
+    return data
+
+def _write_snapshot(path: str, fingerprint: dict, payload: Any, arrays: Dict[str, np.ndarray]) -> None:
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        header = json.dumps({"version": SNAPSHOT_VERSION, "fingerprint": fingerprint, "data": payload})
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, **{SNAPSHOT_HEADER: np.frombuffer(header.encode("utf-8"), dtype=np.uint8)}, **arrays)
+        # Atomic, so concurrently starting workers never read half a file
+        os.replace(tmp, path)
+    except (OSError, TypeError, ValueError) as e:
+        logger.warning(f"Could not write codebook snapshot {path}: {e}")
+
+
+class YearCodebook:
+    """
+    Codebook indexed by (table, column, year) -> code map.
+
+    The codebook CSV flags every (variable, code) row with the years it is
+    valid in (2014 ... 2023), and codes change between coding eras (WEATHER 0
+    "No Additional Atmospheric Conditions" only exists until 2019).
+    load_fars_codebook collapses all years into one map; this keeps them apart.
+
+    Consecutive years with identical code maps share one dict, stored as
+    intervals [(first_year, last_year, codes)], and every year also points
+    straight at its dict so codes() is a single lookup.
+    """
+
+    def __init__(self, df: Optional[pd.DataFrame] = None):
+        self.years: List[int] = []
+        self._maps: Dict[Tuple[str, str, int], Dict[str, str]] = {}
+        self._intervals: Dict[Tuple[str, str], List[Tuple[int, int, Dict[str, str]]]] = {}
+        if df is not None and not df.empty:
+            self._build(df)
+
+    def _build(self, df: pd.DataFrame):
+        self.years = codebook_years(df)
+        coded = (df['code'].notna() & df['value_label'].notna()).to_numpy()
+        tables = df['table'].to_numpy()
+        columns = df['column'].to_numpy()
+        codes = df['code'].to_numpy()
+        labels = df['value_label'].astype(str).str.strip().to_numpy()
+
+        for year in self.years:
+            in_year = df[str(year)].notna().to_numpy()
+            # Variables recorded that year, with or without codes
+            for table, column in set(zip(tables[in_year], columns[in_year])):
+                self._maps[(table, column, year)] = {}
+            rows = in_year & coded
+            for table, column, code, label in zip(tables[rows], columns[rows], codes[rows], labels[rows]):
+                self._maps[(table, column, year)][code] = label
+
+        # Collapse runs of identical yearly maps into intervals sharing one dict
+        for (table, column, year) in sorted(self._maps, key=lambda k: (k[0], k[1], k[2])):
+            codes = self._maps[(table, column, year)]
+            intervals = self._intervals.setdefault((table, column), [])
+            first, last, shared = intervals[-1] if intervals else (None, None, None)
+            if intervals and last == year - 1 and shared == codes:
+                intervals[-1] = (first, year, shared)
+                self._maps[(table, column, year)] = shared
+            else:
+                intervals.append((year, year, codes))
+
+    def to_snapshot(self) -> dict:
+        """JSON form for load_snapshot: the years and each column's coding eras."""
+        return {
+            "years": self.years,
+            "intervals": [[table, column, intervals] for (table, column), intervals in self._intervals.items()],
+        }
+
+    @classmethod
+    def from_snapshot(cls, payload: dict) -> "YearCodebook":
+        codebook = cls()
+        codebook.years = list(payload["years"])
+        for table, column, intervals in payload["intervals"]:
+            codebook._intervals[(table, column)] = [(first, last, codes) for first, last, codes in intervals]
+            for first, last, codes in intervals:
+                for year in range(first, last + 1):
+                    codebook._maps[(table, column, year)] = codes
+        return codebook
+
+    def codes(self, table: str, column: str, year) -> Optional[Dict[str, str]]:
+        """Code map of a column in one year; None if the column was not recorded that year."""
+        try:
+            return self._maps.get((table.lower(), column.upper(), int(year)))
+        except (TypeError, ValueError):
+            return None
+
+    def codes_for_years(self, table: str, column: str, years: Iterable[int]) -> Optional[Dict[str, str]]:
+        """Codes valid in any of `years` (the latest year's label wins); None if never recorded."""
+        maps = [m for m in (self.codes(table, column, y) for y in sorted(years)) if m is not None]
+        if not maps:
+            return None
+        merged: Dict[str, str] = {}
+        for codes in maps:
+            merged.update(codes)
+        return merged
+
+    def intervals(self, table: str, column: str) -> List[Tuple[int, int, Dict[str, str]]]:
+        """[(first_year, last_year, codes)] for each coding era of a column."""
+        return self._intervals.get((table.lower(), column.upper()), [])
+
+    def available_years(self, table: str, column: str) -> List[int]:
+        return [y for first, last, _ in self.intervals(table, column) for y in range(first, last + 1)]
+
+
+def load_year_codebook(csv_path: str, use_snapshot: bool = True) -> YearCodebook:
+    """Loads the codebook CSV into a YearCodebook (empty on failure, like load_fars_codebook)."""
+    try:
+        if use_snapshot:
+            codebook = load_snapshot(
+                csv_path, "year_codebook", lambda: YearCodebook(read_codebook(csv_path)),
+                encode=lambda codebook: (codebook.to_snapshot(), {}),
+                decode=lambda payload, arrays: YearCodebook.from_snapshot(payload),
+            )
+        else:
+            codebook = YearCodebook(read_codebook(csv_path))
+        logger.info(f"Loaded per-year codes for {len(codebook._intervals)} columns ({len(codebook.years)} years).")
+        return codebook
+    except Exception as e:
+        logger.error(f"Failed to load per-year FARS codebook: {str(e)}")
+        return YearCodebook()
+
+
+# ---------------- Table-qualified lookup ----------------
+def codebook_table(name: str) -> str:
+    """SQL table name -> codebook table key: "workspace.fars_database.accident_master" -> "accident"."""
+    return name.rsplit(".", 1)[-1].lower().replace("_master", "")
+
+
+class ColumnIndex:
+    """
+    load_fars_codebook metadata flattened to (table, COLUMN) -> column info,
+    plus COLUMN -> the tables that have it. STATE, ST_CASE and YEAR exist in
+    accident, person and vehicle; resolve() picks the table the query actually
+    reads instead of the first table that happens to contain the name.
+    """
+
+    def __init__(self, column_metadata: Dict[str, Dict[str, Dict]]):
+        self._info: Dict[Tuple[str, str], Dict] = {}
+        self._tables: Dict[str, Tuple[str, ...]] = {}
+        for table, columns in column_metadata.items():
+            for column, info in columns.items():
+                self._info[(table, column)] = info
+                self._tables[column] = self._tables.get(column, ()) + (table,)
+
+    def __len__(self) -> int:
+        return len(self._info)
+
+    def get(self, table: str, column: str) -> Optional[Dict]:
+        return self._info.get((codebook_table(table), column.upper()))
+
+    def tables_for(self, column: str) -> Tuple[str, ...]:
+        """Codebook tables that have the column, in codebook order."""
+        return self._tables.get(column.upper(), ())
+
+    def resolve(self, column: str, tables: Iterable[str] = ()) -> Optional[Tuple[str, Dict]]:
+        """
+        (table, info) for a bare column name: the first of `tables` (e.g. the
+        query's FROM/JOIN sources, in order) that has it, else the first
+        codebook table that does. None if no table has the column.
+        """
+        column = column.upper()
+        candidates = self._tables.get(column)
+        if not candidates:
+            return None
+        for table in tables:
+            table = codebook_table(table)
+            if table in candidates:
+                return table, self._info[(table, column)]
+        return candidates[0], self._info[(candidates[0], column)]
@@ -0,0 +1,155 @@
+"""
+Per-stage model configuration with automatic small -> large escalation.
+
+Classification (routing) and SQL generation run on a small quantized model
+first; the output is validated and the call is retried on the large model only
+when validation fails or the small model errors. Narration stages
+(explanation, RAG answers) go straight to the large model.
+
+Configuration (environment):
+    FARS_SMALL_MODEL        small tier model   (default: llama3.2:3b)
+    FARS_LARGE_MODEL        large tier model   (default: llama3)
+    FARS_TIER_<STAGE>       "small" or "large" to pin a stage, e.g. FARS_TIER_SQL=large
+"""
+
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+from langchain_ollama import ChatOllama
+
+from llm_cache import get_llm_cache
+from llm_gateway import gateway, GatewayLLM, PRIORITY_ROUTING, PRIORITY_SQL, PRIORITY_EXPLANATION
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+SMALL_MODEL = os.getenv("FARS_SMALL_MODEL", "llama3.2:3b")
+LARGE_MODEL = os.getenv("FARS_LARGE_MODEL", "llama3")
+
+# stage -> (default tier, gateway priority)
+STAGES: Dict[str, Tuple[str, int]] = {
+    "routing": ("small", PRIORITY_ROUTING),
+    "sql": ("small", PRIORITY_SQL),
+    "explanation": ("large", PRIORITY_EXPLANATION),
+    "rag": ("large", PRIORITY_EXPLANATION),
+}
+
+_clients: Dict[str, ChatOllama] = {}
+_clients_lock = threading.Lock()
+
+
+def stage_tier(stage: str) -> str:
+    default_tier, _ = STAGES[stage]
+    return os.getenv(f"FARS_TIER_{stage.upper()}", default_tier)
+
+
+def model_for(tier: str) -> str:
+    return SMALL_MODEL if tier == "small" else LARGE_MODEL
+
+
+def get_stage_llm(stage: str, tier: Optional[str] = None) -> GatewayLLM:
+    """Gateway-bound, cached ChatOllama client for a pipeline stage."""
+    model = model_for(tier or stage_tier(stage))
+    with _clients_lock:
+        if model not in _clients:
+            _clients[model] = ChatOllama(model=model, temperature=0, cache=get_llm_cache())
+            logger.info(f"LLM initialized successfully ({model})")
+    return gateway.bind(_clients[model], STAGES[stage][1])
+
+
+# ---------------- Tier statistics ----------------
+class TierStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats: Dict[str, dict] = {}
+
+    def record(self, stage: str, tier: str, latency_ms: float, escalated: bool = False) -> None:
+        with self._lock:
+            stage_stats = self._stats.setdefault(stage, {"calls": 0, "escalations": 0, "tiers": {}})
+            tier_stats = stage_stats["tiers"].setdefault(tier, {"calls": 0, "total_ms": 0.0})
+            tier_stats["calls"] += 1
+            tier_stats["total_ms"] += latency_ms
+            if escalated:
+                stage_stats["escalations"] += 1
+
+    def start_call(self, stage: str) -> None:
+        with self._lock:
+            self._stats.setdefault(stage, {"calls": 0, "escalations": 0, "tiers": {}})["calls"] += 1
+
+    def summary(self) -> Dict[str, dict]:
+        with self._lock:
+            report = {}
+            for stage, stage_stats in self._stats.items():
+                calls = stage_stats["calls"]
+                report[stage] = {
+                    "calls": calls,
+                    "escalation_rate": round(stage_stats["escalations"] / calls, 4) if calls else 0.0,
+                    "tiers": {
+                        tier: {
+                            "model": model_for(tier),
+                            "calls": t["calls"],
+                            "avg_ms": round(t["total_ms"] / t["calls"], 1) if t["calls"] else 0.0,
+                        }
+                        for tier, t in stage_stats["tiers"].items()
+                    },
+                }
+            return report
+
+
+tier_stats = TierStats()
+
+
+def run_tiered(
+    stage: str,
+    call: Callable[[GatewayLLM], object],
+    validate: Callable[[object], Optional[str]],
+):
+    """
+    Run `call(llm)` on the stage's configured tier. If the stage starts on the
+    small tier and `validate(result)` returns a reason (or the call raises),
+    escalate once to the large tier. Returns (result, tier used).
+    """
+    tier = stage_tier(stage)
+    tier_stats.start_call(stage)
+
+    start = time.perf_counter()
+    reason = None
+    try:
+        with span(f"{stage}:{tier}"):
+            result = call(get_stage_llm(stage, tier))
+        reason = validate(result)
+    except Exception as e:
+        if tier != "small":
+            raise
+        result, reason = None, f"error: {str(e)}"
+    latency_ms = (time.perf_counter() - start) * 1000.0
+
+    if reason is None or tier != "small":
+        tier_stats.record(stage, tier, latency_ms)
+        logger.info(f"[tier] stage={stage} tier={tier} model={model_for(tier)} latency_ms={latency_ms:.0f}")
+        if reason is not None:
+            logger.warning(f"[tier] stage={stage} result from {model_for(tier)} still fails validation: {reason}")
+        return result, tier
+
+    tier_stats.record(stage, "small", latency_ms, escalated=True)
+    logger.info(
+        f"[tier] stage={stage} escalating {model_for('small')} -> {model_for('large')} "
+        f"after {latency_ms:.0f} ms ({reason})"
+    )
+
+    start = time.perf_counter()
+    with span(f"{stage}:large", escalation_reason=reason) as s:
+        result = call(get_stage_llm(stage, "large"))
+        reason = validate(result)
+        if reason is not None and s is not None:
+            s.set(validation_failure=reason)
+    latency_ms = (time.perf_counter() - start) * 1000.0
+    tier_stats.record(stage, "large", latency_ms)
+    logger.info(f"[tier] stage={stage} tier=large model={model_for('large')} latency_ms={latency_ms:.0f}")
+    if reason is not None:
+        # Nothing left to escalate to: the result is returned, but not silently
+        logger.warning(f"[tier] stage={stage} result from {model_for('large')} still fails validation: {reason}")
+    return result, "large"
@@ -9,6 +9,8 @@ This version:
 """
 
 import os
+import threading
+import time
 from typing import Literal
 from dotenv import load_dotenv
 load_dotenv("../config/.env")
@@ -16,60 +18,141 @@ load_dotenv("../config/.env")
 # ----------------------------------------------
 # 1) IMPORT MODULES
 # ----------------------------------------------
-from sql_query_chain import ask_fars_database
-from langchain_ollama import ChatOllama
-from langchain_community.vectorstores import FAISS
+from sql_query_chain import ask_fars_database, ask_fars_database_stream, get_column_metadata
 from langchain_huggingface import HuggingFaceEmbeddings
+from retrievers import FanOutRetriever
+from query_filters import ConstraintParser
+from vector_store import load_vectorstore
+from sparse_index import load_sparse_index
+from registry import registry, project_path
+from tracing import span, record_tokens
+from model_tiers import get_stage_llm, run_tiered
 
 # ----------------------------------------------
-# 2) LOAD ACCIDENT FAISS INDEX
+# 2) REGISTER EMBEDDINGS AND FAISS INDEXES
 # ----------------------------------------------
-
-FAISS_PATH = "../../accident_master_faiss"
-
-print(f"Loading FAISS vectorstore from: {FAISS_PATH}")
-
-embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
-
-vectorstore = FAISS.load_local(
-    FAISS_PATH,
-    embeddings=embeddings,
-    allow_dangerous_deserialization=True
-)
-
-accident_retriever = vectorstore.as_retriever(search_kwargs={"k": 4})
+# Nothing is loaded at import time: the registry builds each resource on
+# first use, or up front via registry.warm_up().
+
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+FAISS_PATH = os.getenv("ACCIDENT_FAISS_PATH", project_path("accident_master_faiss"))
+CODEBOOK_FAISS_PATH = os.getenv("CODEBOOK_FAISS_PATH", project_path("fars_codebook_faiss"))
+
+
+def _load_embeddings():
+    return HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
+
+
+def _index_version(path: str):
+    """Live version of an index managed by RAG Pipeline/index_manager.py (None if unversioned)."""
+    try:
+        with open(os.path.join(path, "CURRENT")) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def _live_path(name: str, path: str) -> str:
+    """Resolve the live version directory and remember which version `name` loaded."""
+    version = _index_version(path)
+    _loaded_versions[name] = version
+    return os.path.join(path, "versions", version) if version else path
+
+
+def _load_faiss(name: str, path: str):
+    def loader():
+        live_path = _live_path(name, path)
+        print(f"Loading FAISS vectorstore from: {live_path}")
+        # Memory-mapped index + on-demand SQLite docstore (see vector_store.py)
+        return load_vectorstore(live_path, registry.get("embeddings"))
+    return loader
+
+
+def _load_sparse(name: str, path: str):
+    # Memory-mapped BM25 index built next to the vectorstore (None if absent)
+    return lambda: load_sparse_index(_live_path(name, path))
+
+
+def _load_rag_retriever():
+    # One query embedding, parallel dense (+ BM25) searches, fused global top-k
+    return FanOutRetriever(
+        {
+            "accident": registry.get("accident_vectorstore"),
+            "codebook": registry.get("codebook_vectorstore"),
+        },
+        embeddings=registry.get("embeddings"),
+        k=8,
+        fetch_k=4,
+        constraint_parser=registry.get("constraint_parser"),
+        sparse_indexes={
+            "accident": registry.get("accident_sparse"),
+            "codebook": registry.get("codebook_sparse"),
+        },
+    )
+
+
+registry.register("embeddings", _load_embeddings)
+registry.register("constraint_parser", lambda: ConstraintParser(get_column_metadata()))
+registry.register("accident_vectorstore", _load_faiss("accident_vectorstore", FAISS_PATH))
+registry.register("codebook_vectorstore", _load_faiss("codebook_vectorstore", CODEBOOK_FAISS_PATH))
+registry.register("accident_sparse", _load_sparse("accident_sparse", FAISS_PATH))
+registry.register("codebook_sparse", _load_sparse("codebook_sparse", CODEBOOK_FAISS_PATH))
+registry.register("rag_retriever", _load_rag_retriever)
 
 # ----------------------------------------------
-# 2a) LOAD FARS CODEBOOK FAISS INDEX
+# Hot reload of versioned indexes
 # ----------------------------------------------
-CODEBOOK_FAISS_PATH = "../../fars_codebook_faiss"
-
-print(f"Loading Codebook FAISS vectorstore from: {CODEBOOK_FAISS_PATH}")
-
-codebook_vectorstore = FAISS.load_local(
-    CODEBOOK_FAISS_PATH,
-    embeddings=embeddings,
-    allow_dangerous_deserialization=True
-)
-
-codebook_retriever = codebook_vectorstore.as_retriever(search_kwargs={"k": 4})
+# index_manager.py publishes a new index version by atomically replacing
+# CURRENT; the next RAG request after that picks it up without a restart.
+INDEX_RELOAD_INTERVAL = float(os.getenv("INDEX_RELOAD_INTERVAL", "30"))
+
+_loaded_versions = {}
+_reload_lock = threading.Lock()
+_last_reload_check = 0.0
+
+_INDEX_RESOURCES = {
+    "accident_vectorstore": FAISS_PATH,
+    "codebook_vectorstore": CODEBOOK_FAISS_PATH,
+    "accident_sparse": FAISS_PATH,
+    "codebook_sparse": CODEBOOK_FAISS_PATH,
+}
+
+
+def maybe_reload_indexes() -> None:
+    """Invalidate indexes (and what was built from them) whose version changed."""
+    global _last_reload_check
+    now = time.monotonic()
+    if now - _last_reload_check < INDEX_RELOAD_INTERVAL or not _reload_lock.acquire(blocking=False):
+        return
+    try:
+        _last_reload_check = now
+        stale = [
+            name for name, path in _INDEX_RESOURCES.items()
+            if registry.is_loaded(name) and _index_version(path) != _loaded_versions.get(name)
+        ]
+        for name in stale:
+            print(f"New version of {_INDEX_RESOURCES[name]} found, reloading")
+            registry.invalidate(name)
+        if stale:
+            registry.invalidate("rag_retriever")
+            registry.invalidate("rag_qa")
+    finally:
+        _reload_lock.release()
 
 # ----------------------------------------------
-# 3) SIMPLE RAG QA (supporting both retrievers)
+# 3) SIMPLE RAG QA
 # ----------------------------------------------
 class SimpleRAGQA:
-    def __init__(self, accident_retriever, codebook_retriever, llm):
-        self.accident_retriever = accident_retriever
-        self.codebook_retriever = codebook_retriever
+    def __init__(self, retriever, llm):
+        self.retriever = retriever
         self.llm = llm
 
-    def answer(self, query: str):
-        # Query both FAISS indexes
-        accident_docs = self.accident_retriever.invoke(query)
-        codebook_docs = self.codebook_retriever.invoke(query)
-
-        # Combine results
-        source_docs = accident_docs + codebook_docs
+    def build_prompt(self, query: str):
+        # Single fan-out search across every FAISS index
+        with span("retrieval") as s:
+            source_docs = self.retriever.invoke(query)
+            if s:
+                s.set(documents=len(source_docs))
 
         context = "\n\n".join(doc.page_content for doc in source_docs)
 
@@ -87,20 +170,34 @@ Question:
 
 Answer in clear, concise English:
 """
-        response = self.llm.invoke(prompt)
+        return prompt, source_docs
+
+    def answer(self, query: str):
+        prompt, _ = self.build_prompt(query)
+        with span("rag_llm", prompt_chars=len(prompt)):
+            response = self.llm.invoke(prompt)
+            record_tokens(response)
         return getattr(response, "content", str(response)).strip()
 
-rag_llm = ChatOllama(model="llama3", temperature=0.0)
-rag_qa = SimpleRAGQA(accident_retriever, codebook_retriever, rag_llm)
+    def answer_stream(self, query: str):
+        """Yield the answer text chunk by chunk as the LLM produces it."""
+        prompt, _ = self.build_prompt(query)
+        for chunk in self.llm.stream(prompt):
+            text = getattr(chunk, "content", str(chunk))
+            if text:
+                yield text
+
+rag_llm = get_stage_llm("rag")
+registry.register("rag_qa", lambda: SimpleRAGQA(registry.get("rag_retriever"), rag_llm))
 
 def run_rag(question: str) -> str:
-    return rag_qa.answer(question)
+    maybe_reload_indexes()
+    with span("rag"):
+        return registry.get("rag_qa").answer(question)
 
 # ----------------------------------------------
-# 4) ROUTER LLM
+# 4) ROUTER (small model tier, see model_tiers.py)
 # ----------------------------------------------
-router_llm = ChatOllama(model="llama3", temperature=0)
-
 ROUTER_PROMPT = """
 You are a routing classifier for a hybrid SQL + RAG system for the FARS dataset.
 
@@ -122,11 +219,27 @@ QUESTION:
 LABEL ONLY:
 """
 
+ROUTE_LABELS = {"sql", "rag"}
+
 def route(question: str) -> Literal["sql", "rag"]:
     prompt = ROUTER_PROMPT.format(question=question)
-    response = router_llm.invoke(prompt)
-    label = getattr(response, "content", "").strip().lower()
-    return label if label in {"sql", "rag"} else "rag"
+
+    def classify(llm):
+        response = llm.invoke(prompt)
+        record_tokens(response)
+        return getattr(response, "content", "").strip().strip('"\'.').lower()
+
+    # Small model first; anything but an exact label counts as low confidence
+    # and is re-asked on the large model
+    with span("route") as s:
+        label, tier = run_tiered(
+            "routing",
+            classify,
+            lambda label: None if label in ROUTE_LABELS else f"unexpected label {label!r}",
+        )
+        if s:
+            s.set(label=label, tier=tier)
+    return label if label in ROUTE_LABELS else "rag"
 
 # ----------------------------------------------
 # 5) ORCHESTRATION LAYER
@@ -135,10 +248,37 @@ def answer_question(question: str):
     choice = route(question)
 
     if choice == "sql":
-        return ask_fars_database(question)
+        with span("sql"):
+            return ask_fars_database(question)
     else:  # rag
         return run_rag(question)
 
+
+def answer_question_stream(question: str):
+    """
+    Event-by-event version of answer_question() for streaming clients.
+    Yields (event, data) tuples: first ("route", ...), then the SQL stage events
+    from ask_fars_database_stream() or RAG ("token", ...) events, ending with
+    ("answer", ...) or ("error", ...).
+    """
+    choice = route(question)
+    yield "route", {"route": choice}
+
+    if choice == "sql":
+        yield from ask_fars_database_stream(question)
+        return
+
+    # rag
+    maybe_reload_indexes()
+    try:
+        parts = []
+        for text in registry.get("rag_qa").answer_stream(question):
+            parts.append(text)
+            yield "token", {"text": text}
+        yield "answer", {"answer": "".join(parts).strip()}
+    except Exception as e:
+        yield "error", {"error": f"RAG error: {str(e)}"}
+
 # ----------------------------------------------
 # 6) CLI
 # ----------------------------------------------
@@ -0,0 +1,97 @@
+"""
+Structured constraints for metadata-filtered retrieval.
+
+ConstraintParser pulls YEAR, STATE and a few coded accident fields out of a
+natural-language question, e.g.
+
+    "a crash in Virginia in 2019 involving a school bus"
+        -> {"YEAR": [2019], "STATE": [51], "SCH_BUS": [1]}
+
+State names and value labels come from the FARS codebook, so the codes match
+the ones stored in document metadata by build_vectorstore.py. The retriever
+uses the result to restrict the vector search to matching documents.
+"""
+
+import logging
+import re
+from typing import Dict, List
+
+from metadata_extractor import KEYWORD_MAPPINGS, extract_years
+
+logger = logging.getLogger(__name__)
+
+# accident columns that documents carry in metadata (see build_vectorstore.METADATA_COLS)
+FILTER_COLUMNS = ["STATE", "MONTH", "DAY_WEEK", "WEATHER", "LGT_COND", "RUR_URB", "SCH_BUS"]
+
+# Labels that say nothing about the crash itself
+GENERIC_LABELS = {"yes", "no", "other", "none", "not applicable"}
+
+# Labels that are also everyday words; only matched with the codebook's capitalization
+CASE_SENSITIVE_LABELS = {"May"}
+
+
+class ConstraintParser:
+    def __init__(self, column_metadata: Dict[str, Dict[str, Dict]], table: str = "accident"):
+        phrases: Dict[str, tuple] = {}
+        case_sensitive: Dict[str, tuple] = {}
+
+        table_meta = column_metadata.get(table, {})
+        for column in FILTER_COLUMNS:
+            codes = table_meta.get(column, {}).get("codes", {})
+            for code, label in codes.items():
+                if not code.isdigit():
+                    continue
+                clean = label.strip()
+                lowered = clean.lower()
+                if lowered in GENERIC_LABELS or "unknown" in lowered or "not reported" in lowered:
+                    continue
+                if clean in CASE_SENSITIVE_LABELS:
+                    case_sensitive[clean] = (column, int(code))
+                else:
+                    phrases.setdefault(lowered, (column, int(code)))
+
+            # Yes/No flags (e.g. SCH_BUS) are matched on their keywords instead
+            yes_codes = [int(c) for c, label in codes.items() if label.strip().lower() == "yes" and c.isdigit()]
+            if yes_codes:
+                for keyword in KEYWORD_MAPPINGS.get(column, []):
+                    phrases.setdefault(keyword.lower(), (column, yes_codes[0]))
+
+        self.phrases = phrases
+        self.case_sensitive = case_sensitive
+        # Longest phrase first, so "West Virginia" wins over "Virginia"
+        self._pattern = self._compile(phrases, re.IGNORECASE)
+        self._cs_pattern = self._compile(case_sensitive, 0)
+        logger.info(f"Constraint parser built with {len(phrases) + len(case_sensitive)} phrases")
+
+    @staticmethod
+    def _compile(phrases: Dict[str, tuple], flags: int):
+        if not phrases:
+            return None
+        alternatives = sorted(phrases, key=len, reverse=True)
+        return re.compile(r"\b(" + "|".join(re.escape(p) for p in alternatives) + r")\b", flags)
+
+    def parse(self, question: str) -> Dict[str, List[int]]:
+        """Return {column: [codes]} for every constraint found in the question."""
+        constraints: Dict[str, List[int]] = {}
+
+        def add(column: str, code: int):
+            values = constraints.setdefault(column, [])
+            if code not in values:
+                values.append(code)
+
+        # Years, with ranges expanded
+        for year in extract_years(question):
+            add("YEAR", year)
+
+        if self._pattern is not None:
+            for match in self._pattern.finditer(question):
+                add(*self.phrases[match.group(1).lower()])
+        if self._cs_pattern is not None:
+            for match in self._cs_pattern.finditer(question):
+                add(*self.case_sensitive[match.group(1)])
+
+        if constraints:
+            logger.info(f"Retrieval constraints: {constraints}")
+        return constraints
+
+    __call__ = parse
@@ -0,0 +1,131 @@
+"""
+Process-wide registry for expensive shared resources (embedding models,
+FAISS indexes, codebook metadata).
+
+Modules register a loader at import time, which is cheap; the resource itself
+is only built on first `get()` or on an explicit `warm_up()`.
+
+Fork safety: when the registry is warmed in a parent process before workers
+fork (e.g. `gunicorn --preload`), children inherit the loaded objects
+copy-on-write and never reload them. Locks are re-created in every child so a
+load that was in progress in another thread at fork time cannot deadlock it.
+"""
+
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ResourceRegistry:
+    def __init__(self):
+        self._loaders: Dict[str, Callable[[], Any]] = {}
+        self._resources: Dict[str, Any] = {}
+        self._errors: Dict[str, str] = {}
+        self._load_times: Dict[str, float] = {}
+        self._init_locks()
+
+    def _init_locks(self):
+        self._lock = threading.Lock()
+        self._name_locks: Dict[str, threading.Lock] = {}
+
+    def _name_lock(self, name: str) -> threading.Lock:
+        with self._lock:
+            if name not in self._name_locks:
+                self._name_locks[name] = threading.Lock()
+            return self._name_locks[name]
+
+    def register(self, name: str, loader: Callable[[], Any]) -> None:
+        """Register (or replace) the loader for a named resource."""
+        with self._lock:
+            self._loaders[name] = loader
+            self._resources.pop(name, None)
+            self._errors.pop(name, None)
+
+    def get(self, name: str) -> Any:
+        """Return a resource, loading it on first use."""
+        if name in self._resources:
+            return self._resources[name]
+
+        if name not in self._loaders:
+            raise KeyError(f"No loader registered for resource '{name}'")
+
+        with self._name_lock(name):
+            # Another thread may have finished loading while we waited
+            if name in self._resources:
+                return self._resources[name]
+
+            start = time.perf_counter()
+            try:
+                resource = self._loaders[name]()
+            except Exception as e:
+                self._errors[name] = str(e)
+                logger.error(f"Failed to load resource '{name}': {str(e)}")
+                raise
+
+            self._resources[name] = resource
+            self._errors.pop(name, None)
+            self._load_times[name] = time.perf_counter() - start
+            logger.info(f"Loaded resource '{name}' in {self._load_times[name]:.2f}s")
+            return resource
+
+    def is_loaded(self, name: str) -> bool:
+        return name in self._resources
+
+    def is_registered(self, name: str) -> bool:
+        return name in self._loaders
+
+    def invalidate(self, name: str) -> None:
+        """Drop a loaded resource so the next `get()` reloads it."""
+        with self._name_lock(name):
+            self._resources.pop(name, None)
+            self._load_times.pop(name, None)
+
+    def warm_up(self, names: Optional[Iterable[str]] = None) -> Dict[str, str]:
+        """
+        Eagerly load resources (all registered ones by default).
+        Failures are recorded rather than raised so one missing index does not
+        stop the rest from loading.
+        """
+        for name in list(names or self._loaders):
+            try:
+                self.get(name)
+            except Exception:
+                pass
+        return self.status()
+
+    def warm_up_async(self, names: Optional[Iterable[str]] = None) -> threading.Thread:
+        """Run `warm_up()` in a daemon thread; poll `is_ready()` for completion."""
+        thread = threading.Thread(target=self.warm_up, args=(names,), name="registry-warmup", daemon=True)
+        thread.start()
+        return thread
+
+    def is_ready(self, names: Optional[Iterable[str]] = None) -> bool:
+        return all(name in self._resources for name in (names or self._loaders))
+
+    def status(self) -> Dict[str, str]:
+        status = {}
+        for name in self._loaders:
+            if name in self._resources:
+                status[name] = f"loaded ({self._load_times.get(name, 0.0):.2f}s)"
+            elif name in self._errors:
+                status[name] = f"failed: {self._errors[name]}"
+            else:
+                status[name] = "not loaded"
+        return status
+
+
+# Single shared instance for the whole process
+registry = ResourceRegistry()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=registry._init_locks)
+
+
+def project_path(*parts: str) -> str:
+    """Resolve a path relative to the repository root, independent of the cwd."""
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+    return os.path.normpath(os.path.join(root, *parts))
@@ -0,0 +1,169 @@
+"""
+Retrievers for the FARS RAG pipeline.
+
+FanOutRetriever embeds a question once and searches several FAISS indexes
+concurrently, merging the hits into a single global top-k. With a
+constraint parser (query_filters.ConstraintParser) each index search is
+restricted to documents whose YEAR/STATE/coded metadata match the question.
+Indexes that have a BM25 sparse index (sparse_index.py) are also searched
+lexically, and all ranked lists are combined with reciprocal-rank fusion.
+"""
+
+import contextvars
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+from langchain_core.documents import Document
+from langchain_community.vectorstores import FAISS
+
+from sparse_index import SparseIndex
+from tracing import span
+from vector_store import SQLiteDocstore, filter_fields, filtered_search_by_vector
+
+logger = logging.getLogger(__name__)
+
+
+class FanOutRetriever:
+    """
+    Query several FAISS vectorstores that share one embedding model.
+
+    The query is embedded once, every index is searched in parallel with the
+    same vector, raw distances are converted to each store's normalized
+    relevance score (0..1, higher is better) and the merged list is
+    de-duplicated and cut to a global top-k.
+
+    When `sparse_indexes` are given (index name -> SparseIndex), those indexes
+    also return BM25 hits and every ranked list, dense and sparse, is fused
+    with reciprocal-rank fusion: score = sum(1 / (rrf_k + rank)).
+    """
+
+    def __init__(
+        self,
+        vectorstores: Dict[str, FAISS],
+        embeddings,
+        k: int = 8,
+        fetch_k: int = 4,
+        max_workers: Optional[int] = None,
+        constraint_parser: Optional[Callable[[str], Dict[str, List[int]]]] = None,
+        sparse_indexes: Optional[Dict[str, SparseIndex]] = None,
+        rrf_k: int = 60,
+    ):
+        self.vectorstores = dict(vectorstores)
+        self.embeddings = embeddings
+        self.k = k
+        self.fetch_k = fetch_k
+        self.constraint_parser = constraint_parser
+        self.sparse_indexes = {name: idx for name, idx in (sparse_indexes or {}).items() if idx is not None}
+        self.rrf_k = rrf_k
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers or max(1, len(self.vectorstores)),
+            thread_name_prefix="fanout",
+        )
+
+    def _search_one(
+        self,
+        name: str,
+        vectorstore: FAISS,
+        query: str,
+        embedding: List[float],
+        constraints: Dict[str, List[int]],
+    ) -> List[List[Tuple[Document, float, str]]]:
+        """Ranked hit lists for one index: dense first, then sparse if it has one."""
+        # Only apply the constraints this index's documents actually carry
+        # (the codebook index has no YEAR or STATE, for example)
+        fields = filter_fields(vectorstore) if constraints else set()
+        applicable = {f: v for f, v in constraints.items() if f in fields}
+
+        with span(f"index_search:{name}") as s:
+            hits = []
+            if applicable:
+                hits = filtered_search_by_vector(vectorstore, embedding, self.fetch_k, applicable)
+                if not hits:
+                    logger.info(f"No documents in '{name}' match {applicable}; searching unfiltered")
+                    applicable = {}
+            if not hits:
+                hits = vectorstore.similarity_search_with_score_by_vector(embedding, k=self.fetch_k)
+            if s:
+                s.set(filter=applicable or None, hits=len(hits))
+        score_fn = vectorstore._select_relevance_score_fn()
+        ranked = [[(doc, score_fn(distance), name) for doc, distance in hits]]
+
+        sparse = self.sparse_indexes.get(name)
+        if sparse is not None:
+            with span(f"sparse_search:{name}") as s:
+                allowed = None
+                if applicable and isinstance(vectorstore.docstore, SQLiteDocstore):
+                    allowed = vectorstore.docstore.positions(applicable)
+                sparse_hits = sparse.search(query, k=self.fetch_k, allowed=allowed)
+                ranked.append([
+                    (vectorstore.docstore.search(vectorstore.index_to_docstore_id[pos]), score, name)
+                    for pos, score in sparse_hits
+                ])
+                if s:
+                    s.set(hits=len(sparse_hits))
+        return ranked
+
+    def _fuse(self, ranked_lists: List[List[Tuple[Document, float, str]]]) -> List[Tuple[Document, float, str]]:
+        """Reciprocal-rank fusion keyed on chunk text."""
+        fused: Dict[str, list] = {}
+        for hits in ranked_lists:
+            for rank, (doc, _, name) in enumerate(hits):
+                if not isinstance(doc, Document):
+                    continue
+                entry = fused.setdefault(doc.page_content, [doc, 0.0, name])
+                entry[1] += 1.0 / (self.rrf_k + rank + 1)
+        return [tuple(entry) for entry in fused.values()]
+
+    def search(self, query: str) -> List[Tuple[Document, float, str]]:
+        """
+        Return (document, score, index name) tuples, best first. The score is
+        the normalized relevance score, or the RRF score in hybrid mode.
+        """
+        with span("embed_query"):
+            embedding = self.embeddings.embed_query(query)
+
+        constraints = self.constraint_parser(query) if self.constraint_parser else {}
+
+        # Copy the context per task so index spans attach to the active trace
+        futures = [
+            self._executor.submit(
+                contextvars.copy_context().run, self._search_one, name, vs, query, embedding, constraints
+            )
+            for name, vs in self.vectorstores.items()
+        ]
+
+        ranked_lists = []
+        for future in futures:
+            try:
+                ranked_lists.extend(future.result())
+            except Exception as e:
+                logger.error(f"Index search failed: {str(e)}")
+
+        if self.sparse_indexes:
+            merged = self._fuse(ranked_lists)
+        else:
+            merged = [hit for hits in ranked_lists for hit in hits]
+        merged.sort(key=lambda hit: hit[1], reverse=True)
+
+        # Drop duplicates (the same chunk can live in more than one index)
+        seen = set()
+        results = []
+        for doc, score, name in merged:
+            key = doc.page_content
+            if key in seen:
+                continue
+            seen.add(key)
+            results.append((doc, score, name))
+            if len(results) >= self.k:
+                break
+        return results
+
+    def invoke(self, query: str) -> List[Document]:
+        """Retriever-style entry point: documents only, tagged with their source index."""
+        docs = []
+        for doc, score, name in self.search(query):
+            metadata = dict(doc.metadata)
+            metadata.update({"index": name, "score": score})
+            docs.append(Document(page_content=doc.page_content, metadata=metadata))
+        return docs
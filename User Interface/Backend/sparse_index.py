@@ -0,0 +1,193 @@
+"""
+Memory-mapped BM25 index over FARS documents, built next to each vectorstore.
+
+Row documents are "COL: value" lines full of codes ("HARM_EV: 12",
+"ST_CASE: 10001") that dense MiniLM embeddings match poorly. The sparse index
+tokenizes every line into plain terms plus field-qualified terms
+("harm_ev=12", and "weather=2" / "weather=rain" for a decoded "WEATHER: Rain (2)"),
+so exact codes and case numbers are found precisely.
+
+On-disk layout (<index>/sparse/), all flat arrays opened with np.memmap:
+
+    terms.u64     sorted 64-bit term hashes (binary-searched at query time)
+    offsets.i64   postings range of each term
+    docs.i32      postings: index positions (same positions as the FAISS index)
+    impacts.f32   postings: precomputed BM25 weight (idf x saturated tf)
+    meta.json     document count, average length, k1, b
+
+Scoring a query is a sum of the impacts of its terms, so nothing is
+recomputed per query and workers share the pages through the OS cache.
+"""
+
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+import shutil
+from collections import Counter, defaultdict
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SPARSE_DIR = "sparse"
+
+WORD_RE = re.compile(r"[a-z0-9_]+(?:\.[0-9]+)?")
+# Decoded values carry their code: "WEATHER: Rain (2)"
+DECODED_VALUE_RE = re.compile(r"^(.*?)\s*\((-?\d+)\)$")
+FIELD_LINE_RE = re.compile(r"^\s*([A-Za-z][A-Za-z0-9_]*)\s*:\s*(.+?)\s*$", re.MULTILINE)
+# "HARM_EV 12", "HARM_EV = 12", "st_case: 10001" in a question
+QUERY_FIELD_RE = re.compile(r"\b([A-Za-z][A-Za-z0-9]*_[A-Za-z0-9_]+|[A-Z]{3,})\s*[:=]?\s*(-?\d+(?:\.\d+)?)\b")
+
+
+# ---------------- Tokenization ----------------
+def _value_token(value: str) -> str:
+    value = value.strip().lower()
+    # "12.0" and "12" are the same code
+    if re.fullmatch(r"-?\d+\.0+", value):
+        value = value.split(".")[0]
+    return value
+
+def document_terms(text: str) -> List[str]:
+    terms = WORD_RE.findall(text.lower())
+    for col, value in FIELD_LINE_RE.findall(text):
+        decoded = DECODED_VALUE_RE.match(value)
+        if decoded:
+            terms.append(f"{col.lower()}={decoded.group(2)}")
+            value = decoded.group(1)
+        terms.append(f"{col.lower()}={_value_token(value)}")
+    return terms
+
+def query_terms(question: str) -> List[str]:
+    terms = WORD_RE.findall(question.lower())
+    for col, value in QUERY_FIELD_RE.findall(question):
+        terms.append(f"{col.lower()}={_value_token(value)}")
+    return terms
+
+def term_hash(term: str) -> int:
+    return int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+# ---------------- Build ----------------
+def build_sparse_index(texts: Iterable[str], path: str, k1: float = 1.2, b: float = 0.75) -> int:
+    """
+    Build the BM25 index for texts given in index-position order and write it
+    to <path>/sparse. Returns the number of documents indexed.
+    """
+    postings = defaultdict(list)  # term hash -> [(pos, tf)]
+    lengths = []
+    for pos, text in enumerate(texts):
+        counts = Counter(document_terms(text))
+        lengths.append(sum(counts.values()))
+        for term, tf in counts.items():
+            postings[term_hash(term)].append((pos, tf))
+
+    num_docs = len(lengths)
+    lengths = np.asarray(lengths, dtype=np.float32)
+    avgdl = float(lengths.mean()) if num_docs else 0.0
+
+    terms = np.fromiter(sorted(postings), dtype=np.uint64, count=len(postings))
+    offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    docs_parts, impact_parts = [], []
+    for i, h in enumerate(terms):
+        plist = postings[int(h)]
+        pos = np.fromiter((p for p, _ in plist), dtype=np.int32, count=len(plist))
+        tf = np.fromiter((t for _, t in plist), dtype=np.float32, count=len(plist))
+        idf = math.log(1 + (num_docs - len(plist) + 0.5) / (len(plist) + 0.5))
+        norm = k1 * (1 - b + b * lengths[pos] / max(avgdl, 1e-9))
+        docs_parts.append(pos)
+        impact_parts.append((idf * tf * (k1 + 1) / (tf + norm)).astype(np.float32))
+        offsets[i + 1] = offsets[i] + len(plist)
+
+    out = os.path.join(path, SPARSE_DIR)
+    tmp = out + ".tmp"
+    os.makedirs(tmp, exist_ok=True)
+    terms.tofile(os.path.join(tmp, "terms.u64"))
+    offsets.tofile(os.path.join(tmp, "offsets.i64"))
+    (np.concatenate(docs_parts) if docs_parts else np.zeros(0, np.int32)).tofile(os.path.join(tmp, "docs.i32"))
+    (np.concatenate(impact_parts) if impact_parts else np.zeros(0, np.float32)).tofile(os.path.join(tmp, "impacts.f32"))
+    with open(os.path.join(tmp, "meta.json"), "w") as f:
+        json.dump({"num_docs": num_docs, "num_terms": len(terms), "avgdl": avgdl, "k1": k1, "b": b}, f)
+
+    if os.path.exists(out):
+        shutil.rmtree(out)
+    os.replace(tmp, out)
+    return num_docs
+
+def build_for_vectorstore(vectorstore, path: str) -> int:
+    """Index a LangChain FAISS vectorstore's documents in FAISS position order."""
+    def texts():
+        for pos in range(vectorstore.index.ntotal):
+            yield vectorstore.docstore.search(vectorstore.index_to_docstore_id[pos]).page_content
+
+    count = build_sparse_index(texts(), path)
+    print(f"Sparse BM25 index built for {count} documents in {os.path.join(path, SPARSE_DIR)}")
+    return count
+
+
+# ---------------- Query ----------------
+class SparseIndex:
+    def __init__(self, path: str, max_df_ratio: float = 0.5):
+        base = os.path.join(path, SPARSE_DIR)
+        with open(os.path.join(base, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.num_docs = self.meta["num_docs"]
+        # Terms in more than half the documents (column names, common codes)
+        # carry almost no BM25 weight but cost the most to score
+        self.max_df = max(1, int(max_df_ratio * self.num_docs))
+
+        def mmap(name, dtype):
+            file = os.path.join(base, name)
+            if os.path.getsize(file) == 0:
+                return np.zeros(0, dtype=dtype)
+            return np.memmap(file, dtype=dtype, mode="r")
+
+        self.terms = mmap("terms.u64", np.uint64)
+        self.offsets = mmap("offsets.i64", np.int64)
+        self.docs = mmap("docs.i32", np.int32)
+        self.impacts = mmap("impacts.f32", np.float32)
+
+    def _postings(self, term: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        h = np.uint64(term_hash(term))
+        i = int(np.searchsorted(self.terms, h))
+        if i >= len(self.terms) or self.terms[i] != h:
+            return None
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        if end - start > self.max_df:
+            return None
+        return self.docs[start:end], self.impacts[start:end]
+
+    def search(self, question: str, k: int = 10, allowed: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        """Top-k (position, BM25 score), optionally restricted to `allowed` positions."""
+        doc_parts, impact_parts = [], []
+        for term in set(query_terms(question)):
+            hit = self._postings(term)
+            if hit is not None:
+                doc_parts.append(hit[0])
+                impact_parts.append(hit[1])
+        if not doc_parts:
+            return []
+
+        positions = np.concatenate(doc_parts)
+        impacts = np.concatenate(impact_parts)
+        if allowed is not None:
+            keep = np.isin(positions, allowed)
+            positions, impacts = positions[keep], impacts[keep]
+            if len(positions) == 0:
+                return []
+
+        unique, inverse = np.unique(positions, return_inverse=True)
+        scores = np.bincount(inverse, weights=impacts)
+        top = np.argsort(-scores)[:k] if len(scores) <= k else np.argpartition(-scores, k)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(unique[i]), float(scores[i])) for i in top]
+
+
+def load_sparse_index(path: str) -> Optional[SparseIndex]:
+    """The sparse index saved next to a vectorstore, or None if it was never built."""
+    if not os.path.exists(os.path.join(path, SPARSE_DIR, "meta.json")):
+        return None
+    return SparseIndex(path)
@@ -1,12 +1,16 @@
-from langchain_ollama import ChatOllama
 from dotenv import load_dotenv
 import os
 import re 
 import pandas as pd
 from databricks import sql
 import logging
-from metadata_loader import load_fars_codebook
-from metadata_extractor import extract_relevant_metadata
+from metadata_loader import load_fars_codebook, load_year_codebook, ColumnIndex, codebook_table
+from metadata_extractor import extract_relevant_metadata, extract_relevant_columns, extract_years, extract_sql_years
+from label_index import LabelIndex, filter_years, format_predicate_hints, resolved_codes
+from column_retriever import ColumnRetriever
+from registry import registry, project_path
+from tracing import span, record_tokens
+from model_tiers import get_stage_llm, run_tiered
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -16,7 +20,26 @@ logger = logging.getLogger(__name__)
 load_dotenv("../../config/.env")
 
 # ---------------- Column Metadata ---------------- 
-COLUMN_METADATA = load_fars_codebook("../../fars_codebook.csv")
+# Parsed lazily through the shared registry instead of at import time
+CODEBOOK_CSV_PATH = os.getenv("FARS_CODEBOOK_PATH", project_path("fars_codebook.csv"))
+
+registry.register("column_metadata", lambda: load_fars_codebook(CODEBOOK_CSV_PATH))
+
+registry.register("year_codebook", lambda: load_year_codebook(CODEBOOK_CSV_PATH))
+
+registry.register("column_index", lambda: ColumnIndex(get_column_metadata()))
+
+def get_column_metadata() -> dict:
+    """Return the parsed FARS codebook, loading it on first use."""
+    return registry.get("column_metadata")
+
+def get_year_codebook():
+    """Return the per-year codebook ((table, column, year) -> codes), loading it on first use."""
+    return registry.get("year_codebook")
+
+def get_column_index() -> ColumnIndex:
+    """Return the (table, column) -> metadata index over the codebook, building it on first use."""
+    return registry.get("column_index")
 
 # --------- Databricks Connection and Execution ---------
 def run_databricks_query(query: str) -> pd.DataFrame:
@@ -31,9 +54,11 @@ def run_databricks_query(query: str) -> pd.DataFrame:
             access_token=os.getenv("DATABRICKS_TOKEN")
         ) as connection:
             with connection.cursor() as cursor:
-                cursor.execute(query)
-                arrow_table = cursor.fetchall_arrow()
-                df = arrow_table.to_pandas()
+                with span("warehouse_execution"):
+                    cursor.execute(query)
+                    arrow_table = cursor.fetchall_arrow()
+                with span("arrow_to_pandas", rows=arrow_table.num_rows):
+                    df = arrow_table.to_pandas()
                 logger.info(f"Query executed successfully, returned {len(df)} rows")
                 return df
     except Exception as e:
@@ -41,19 +66,12 @@ def run_databricks_query(query: str) -> pd.DataFrame:
         raise
 
 # ---------------- Ollama LLM ----------------
-llm = None
-
-def get_llm():
-    """Lazy initialization of LLM"""
-    global llm
-    if llm is None:
-        try:
-            llm = ChatOllama(model="llama3", temperature=0)
-            logger.info("LLM initialized successfully")
-        except Exception as e:
-            logger.error(f"Failed to initialize LLM: {str(e)}")
-            raise
-    return llm
+def get_llm(stage: str = "explanation", tier: str = None):
+    """
+    Gateway-bound, cached Ollama client for a pipeline stage.
+    Per-stage models and small/large tiering are configured in model_tiers.
+    """
+    return get_stage_llm(stage, tier)
 
 # ---------------- Table & Schema Info ----------------
 TABLE_SCHEMAS = {
@@ -101,6 +119,39 @@ TABLE_SCHEMAS = {
     }
 }
 
+# Codebook labels of the queryable columns -> codes ("rainy" -> WEATHER = 2)
+registry.register(
+    "label_index",
+    lambda: LabelIndex(
+        get_column_metadata(),
+        {t: info["columns"] for t, info in TABLE_SCHEMAS.items()},
+        string_columns={t: info.get("string_columns", []) for t, info in TABLE_SCHEMAS.items()},
+    )
+)
+
+# Embedding search over every queryable column's codebook definition. Uses the
+# backend's "embeddings" resource (registered by orchestration.py); without it
+# only the keyword matches are used.
+registry.register(
+    "column_retriever",
+    lambda: ColumnRetriever(
+        get_column_metadata(),
+        registry.get("embeddings"),
+        schema={t: info["columns"] for t, info in TABLE_SCHEMAS.items()},
+        csv_path=CODEBOOK_CSV_PATH,
+    )
+)
+
+def retrieve_columns(question: str, k: int = 5) -> set:
+    """Columns whose codebook definitions are closest to the question."""
+    if not registry.is_registered("embeddings"):
+        return set()
+    try:
+        return {column for _, column, _ in registry.get("column_retriever").top_columns(question, k=k)}
+    except Exception as e:
+        logger.warning(f"Column retrieval failed, using keyword matches only: {str(e)}")
+        return set()
+
 # ---------------- Schema Prompt Builder ----------------
 def build_schema_prompt(tables, question: str = ""):
     """Build schema prompt with optional metadata context based on question keywords."""
@@ -122,12 +173,27 @@ def build_schema_prompt(tables, question: str = ""):
     )
     
     # Add keyword-based metadata context using the new metadata_extractor module
-    if question and COLUMN_METADATA:
-        metadata_context = extract_relevant_metadata(
-            question=question,
-            column_metadata=COLUMN_METADATA,
-            max_codes_per_column=20
-        )
+    column_metadata = get_column_metadata() if question else {}
+    if column_metadata:
+        with span("metadata_extraction"):
+            keyword_columns = extract_relevant_columns(question)
+            # Resolved values only keep the codes valid in the years asked about
+            value_matches = filter_years(
+                registry.get("label_index").resolve(question, keyword_columns),
+                get_year_codebook(),
+                extract_years(question),
+            )
+            metadata_context = extract_relevant_metadata(
+                question=question,
+                column_metadata=column_metadata,
+                max_codes_per_column=20,
+                year_codebook=get_year_codebook(),
+                resolved_codes=resolved_codes(value_matches, keyword_columns),
+                retrieved_columns=retrieve_columns(question),
+                column_index=get_column_index(),
+                tables=list(tables)
+            )
+        prompt += format_predicate_hints(value_matches, keyword_columns)
         if metadata_context:
             prompt += metadata_context
             prompt += (
@@ -219,70 +285,93 @@ def qualify_ambiguous_columns(sql_query: str) -> str:
     Example: STATE -> accident_master.STATE
     """
     for col, table in AMBIGUOUS_COLUMNS.items():
-        # Only replace standalone column names (not already qualified)
-        pattern = rf"(?<!\.)\b{col}\b"
-        sql_query = re.sub(pattern, f"{table}.{col}", sql_query)
+        # Only replace standalone column names (not already qualified), and
+        # leave date-part units alone: EXTRACT(YEAR FROM d) is not a column
+        pattern = rf"(\bEXTRACT\s*\(\s*){col}\b|(?<!\.)\b{col}\b"
+        sql_query = re.sub(
+            pattern, lambda m: m.group(0) if m.group(1) else f"{table}.{col}", sql_query, flags=re.IGNORECASE
+        )
     return sql_query
 
-def get_column_metadata_context(df: pd.DataFrame, sql_query: str) -> str:
+# ---------------------- Result Column Tables ---------------------
+# The alias is read by lookahead so "FROM a JOIN b" does not consume the JOIN
+SOURCE_RE = re.compile(r"\b(?:FROM|JOIN)\s+([\w.]+)(?=(?:\s+(?:AS\s+)?(\w+))?)", re.IGNORECASE)
+# "a.STATE", "workspace.fars_database.person_master.STATE"
+QUALIFIED_COLUMN_RE = re.compile(r"\b([\w.]+)\.(\w+)\b")
+
+def sql_source_tables(sql_query: str):
+    """
+    Codebook tables read by the query, from its FROM and JOIN clauses in
+    order, and {COLUMN: table} for columns the SELECT qualifies with a table
+    or alias ("p.STATE" -> "person"). CTE and subquery names are skipped.
+    """
+    body = re.sub(r"'[^']*'", "''", sql_query or "")
+    known = {codebook_table(t) for t in TABLE_SCHEMAS}
+
+    sources, aliases = [], {}
+    for name, alias in SOURCE_RE.findall(body):
+        table = codebook_table(name)
+        if table not in known:
+            continue
+        if table not in sources:
+            sources.append(table)
+        aliases[name.lower()] = aliases[name.rsplit(".", 1)[-1].lower()] = table
+        if alias and alias.upper() not in SQL_KEYWORDS:
+            aliases[alias.lower()] = table
+
+    select = re.split(r"\bFROM\b", body, maxsplit=1, flags=re.IGNORECASE)[0]
+    qualified = {}
+    for prefix, column in QUALIFIED_COLUMN_RE.findall(select):
+        table = aliases.get(prefix.lower())
+        if table:
+            qualified.setdefault(column.upper(), table)
+    return sources, qualified
+
+def resolve_result_columns(columns, sql_query: str) -> dict:
+    """
+    {result column: (codebook table, column metadata)} for the columns of a
+    query result that are codebook variables. A column in several tables
+    (STATE, YEAR) resolves to the table the SELECT qualifies it with, else
+    the first FROM/JOIN source that has it.
+    """
+    column_index = get_column_index()
+    sources, qualified = sql_source_tables(sql_query)
+
+    resolved = {}
+    for col in columns:
+        name = col.upper()
+        tables = [qualified[name]] + sources if name in qualified else sources
+        hit = column_index.resolve(name, tables)
+        if hit is not None:
+            resolved[col] = hit
+    return resolved
+
+def get_column_metadata_context(df: pd.DataFrame, sql_query: str, years=None) -> str:
     """
     Build natural-language context for columns in the query result using
-    the metadata loaded from fars_codebook.csv.
+    the metadata loaded from fars_codebook.csv. When `years` is given, code
+    mappings are limited to the codes valid in those years.
     """
-    if not COLUMN_METADATA:
+    if not get_column_metadata():
         return ""
 
-    columns_in_result = [c.upper() for c in df.columns]
-    query_lower = sql_query.lower()
-
-    # Mapping Databricks Table Names -> FARS Codebook File Names
-    # The SQL might use "accident_master", but the codebook just uses "accident"
-    table_mapping = {
-        "accident_master": "accident",
-        "vehicle_master": "vehicle",
-        "person_master": "person",
-        "accidents": "accident", # Catch-alls
-        "vehicles": "vehicle",
-        "persons": "person",
-        "people": "person"
-    }
-
-    # Identify which tables are likely in the SQL query
-    active_codebook_tables = []
-    for sql_key, codebook_key in table_mapping.items():
-        if sql_key in query_lower:
-            active_codebook_tables.append(codebook_key)
-
-    # If detection fails, default to checking all codebook tables
-    if not active_codebook_tables:
-        active_codebook_tables = list(COLUMN_METADATA.keys())
+    resolved = resolve_result_columns(df.columns, sql_query)
 
     context_lines = []
     context_lines.append("Column Meanings:")
 
-    for col in columns_in_result:
-        col_meta = None
-        
-        # 1. Search in the tables identified in the SQL query
-        for table_key in active_codebook_tables:
-            if table_key in COLUMN_METADATA:
-                if col in COLUMN_METADATA[table_key]:
-                    col_meta = COLUMN_METADATA[table_key][col]
-                    break
-        
-        # 2. Fallback: Search ALL tables if not found (e.g. JOINs might obscure table names)
-        if not col_meta:
-            for table_key in COLUMN_METADATA:
-                if col in COLUMN_METADATA[table_key]:
-                    col_meta = COLUMN_METADATA[table_key][col]
-                    break
-
-        # 3. Build the Context String
-        if col_meta:
+    year_codebook = get_year_codebook() if years else None
+
+    for column in df.columns:
+        col = column.upper()
+        if column in resolved:
+            col_table, col_meta = resolved[column]
             desc = col_meta.get("description", f"Meaning of {col}")
             context_lines.append(f"- {col}: {desc}")
             
             codes = col_meta.get("codes", {})
+            if year_codebook is not None:
+                codes = year_codebook.codes_for_years(col_table, col, years) or codes
             if codes:
                 context_lines.append("  Code Mappings (JSON Lookup Table):")
         
@@ -306,143 +395,238 @@ def get_column_metadata_context(df: pd.DataFrame, sql_query: str) -> str:
 
 
 # ---------------- LLM Explanation --------------------
+EMPTY_RESULT_MESSAGE = "The query returned no results. This might mean there's no data matching your criteria."
+
+def build_explanation_prompt(question: str, df: pd.DataFrame, sql_query: str = "") -> str:
+    """Build the prompt that turns a (non-empty) query result into prose."""
+    # Years the answer is about: from the question, else from the SQL's YEAR filter
+    years = extract_years(question) or extract_sql_years(sql_query)
+
+    # Get metadata context for the columns in the result
+    metadata_context = get_column_metadata_context(df, sql_query, years)
+
+    # Create explicit row-by-row mapping WITH the decoded labels for ALL coded columns
+    row_mappings = []
+
+    # Extract code mappings for all columns in the dataframe, from the table
+    # each column was selected from
+    column_code_maps = {}
+    for col, (table_key, col_meta) in resolve_result_columns(df.columns, sql_query).items():
+        codes = col_meta.get('codes', {})
+        if codes:  # Only store if there are actual code mappings
+            column_code_maps[col] = (table_key, codes)
+
+    # Codes changed between years: decode each row with its own YEAR when the
+    # result has one, else with the single year the question is about
+    year_codebook = get_year_codebook()
+    year_col = next((c for c in df.columns if c.upper() == "YEAR"), None)
+    default_year = years[0] if len(years) == 1 else None
+
+    # Build row mappings with decoded labels
+    for idx, row in df.iterrows():
+        row_dict = row.to_dict()
+        mappings = []
+        row_year = row_dict.get(year_col) if year_col else None
+        if row_year is None or pd.isna(row_year):
+            row_year = default_year
+
+        # For each column that has code mappings, add the decoded label
+        for col, (table_key, codes) in column_code_maps.items():
+            if col in row_dict:
+                code_val = str(row_dict[col]).strip()
+                if row_year is not None:
+                    codes = year_codebook.codes(table_key, col, row_year) or codes
+                mapped_label = codes.get(code_val, f"Code {code_val} (no mapping)")
+                mappings.append(f"{col} code '{code_val}' means '{mapped_label}'")
+
+        # Format the row with its mappings
+        if mappings:
+            row_mappings.append(f"Row {idx + 1}: {row_dict} → {' | '.join(mappings)}")
+        else:
+            row_mappings.append(f"Row {idx + 1}: {row_dict}")
+
+    rows_text = "\n".join(row_mappings)
+
+    prompt = (
+        "You are an expert data interpreter.\n"
+        f"The user asked: {question}\n\n"
+        
+        "QUERY RESULTS (row-by-row):\n"
+        f"{rows_text}\n\n"
+        
+        "COLUMN METADATA:\n"
+        f"{metadata_context}\n\n"
+        
+        "====================\n"
+        "CRITICAL MAPPING INSTRUCTIONS\n"
+        "====================\n\n"
+        
+        "EVERY answer MUST start with: \"According to the FARS data,\"\n"
+        "DO NOT add any preamble, greeting, or introduction before this phrase.\n"
+        "DO NOT say things like 'I'm ready to help' or 'Here's the answer'.\n"
+        "Start IMMEDIATELY with \"According to the FARS data,\"\n\n"
+        
+        "FOR SINGLE-ROW RESULTS:\n"
+        "- Output ONE concise sentence starting with \"According to the FARS data,\"\n"
+        "- DO NOT mention column names, SQL terms, or technical details\n"
+        "- State the answer directly and naturally\n"
+        "- Examples:\n"
+        "  * \"According to the FARS data, there were 40,901 total fatalities in 2023.\"\n"
+        "  * \"According to the FARS data, there were 2,829,432 accidents involving 17-year-old drivers.\"\n\n"
+
+        "FOR MULTI-ROW RESULTS:\n"
+        "1. Start with ONLY: \"According to the FARS data, accidents in Virginia (STATE=51) in 2022 had fatalities in various weather conditions.\"\n\n"
+        
+        "2. For EACH row, process it EXACTLY as follows:\n"
+        "   a) Look at Row N in the QUERY RESULTS section above\n"
+        "   b) The row shows the EXACT mapping: code 'X' means 'Y'\n"
+        "   c) Use the EXACT label 'Y' shown in the arrow (→) part\n"
+        "   d) Output: \"<count value> fatality/fatalities occurred in the <category> <exact label from arrow>.\"\n\n"
+        
+        "EXAMPLE MAPPING PROCESS:\n"
+        "Row: {'WEATHER': '3', 'FATALS': 1} → WEATHER code '3' means 'Sleet or Hail'\n"
+        "Step 1: Extract FATALS = 1\n"
+        "Step 2: Extract the label after 'means' = 'Sleet or Hail'\n"
+        "Step 3: Output → \"1 fatality occurred in the weather condition Sleet or Hail.\"\n\n"
+        
+        "ANOTHER EXAMPLE:\n"
+        "Row: {'WEATHER': '8', 'FATALS': 1} → WEATHER code '8' means 'Other'\n"
+        "Output → \"1 fatality occurred in the weather condition Other.\"\n\n"
+        
+        "CRITICAL RULES:\n"
+        "- Use EXACT STRING MATCHING from the arrow (→) mappings\n"
+        "- Process rows INDEPENDENTLY - do not mix data between rows\n"
+        "- All values must come from the SAME row dictionary\n"
+        "- Use singular 'fatality' for 1, plural 'fatalities' for any other number\n"
+        "- If no mapping exists, use: \"<count> fatalities occurred in <category> <code> (not reported in metadata).\"\n"
+        "- Output one sentence per row, no bullet points or numbering\n\n"
+        
+        "DO NOT:\n"
+        "- Mention SQL, tables, databases, or technical details\n"
+        "- Use bullet points or numbered lists\n"
+        "- Add extra explanations or commentary\n"
+        "- Reorder or sort the rows\n"
+        "- Combine multiple rows into one sentence\n"
+    )
+    return prompt
+
+
 def llm_explanation(question: str, df: pd.DataFrame, sql_query: str = "") -> str:
     """
     Uses Ollama to convert the Databricks query result into a natural language answer.
     """
     try:
-        llm = get_llm()
+        llm = get_llm("explanation")
         
         # Handle empty results
         if df.empty:
-            return "The query returned no results. This might mean there's no data matching your criteria."
-        
-        # Get metadata context for the columns in the result
-        metadata_context = get_column_metadata_context(df, sql_query)
-        
-        # Create explicit row-by-row mapping WITH the decoded labels for ALL coded columns
-        row_mappings = []
-        
-        # Extract code mappings for all columns in the dataframe
-        column_code_maps = {}
-        for col in df.columns:
-            col_upper = col.upper()
-            for table_key in COLUMN_METADATA:
-                if col_upper in COLUMN_METADATA[table_key]:
-                    codes = COLUMN_METADATA[table_key][col_upper].get('codes', {})
-                    if codes:  # Only store if there are actual code mappings
-                        column_code_maps[col] = codes
-                    break
+            return EMPTY_RESULT_MESSAGE
         
-        # Build row mappings with decoded labels
-        for idx, row in df.iterrows():
-            row_dict = row.to_dict()
-            mappings = []
-            
-            # For each column that has code mappings, add the decoded label
-            for col, codes in column_code_maps.items():
-                if col in row_dict:
-                    code_val = str(row_dict[col]).strip()
-                    mapped_label = codes.get(code_val, f"Code {code_val} (no mapping)")
-                    mappings.append(f"{col} code '{code_val}' means '{mapped_label}'")
-            
-            # Format the row with its mappings
-            if mappings:
-                row_mappings.append(f"Row {idx + 1}: {row_dict} → {' | '.join(mappings)}")
-            else:
-                row_mappings.append(f"Row {idx + 1}: {row_dict}")
-        
-        rows_text = "\n".join(row_mappings)
-
-        prompt = (
-            "You are an expert data interpreter.\n"
-            f"The user asked: {question}\n\n"
-            
-            "QUERY RESULTS (row-by-row):\n"
-            f"{rows_text}\n\n"
-            
-            "COLUMN METADATA:\n"
-            f"{metadata_context}\n\n"
-            
-            "====================\n"
-            "CRITICAL MAPPING INSTRUCTIONS\n"
-            "====================\n\n"
-            
-            "EVERY answer MUST start with: \"According to the FARS data,\"\n"
-            "DO NOT add any preamble, greeting, or introduction before this phrase.\n"
-            "DO NOT say things like 'I'm ready to help' or 'Here's the answer'.\n"
-            "Start IMMEDIATELY with \"According to the FARS data,\"\n\n"
-            
-            "FOR SINGLE-ROW RESULTS:\n"
-            "- Output ONE concise sentence starting with \"According to the FARS data,\"\n"
-            "- DO NOT mention column names, SQL terms, or technical details\n"
-            "- State the answer directly and naturally\n"
-            "- Examples:\n"
-            "  * \"According to the FARS data, there were 40,901 total fatalities in 2023.\"\n"
-            "  * \"According to the FARS data, there were 2,829,432 accidents involving 17-year-old drivers.\"\n\n"
-
-            "FOR MULTI-ROW RESULTS:\n"
-            "1. Start with ONLY: \"According to the FARS data, accidents in Virginia (STATE=51) in 2022 had fatalities in various weather conditions.\"\n\n"
-            
-            "2. For EACH row, process it EXACTLY as follows:\n"
-            "   a) Look at Row N in the QUERY RESULTS section above\n"
-            "   b) The row shows the EXACT mapping: code 'X' means 'Y'\n"
-            "   c) Use the EXACT label 'Y' shown in the arrow (→) part\n"
-            "   d) Output: \"<count value> fatality/fatalities occurred in the <category> <exact label from arrow>.\"\n\n"
-            
-            "EXAMPLE MAPPING PROCESS:\n"
-            "Row: {'WEATHER': '3', 'FATALS': 1} → WEATHER code '3' means 'Sleet or Hail'\n"
-            "Step 1: Extract FATALS = 1\n"
-            "Step 2: Extract the label after 'means' = 'Sleet or Hail'\n"
-            "Step 3: Output → \"1 fatality occurred in the weather condition Sleet or Hail.\"\n\n"
-            
-            "ANOTHER EXAMPLE:\n"
-            "Row: {'WEATHER': '8', 'FATALS': 1} → WEATHER code '8' means 'Other'\n"
-            "Output → \"1 fatality occurred in the weather condition Other.\"\n\n"
-            
-            "CRITICAL RULES:\n"
-            "- Use EXACT STRING MATCHING from the arrow (→) mappings\n"
-            "- Process rows INDEPENDENTLY - do not mix data between rows\n"
-            "- All values must come from the SAME row dictionary\n"
-            "- Use singular 'fatality' for 1, plural 'fatalities' for any other number\n"
-            "- If no mapping exists, use: \"<count> fatalities occurred in <category> <code> (not reported in metadata).\"\n"
-            "- Output one sentence per row, no bullet points or numbering\n\n"
-            
-            "DO NOT:\n"
-            "- Mention SQL, tables, databases, or technical details\n"
-            "- Use bullet points or numbered lists\n"
-            "- Add extra explanations or commentary\n"
-            "- Reorder or sort the rows\n"
-            "- Combine multiple rows into one sentence\n"
-        )
+        prompt = build_explanation_prompt(question, df, sql_query)
 
-        response = llm.invoke(prompt)
+        with span("explanation_llm", prompt_chars=len(prompt)):
+            response = llm.invoke(prompt)
+            record_tokens(response)
         return response.content.strip()
     except Exception as e:
         logger.error(f"Error generating explanation: {str(e)}")
         return f"Query executed successfully but explanation generation failed: {str(e)}"
 
-# ---------------- Main Query Function ----------------
-def ask_fars_database(question: str, max_retries: int = 0):
+
+def stream_explanation(question: str, df: pd.DataFrame, sql_query: str = ""):
     """
-    Main function to process natural language questions and return SQL results.
-    Returns a dict with 'query', 'results', and 'answer' keys.
+    Same as llm_explanation(), but yields the answer text chunk by chunk as the
+    LLM produces it.
     """
     try:
-        llm = get_llm()
-        
+        if df.empty:
+            yield EMPTY_RESULT_MESSAGE
+            return
+
+        llm = get_llm("explanation")
+        prompt = build_explanation_prompt(question, df, sql_query)
+        for chunk in llm.stream(prompt):
+            text = getattr(chunk, "content", str(chunk))
+            if text:
+                yield text
+    except Exception as e:
+        logger.error(f"Error streaming explanation: {str(e)}")
+        yield f"Query executed successfully but explanation generation failed: {str(e)}"
+
+# ---------------- SQL Validation ----------------
+SQL_KEYWORDS = {
+    "SELECT", "FROM", "WHERE", "AND", "OR", "NOT", "IN", "IS", "NULL", "AS", "ON",
+    "JOIN", "LEFT", "RIGHT", "INNER", "OUTER", "FULL", "CROSS", "GROUP", "BY", "ORDER",
+    "HAVING", "LIMIT", "OFFSET", "DISTINCT", "CASE", "WHEN", "THEN", "ELSE", "END", "WITH",
+    "UNION", "ALL", "ASC", "DESC", "BETWEEN", "LIKE", "EXISTS", "TRUE", "FALSE", "OVER",
+    "PARTITION", "COUNT", "SUM", "AVG", "MIN", "MAX", "COALESCE", "ROUND", "CAST", "INT",
+    "INTEGER", "BIGINT", "DOUBLE", "FLOAT", "DECIMAL", "STRING", "ROW_NUMBER", "RANK",
+    "DENSE_RANK", "ABS", "NULLIF", "IF", "IFNULL", "NVL", "CONCAT", "LOWER", "UPPER",
+    # Reserved words used without parentheses (dates, window frames, TRIM)
+    "CURRENT_DATE", "CURRENT_TIMESTAMP", "INTERVAL", "DATE", "TIMESTAMP", "QUARTER", "WEEK",
+    "SECOND", "BOTH", "LEADING", "TRAILING", "FOR", "NULLS", "FIRST", "LAST", "FILTER", "ROWS",
+    "RANGE", "PRECEDING", "FOLLOWING", "UNBOUNDED", "CURRENT", "ROW", "ILIKE", "RLIKE", "QUALIFY",
+}
+KNOWN_COLUMNS = {c for info in TABLE_SCHEMAS.values() for c in info["columns"]}
+
+def validate_sql(sql_query: str):
+    """
+    Cheap static checks on generated SQL. Returns None when the query looks
+    valid, otherwise a short reason (used to escalate to the larger model).
+    """
+    if not sql_query or sql_query == ";":
+        return "empty SQL"
+    if not re.match(r"^\s*(SELECT|WITH)\b", sql_query, re.IGNORECASE):
+        return "does not start with SELECT or WITH"
+    if sql_query.count("(") != sql_query.count(")"):
+        return "unbalanced parentheses"
+
+    body = re.sub(r"'[^']*'", "''", sql_query)  # ignore string literals
+    # FROM inside function arguments is not a table source:
+    # EXTRACT(YEAR FROM d), TRIM(BOTH ' ' FROM s), SUBSTRING(s FROM 1 FOR 2)
+    body = re.sub(r"\bEXTRACT\s*\(\s*[\w.]+\s+FROM\b", "EXTRACT(", body, flags=re.IGNORECASE)
+    body = re.sub(r"\b((?:TRIM|SUBSTRING|OVERLAY|POSITION)\s*\([^()]*?)\bFROM\b", r"\1,", body, flags=re.IGNORECASE)
+    cte_names = set(re.findall(r"\b(\w+)\s+AS\s*\(", body, re.IGNORECASE))
+    sources = re.findall(r"\b(?:FROM|JOIN)\s+([\w.]+)", body, re.IGNORECASE)
+    if not sources:
+        return "no FROM clause"
+    # Short names are accepted; qualify_table_names expands them afterwards
+    unknown_tables = [
+        t for t in sources if t not in TABLE_SCHEMAS and t not in FULLY_QUALIFIED_TABLES and t not in cte_names
+    ]
+    if unknown_tables:
+        return f"unknown tables: {', '.join(sorted(set(unknown_tables)))}"
+
+    # Schema columns are upper-case; any other upper-case identifier that is
+    # not a keyword, a function call or an alias is a hallucinated column.
+    aliases = set(re.findall(r"\bAS\s+(\w+)", body, re.IGNORECASE)) | cte_names
+    functions = set(re.findall(r"\b([A-Z][A-Z0-9_]*)\s*\(", body))
+    identifiers = set(re.findall(r"(?<![\w.])(?:\w+\.)*([A-Z][A-Z0-9_]+)\b", body))
+    unknown_columns = identifiers - SQL_KEYWORDS - KNOWN_COLUMNS - aliases - functions
+    if unknown_columns:
+        return f"unknown columns: {', '.join(sorted(unknown_columns))}"
+    return None
+
+# ---------------- SQL Generation ----------------
+def generate_sql(question: str) -> str:
+    """
+    Build the metadata-aware prompt, ask the LLM for SQL and clean it up.
+    Runs on the small model tier first and escalates to the large model when
+    validate_sql() rejects the result.
+    """
+    # ------------------------ PROMPT BUILD ------------------------
+    with span("prompt_build"):
         tables = list(TABLE_SCHEMAS.keys())
-        
+
         # Build the enhanced prompt with metadata context
         schema_prompt = build_schema_prompt(tables, question)
 
-        # ------------------------ SQL GENERATION ------------------------
         full_prompt = (
             f"{schema_prompt}"
             f"\n=== USER QUESTION ===\n{question}\n\n"
             f"=== QUERY REQUIREMENTS ===\n"
         )
-        
+
         # Add specific guidance based on question type
         if any(word in question.lower() for word in ['example', 'sample', 'show me an', 'give me an']):
             full_prompt += "- User wants an EXAMPLE, so use LIMIT 1 or LIMIT 5\n"
@@ -450,22 +634,39 @@ def ask_fars_database(question: str, max_retries: int = 0):
             full_prompt += "- User wants a COUNT or aggregate, so use COUNT() or SUM()\n"
         if any(word in question.lower() for word in ['distribution', 'breakdown', 'by']):
             full_prompt += "- User wants grouped results, so use GROUP BY\n"
-        
+
         full_prompt += (
             f"\n=== YOUR SQL QUERY ===\n"
             "Now generate the SQL query following all the rules above:\n"
         )
-        
-        logger.info(f"Generating SQL for question: {question}")
-        response = llm.invoke(full_prompt)
-        sql_query = clean_sql_output(response.content.strip())
-        
-        # 1) Qualify ambiguous columns to avoid SQL ambiguity
-        sql_query = qualify_ambiguous_columns(sql_query)
-        # 2) Fully qualify table names for any remaining unqualified tables
-        sql_query = qualify_table_names(sql_query)
-        
-        logger.info(f"Generated SQL: {sql_query}")
+
+    # ------------------------ SQL GENERATION ------------------------
+    def generate(llm):
+        with span("sql_generation", prompt_chars=len(full_prompt), model=llm.model):
+            response = llm.invoke(full_prompt)
+            record_tokens(response)
+        return clean_sql_output(response.content.strip())
+
+    logger.info(f"Generating SQL for question: {question}")
+    # Validate the model's own SQL; qualification only rewrites names
+    sql_query, tier = run_tiered("sql", generate, validate_sql)
+
+    # 1) Qualify ambiguous columns to avoid SQL ambiguity
+    sql_query = qualify_ambiguous_columns(sql_query)
+    # 2) Fully qualify table names for any remaining unqualified tables
+    sql_query = qualify_table_names(sql_query)
+
+    logger.info(f"Generated SQL ({tier} model): {sql_query}")
+    return sql_query
+
+# ---------------- Main Query Function ----------------
+def ask_fars_database(question: str, max_retries: int = 0):
+    """
+    Main function to process natural language questions and return SQL results.
+    Returns a dict with 'query', 'results', and 'answer' keys.
+    """
+    try:
+        sql_query = generate_sql(question)
 
         # Check if SQL was actually generated
         if not sql_query or sql_query == ";":
@@ -503,4 +704,47 @@ def ask_fars_database(question: str, max_retries: int = 0):
             "query": None,
             "results": pd.DataFrame(),
             "answer": error_msg
-        }
\ No newline at end of file
+        }
+
+
+def ask_fars_database_stream(question: str):
+    """
+    Streaming variant of ask_fars_database().
+    Yields (event, data) tuples as each stage completes:
+        ("sql",   {"query": ...})
+        ("rows",  {"columns": [...], "rows": [...], "row_count": n})
+        ("token", {"text": ...})        # repeated while the explanation streams
+        ("answer", {"answer": ...})     # full explanation once streaming ends
+        ("error", {"error": ...})       # instead of the remaining events on failure
+    """
+    try:
+        sql_query = generate_sql(question)
+    except Exception as e:
+        logger.exception("Error generating SQL")
+        yield "error", {"error": f"Error in ask_fars_database: {str(e)}"}
+        return
+
+    if not sql_query or sql_query == ";":
+        yield "error", {"error": "Failed to generate valid SQL query from the question."}
+        return
+
+    yield "sql", {"query": sql_query}
+
+    try:
+        df = run_databricks_query(sql_query)
+    except Exception as e:
+        yield "error", {"query": sql_query, "error": f"SQL execution error: {str(e)}"}
+        return
+
+    yield "rows", {
+        "columns": list(df.columns),
+        "rows": df.fillna("").astype(str).values.tolist(),
+        "row_count": len(df),
+    }
+
+    parts = []
+    for text in stream_explanation(question, df, sql_query):
+        parts.append(text)
+        yield "token", {"text": text}
+
+    yield "answer", {"answer": "".join(parts).strip()}
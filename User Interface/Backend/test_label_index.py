@@ -0,0 +1,107 @@
+from label_index import (
+    LabelIndex, Predicate, ValueMatch, edit_distance, filter_years, format_predicate_hints,
+    is_confident, resolved_codes, stem,
+)
+
+COLUMN_METADATA = {
+    "accident": {
+        "STATE": {"description": "State", "codes": {"48": "Texas", "51": "Virginia", "54": "West Virginia"}},
+        "WEATHER": {"description": "Atmospheric Conditions",
+                    "codes": {"1": "Clear", "2": "Rain", "4": "Snow", "5": "Fog, Smog, Smoke", "99": "Unknown"}},
+        "LGT_COND": {"description": "Light Condition",
+                     "codes": {"1": "Daylight", "2": "Dark - Not Lighted", "3": "Dark - Lighted"}},
+    },
+    "vehicle": {
+        "IMPACT1": {"description": "Initial Contact Point", "codes": {"12": "Front", "13": "Top"}},
+        "ADS_PRES": {"description": "ADS Presence", "codes": {"1": "Yes, ADS Present"}},
+    },
+}
+SCHEMA = {
+    "workspace.fars_database.accident_master": ["STATE", "WEATHER", "LGT_COND"],
+    "workspace.fars_database.vehicle_master": ["IMPACT1", "ADS_PRES"],
+}
+STRING_COLUMNS = {"workspace.fars_database.vehicle_master": ["ADS_PRES"]}
+
+INDEX = LabelIndex(COLUMN_METADATA, SCHEMA, string_columns=STRING_COLUMNS)
+
+
+class FakeYearCodebook:
+    years = [2019, 2020]
+    codes_by_year = {("accident", "WEATHER", 2019): {"1": "Clear", "2": "Rain"},
+                     ("accident", "WEATHER", 2020): {"1": "Clear", "4": "Snow"}}
+
+    def codes_for_years(self, table, column, years):
+        maps = [self.codes_by_year[(table, column, y)] for y in years if (table, column, y) in self.codes_by_year]
+        return {c: l for m in maps for c, l in m.items()} if maps else None
+
+    def available_years(self, table, column):
+        return [y for (t, c, y) in self.codes_by_year if (t, c) == (table, column)]
+
+
+def best(question, relevant=None):
+    return {m.phrase: m.candidates[0] for m in INDEX.resolve(question, relevant)}
+
+
+def test_stem_and_distance():
+    assert stem("crashes") == "crash"
+    assert stem("running") == "run"
+    assert edit_distance("pedestrain", "pedestrian", 2) == 1
+
+
+def test_resolves_whole_labels_longest_first():
+    found = best("fatal crashes on rainy nights in West Virginia")
+    assert found["rainy"].sql() == "accident_master.WEATHER = 2"
+    assert found["West Virginia"].codes == ("54",)
+
+
+def test_typo_correction():
+    (match,) = INDEX.resolve("crashes in Virgina", None)
+    assert match.fuzzy and match.candidates[0].codes == ("51",)
+
+
+def test_unknown_labels_not_indexed():
+    assert INDEX.resolve("unknown weather", None) == []
+
+
+def test_parts_of_compound_labels_are_not_hints():
+    matches = INDEX.resolve("crashes at night with no lighting", {"LGT_COND"})
+    assert matches and not matches[0].candidates[0].whole
+    assert format_predicate_hints(matches, {"LGT_COND"}) == ""
+    assert resolved_codes(matches, {"LGT_COND"}) == {}
+
+
+def test_single_common_words_need_confirmation():
+    (top,) = INDEX.resolve("list the top 10 states", None)
+    assert top.candidates[0].column == "IMPACT1"
+    assert not is_confident(top, top.candidates[0])
+    assert format_predicate_hints([top]) == ""
+
+    (rain,) = INDEX.resolve("crashes in rain", {"WEATHER"})
+    assert is_confident(rain, rain.candidates[0], {"WEATHER"})
+    assert not is_confident(rain, rain.candidates[0])
+
+    (texas,) = INDEX.resolve("crashes in Texas", None)
+    assert texas.proper_noun and is_confident(texas, texas.candidates[0])
+
+
+def test_string_columns_are_quoted():
+    predicate = Predicate("vehicle_master", "ADS_PRES", ("1",), ("Yes",), 2.0, quoted=True)
+    assert predicate.sql() == "vehicle_master.ADS_PRES = '1'"
+    numeric = Predicate("accident_master", "WEATHER", ("2", "4"), ("Rain", "Snow"), 2.0)
+    assert numeric.sql() == "accident_master.WEATHER IN (2, 4)"
+    (match,) = INDEX.resolve("vehicles with Yes, ADS Present", None)
+    assert match.candidates[0].quoted
+
+
+def test_filter_years_drops_codes_not_in_those_years():
+    matches = INDEX.resolve("rain or snow", {"WEATHER"})
+    filtered = filter_years(matches, FakeYearCodebook(), [2019])
+    assert [m.phrase for m in filtered if m.candidates] == ["rain"]
+    # Years the codebook does not cover leave the matches alone
+    assert filter_years(matches, FakeYearCodebook(), [2010]) == matches
+
+
+def test_format_hints_lists_confident_predicates():
+    match = ValueMatch("snow", 0, 4, False, [Predicate("accident_master", "WEATHER", ("4",), ("Snow",), 3.3)])
+    hints = format_predicate_hints([match], {"WEATHER"})
+    assert "'snow' -> accident_master.WEATHER = 4" in hints
@@ -0,0 +1,17 @@
+from metadata_extractor import extract_sql_years, extract_years
+
+
+def test_ranges_are_expanded():
+    assert extract_years("Fatal crashes from 2018 to 2020") == [2018, 2019, 2020]
+    assert extract_years("crashes in 2019-2021") == [2019, 2020, 2021]
+    assert extract_years("Between 2016 and 2018, which state had most crashes?") == [2016, 2017, 2018]
+
+
+def test_years_joined_by_and_are_not_a_range():
+    assert extract_years("Compare fatalities in 2015 and 2022") == [2015, 2022]
+    assert sorted(extract_years("2015 and 2019-2020")) == [2015, 2019, 2020]
+
+
+def test_sql_years_come_from_year_predicates():
+    assert extract_sql_years("SELECT COUNT(*) FROM a WHERE a.YEAR = 2021 AND MOD_YEAR = 2015") == [2021]
+    assert extract_sql_years("SELECT * FROM a WHERE YEAR BETWEEN 2018 AND 2020") == [2018, 2019, 2020]
@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+
+from metadata_loader import YearCodebook, load_snapshot
+
+CODEBOOK = pd.DataFrame({
+    "table": ["accident"] * 3,
+    "column": ["WEATHER"] * 3,
+    "code": ["0", "0", "2"],
+    "value_label": ["No Additional Atmospheric Conditions", "Clear Later", "Rain"],
+    "2019": [1, None, 1],
+    "2020": [None, 1, 1],
+    "2021": [None, 1, 1],
+})
+
+
+def test_snapshots_round_trip_without_pickle(tmp_path, monkeypatch):
+    monkeypatch.setenv("FARS_CODEBOOK_SNAPSHOT_DIR", str(tmp_path / "snapshots"))
+    csv_path = tmp_path / "codebook.csv"
+    csv_path.write_text("name_ncsa,value,value_label\n")
+
+    def cached(name, build, **codec):
+        load_snapshot(str(csv_path), name, build, **codec)
+        return load_snapshot(str(csv_path), name, lambda: None, **codec)
+
+    metadata = {"accident": {"WEATHER": {"description": "Weather", "codes": {"2": "Rain"}}}}
+    assert cached("column_metadata", lambda: metadata) == metadata
+
+    vectors = np.random.default_rng(0).random((4, 3), dtype=np.float32)
+    loaded = cached("vectors", lambda: vectors, encode=lambda v: (None, {"vectors": v}),
+                    decode=lambda payload, arrays: arrays["vectors"])
+    np.testing.assert_array_equal(loaded, vectors)
+
+    codebook = cached("year_codebook", lambda: YearCodebook(CODEBOOK),
+                      encode=lambda c: (c.to_snapshot(), {}),
+                      decode=lambda payload, arrays: YearCodebook.from_snapshot(payload))
+    assert codebook.years == [2019, 2020, 2021]
+    assert codebook.codes("accident", "WEATHER", 2019) == {"0": "No Additional Atmospheric Conditions", "2": "Rain"}
+    assert codebook.intervals("accident", "WEATHER")[1][:2] == (2020, 2021)
+
+    assert all(path.suffix == ".npz" for path in (tmp_path / "snapshots").iterdir())
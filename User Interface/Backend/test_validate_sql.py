@@ -0,0 +1,26 @@
+from sql_query_chain import qualify_ambiguous_columns, qualify_table_names, validate_sql
+
+
+def qualify(sql):
+    return qualify_table_names(qualify_ambiguous_columns(sql))
+
+
+def test_extract_unit_is_not_qualified():
+    sql = "SELECT COUNT(*) FROM accident_master WHERE YEAR = EXTRACT(YEAR FROM CURRENT_DATE) - 1"
+    qualified = qualify(sql)
+    assert "EXTRACT(YEAR FROM CURRENT_DATE)" in qualified
+    assert "workspace.fars_database.accident_master.YEAR =" in qualified
+
+
+def test_functions_validate_before_and_after_qualifying():
+    sql = (
+        "SELECT STATE, TRIM(BOTH ' ' FROM CITY) AS NAME, COUNT(*) AS CRASHES "
+        "FROM accident_master WHERE YEAR = EXTRACT(YEAR FROM CURRENT_DATE) - 1 GROUP BY STATE, CITY"
+    )
+    assert validate_sql(sql) is None
+    assert validate_sql(qualify(sql)) is None
+
+
+def test_unknown_tables_and_columns_are_reported():
+    assert validate_sql("SELECT COUNT(*) FROM crashes").startswith("unknown tables")
+    assert validate_sql("SELECT SPEEDING FROM accident_master").startswith("unknown columns")
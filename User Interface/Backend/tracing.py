@@ -0,0 +1,177 @@
+"""
+Lightweight per-request latency tracing for the question pipeline.
+
+Usage:
+    with start_trace("query") as trace:
+        with span("sql_generation") as s:
+            response = llm.invoke(prompt)
+            record_tokens(response)
+    trace.to_dict()           # nested span tree with timings and token counts
+    export_trace(trace, dir)  # Chrome Trace Event JSON (chrome://tracing, Perfetto)
+
+`span()` is a no-op when no trace is active, so instrumented code paths cost
+nothing outside of a traced request. Work handed to thread pools should be
+submitted through `contextvars.copy_context().run` to keep its spans attached
+to the right parent.
+"""
+
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_current_trace: contextvars.ContextVar = contextvars.ContextVar("fars_trace", default=None)
+_current_span: contextvars.ContextVar = contextvars.ContextVar("fars_span", default=None)
+
+
+class Span:
+    def __init__(self, name: str, parent: Optional["Span"] = None, **attributes):
+        self.name = name
+        self.parent = parent
+        self.attributes: Dict[str, Any] = dict(attributes)
+        self.children: List["Span"] = []
+        self.thread_id = threading.get_ident()
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.end if self.end is not None else time.perf_counter()
+        return (end - self.start) * 1000.0
+
+    def set(self, **attributes) -> None:
+        self.attributes.update(attributes)
+
+    def add_tokens(self, input_tokens: int = 0, output_tokens: int = 0) -> None:
+        self.attributes["input_tokens"] = self.attributes.get("input_tokens", 0) + input_tokens
+        self.attributes["output_tokens"] = self.attributes.get("output_tokens", 0) + output_tokens
+
+    def to_dict(self, origin: float) -> dict:
+        return {
+            "name": self.name,
+            "start_ms": round((self.start - origin) * 1000.0, 3),
+            "duration_ms": round(self.duration_ms, 3),
+            "attributes": self.attributes,
+            "children": [child.to_dict(origin) for child in self.children],
+        }
+
+
+class Trace:
+    def __init__(self, name: str, **attributes):
+        self.trace_id = uuid.uuid4().hex
+        self.wall_start = time.time()
+        self.root = Span(name, **attributes)
+
+    def to_dict(self) -> dict:
+        return {"trace_id": self.trace_id, "root": self.root.to_dict(self.root.start)}
+
+    def _walk(self, span: Span):
+        yield span
+        for child in span.children:
+            yield from self._walk(child)
+
+    def to_chrome_trace(self) -> dict:
+        """Render as Chrome Trace Event Format ("X" complete events, microseconds)."""
+        origin = self.root.start
+        events = []
+        for s in self._walk(self.root):
+            events.append({
+                "name": s.name,
+                "cat": "fars",
+                "ph": "X",
+                "ts": round((self.wall_start + (s.start - origin)) * 1e6),
+                "dur": round(s.duration_ms * 1000.0),
+                "pid": os.getpid(),
+                "tid": s.thread_id,
+                "args": s.attributes,
+            })
+        return {"traceEvents": events, "otherData": {"trace_id": self.trace_id}}
+
+
+@contextmanager
+def start_trace(name: str, **attributes):
+    """Open a new trace for the current request and make it the active context."""
+    trace = Trace(name, **attributes)
+    trace_token = _current_trace.set(trace)
+    span_token = _current_span.set(trace.root)
+    try:
+        yield trace
+    finally:
+        trace.root.end = time.perf_counter()
+        _current_span.reset(span_token)
+        _current_trace.reset(trace_token)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Time a pipeline stage as a child of the active span (no-op without a trace)."""
+    parent = _current_span.get()
+    if parent is None:
+        yield None
+        return
+
+    s = Span(name, parent=parent, **attributes)
+    parent.children.append(s)
+    token = _current_span.set(s)
+    try:
+        yield s
+    except Exception as e:
+        s.set(error=str(e))
+        raise
+    finally:
+        s.end = time.perf_counter()
+        _current_span.reset(token)
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+def record_tokens(response) -> None:
+    """Attach prompt/completion token counts from a LangChain LLM response."""
+    s = _current_span.get()
+    if s is None or response is None:
+        return
+
+    usage = getattr(response, "usage_metadata", None) or {}
+    input_tokens = usage.get("input_tokens")
+    output_tokens = usage.get("output_tokens")
+
+    # Older langchain-ollama releases only expose Ollama's raw counters
+    if input_tokens is None and output_tokens is None:
+        meta = getattr(response, "response_metadata", None) or {}
+        input_tokens = meta.get("prompt_eval_count")
+        output_tokens = meta.get("eval_count")
+
+    s.add_tokens(input_tokens or 0, output_tokens or 0)
+
+
+def export_trace(trace: Trace, directory: Optional[str] = None) -> Optional[str]:
+    """
+    Write a trace as Chrome Trace Event JSON to `directory` (or $FARS_TRACE_DIR).
+    Returns the file path, or None when exporting is not configured.
+    """
+    directory = directory or os.getenv("FARS_TRACE_DIR")
+    if not directory:
+        return None
+
+    try:
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"trace_{trace.trace_id}.json")
+        with open(path, "w") as f:
+            json.dump(trace.to_chrome_trace(), f, default=str)
+        return path
+    except Exception as e:
+        logger.error(f"Failed to export trace: {str(e)}")
+        return None
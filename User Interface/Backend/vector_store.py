@@ -0,0 +1,360 @@
+"""
+Memory-mapped FAISS vectorstores with an on-disk SQLite docstore.
+
+FAISS.load_local reads the whole index and unpickles every Document into RAM
+in each worker process. This format keeps the same index.faiss but stores the
+documents in docs.sqlite, keyed by their position in the index:
+
+    <index>/index.faiss   FAISS index, opened with mmap (read-only, shared
+                          page cache across forked workers)
+    <index>/docs.sqlite   pos -> (doc_id, page_content, metadata JSON), an
+                          indexed (field, value) -> pos table of integer metadata
+                          (YEAR, STATE, ...) used for filtered search, and the
+                          store's distance_strategy / normalize_L2 settings
+
+Loading is near-instant, per-worker memory no longer grows with the corpus,
+only the top-k hits are fetched from SQLite, and nothing is unpickled.
+
+Directories saved by FAISS.save_local (index.pkl only) still load through
+the old pickle path with a warning. Convert them once (this also builds the
+BM25 index, see sparse_index.py) with:
+
+    python vector_store.py <index_dir> [<index_dir> ...]
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+from collections.abc import Mapping
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
+
+import faiss
+import numpy as np
+from langchain_community.docstore.base import Docstore
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.utils import DistanceStrategy
+from langchain_core.documents import Document
+
+logger = logging.getLogger(__name__)
+
+DOCSTORE_FILE = "docs.sqlite"
+INDEX_FILE = "index.faiss"
+
+
+# ---------------- Docstore ----------------
+class SQLiteDocstore(Docstore):
+    """Read-only docstore that fetches Documents by index position on demand."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._fields: Optional[Set[str]] = None
+
+    def _db(self) -> sqlite3.Connection:
+        # One connection per thread and process (SQLite handles must not cross a fork)
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def search(self, search: Union[int, str]) -> Union[str, Document]:
+        row = self._db().execute(
+            "SELECT page_content, metadata FROM docs WHERE pos = ?", (int(search),)
+        ).fetchone()
+        if row is None:
+            return f"ID {search} not found."
+        return Document(page_content=row[0], metadata=json.loads(row[1]))
+
+    def __len__(self) -> int:
+        return self._db().execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+
+    def filter_fields(self) -> Set[str]:
+        """Metadata fields that can be used in positions() (empty for older files)."""
+        if self._fields is None:
+            try:
+                rows = self._db().execute("SELECT field FROM filter_fields").fetchall()
+                self._fields = {row[0] for row in rows}
+            except sqlite3.OperationalError:
+                self._fields = set()
+        return self._fields
+
+    def positions(self, constraints: Dict[str, List[int]]) -> np.ndarray:
+        """Index positions whose metadata matches every {field: [values]} constraint."""
+        clauses, params = [], []
+        for field, values in constraints.items():
+            clauses.append(f"SELECT pos FROM filters WHERE field = ? AND value IN ({','.join('?' * len(values))})")
+            params.extend([field, *values])
+        rows = self._db().execute(" INTERSECT ".join(clauses), params).fetchall()
+        return np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+
+
+class PositionMap(Mapping):
+    """
+    index_to_docstore_id for SQLiteDocstore: FAISS position i maps to docstore
+    key i, so nothing per-vector is held in memory.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+
+    def __getitem__(self, i) -> int:
+        i = int(i)
+        if not 0 <= i < self.size:
+            raise KeyError(i)
+        return i
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(range(self.size))
+
+
+# ---------------- Save ----------------
+class DocstoreWriter:
+    """
+    Writes <path>/docs.sqlite incrementally: add() appends documents at the
+    next index positions, finish() builds the filter tables and moves the file
+    into place. Nothing is kept in memory between add() calls.
+    """
+
+    def __init__(self, path: str):
+        os.makedirs(path, exist_ok=True)
+        self.db_path = os.path.join(path, DOCSTORE_FILE)
+        self.tmp_path = self.db_path + ".tmp"
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+        self.count = 0
+        self._conn = sqlite3.connect(self.tmp_path)
+        self._conn.execute(
+            "CREATE TABLE docs (pos INTEGER PRIMARY KEY, doc_id TEXT, page_content TEXT NOT NULL, metadata TEXT NOT NULL)"
+        )
+
+    def add(self, docs: Iterable[Tuple[str, Document]]) -> None:
+        """Append (doc_id, Document) pairs in index order."""
+        def rows():
+            for doc_id, doc in docs:
+                yield self.count, str(doc_id), doc.page_content, json.dumps(doc.metadata, default=str)
+                self.count += 1
+
+        self._conn.executemany("INSERT INTO docs VALUES (?, ?, ?, ?)", rows())
+        self._conn.commit()
+
+    def finish(
+        self,
+        distance_strategy: DistanceStrategy = DistanceStrategy.EUCLIDEAN_DISTANCE,
+        normalize_L2: bool = False,
+    ) -> None:
+        conn = self._conn
+        # Integer metadata (YEAR, STATE, coded fields) becomes filterable
+        conn.execute(
+            "CREATE TABLE filters (field TEXT, value INTEGER, pos INTEGER, PRIMARY KEY (field, value, pos)) WITHOUT ROWID"
+        )
+        conn.execute(
+            "INSERT INTO filters SELECT json_each.key, json_each.value, docs.pos FROM docs, json_each(docs.metadata) "
+            "WHERE json_each.type = 'integer'"
+        )
+        conn.execute("CREATE TABLE filter_fields AS SELECT DISTINCT field FROM filters")
+
+        # FAISS(...) defaults would otherwise change how scores and queries are computed
+        conn.execute("CREATE TABLE settings (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        conn.executemany("INSERT INTO settings VALUES (?, ?)", [
+            ("distance_strategy", DistanceStrategy(distance_strategy).value),
+            ("normalize_L2", json.dumps(bool(normalize_L2))),
+        ])
+        conn.commit()
+        conn.close()
+        os.replace(self.tmp_path, self.db_path)
+
+    def abort(self) -> None:
+        self._conn.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+def save_docstore(vectorstore: FAISS, path: str) -> None:
+    """Write the vectorstore's documents to <path>/docs.sqlite in index order."""
+    writer = DocstoreWriter(path)
+    writer.add(
+        (doc_id, vectorstore.docstore.search(doc_id))
+        for doc_id in (vectorstore.index_to_docstore_id[pos] for pos in range(vectorstore.index.ntotal))
+    )
+    writer.finish(vectorstore.distance_strategy, vectorstore._normalize_L2)
+
+def save_vectorstore(vectorstore: FAISS, path: str) -> None:
+    """Save the index and a SQLite docstore (no pickle)."""
+    os.makedirs(path, exist_ok=True)
+    faiss.write_index(vectorstore.index, os.path.join(path, INDEX_FILE))
+    save_docstore(vectorstore, path)
+
+
+# ---------------- Load ----------------
+def read_index_mmap(index_path: str):
+    """
+    Open a FAISS index memory-mapped where the index type allows it:
+    flat/HNSW storage maps with IO_FLAG_MMAP_IFC, IVF lists with IO_FLAG_MMAP.
+    """
+    attempts = [faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY]
+    if hasattr(faiss, "IO_FLAG_MMAP_IFC"):
+        attempts.insert(0, faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY)
+    else:
+        # IO_FLAG_MMAP only maps IVF inverted lists; flat and HNSW storage is
+        # then read into each worker's memory
+        logger.warning(
+            f"This faiss build has no IO_FLAG_MMAP_IFC; flat/HNSW vectors of {index_path} "
+            f"are read into memory (upgrade faiss to memory-map them)"
+        )
+    for flags in attempts:
+        try:
+            return faiss.read_index(index_path, flags)
+        except RuntimeError:
+            continue
+    logger.warning(f"Could not memory-map {index_path}; reading it into memory")
+    return faiss.read_index(index_path)
+
+def _store_settings(conn: sqlite3.Connection, index) -> dict:
+    """FAISS constructor settings saved in docs.sqlite (inferred from the index for older files)."""
+    try:
+        settings = dict(conn.execute("SELECT key, value FROM settings").fetchall())
+    except sqlite3.OperationalError:
+        settings = {}
+    if "distance_strategy" in settings:
+        strategy = DistanceStrategy(settings["distance_strategy"])
+    elif index.metric_type == faiss.METRIC_INNER_PRODUCT:
+        strategy = DistanceStrategy.MAX_INNER_PRODUCT
+    else:
+        strategy = DistanceStrategy.EUCLIDEAN_DISTANCE
+    return {
+        "distance_strategy": strategy,
+        "normalize_L2": json.loads(settings.get("normalize_L2", "false")),
+    }
+
+def load_vectorstore(path: str, embeddings) -> FAISS:
+    """Load a FAISS vectorstore, memory-mapped when docs.sqlite is present."""
+    db_path = os.path.join(path, DOCSTORE_FILE)
+    if not os.path.exists(db_path):
+        logger.warning(f"{path} has no {DOCSTORE_FILE}; loading pickled docstore (run vector_store.py to convert)")
+        return FAISS.load_local(path, embeddings=embeddings, allow_dangerous_deserialization=True)
+
+    index = read_index_mmap(os.path.join(path, INDEX_FILE))
+
+    # A later save_local without save_docstore would leave docs.sqlite stale
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        last_pos = conn.execute("SELECT MAX(pos) FROM docs").fetchone()[0]
+        settings = _store_settings(conn, index)
+    finally:
+        conn.close()
+    if (last_pos if last_pos is not None else -1) + 1 != index.ntotal:
+        logger.warning(f"{db_path} does not match {INDEX_FILE}; loading pickled docstore")
+        return FAISS.load_local(path, embeddings=embeddings, allow_dangerous_deserialization=True)
+
+    return FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=SQLiteDocstore(db_path),
+        index_to_docstore_id=PositionMap(index.ntotal),
+        **settings,
+    )
+
+
+def load_editable_vectorstore(path: str, embeddings) -> FAISS:
+    """
+    Read a docs.sqlite vectorstore fully into memory (InMemoryDocstore and a
+    writable index), for offline tools that add or delete documents.
+    """
+    index = faiss.read_index(os.path.join(path, INDEX_FILE))
+    conn = sqlite3.connect(f"file:{os.path.join(path, DOCSTORE_FILE)}?mode=ro", uri=True)
+    try:
+        rows = conn.execute("SELECT pos, doc_id, page_content, metadata FROM docs ORDER BY pos").fetchall()
+        settings = _store_settings(conn, index)
+    finally:
+        conn.close()
+    if len(rows) != index.ntotal:
+        raise ValueError(f"{path}: {DOCSTORE_FILE} holds {len(rows)} documents but {INDEX_FILE} {index.ntotal} vectors")
+
+    return FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=InMemoryDocstore({
+            doc_id: Document(page_content=text, metadata=json.loads(metadata)) for _, doc_id, text, metadata in rows
+        }),
+        index_to_docstore_id={pos: doc_id for pos, doc_id, _, _ in rows},
+        **settings,
+    )
+
+
+# ---------------- Filtered search ----------------
+def filter_fields(vectorstore: FAISS) -> Set[str]:
+    """Metadata fields present on the store's documents."""
+    if isinstance(vectorstore.docstore, SQLiteDocstore):
+        return vectorstore.docstore.filter_fields()
+    # Pickled docstore: documents share one schema, so the first one is representative
+    docs = getattr(vectorstore.docstore, "_dict", {})
+    first = next(iter(docs.values()), None)
+    return set(first.metadata) if first is not None else set()
+
+def _search_params(index, selector):
+    if isinstance(index, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=index.hnsw.efSearch)
+    if isinstance(index, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(sel=selector, nprobe=index.nprobe)
+    return faiss.SearchParameters(sel=selector)
+
+def filtered_search_by_vector(
+    vectorstore: FAISS,
+    embedding: List[float],
+    k: int,
+    constraints: Dict[str, List[int]],
+) -> List[Tuple[Document, float]]:
+    """
+    Vector search restricted to documents matching `constraints`.
+
+    With a SQLite docstore the matching positions are looked up in the filters
+    table and handed to FAISS as an ID selector, so only those vectors are
+    scored. Pickled stores fall back to LangChain's post-filtering.
+    """
+    if not isinstance(vectorstore.docstore, SQLiteDocstore):
+        return vectorstore.similarity_search_with_score_by_vector(
+            embedding, k=k, filter=constraints, fetch_k=max(50, 10 * k)
+        )
+
+    ids = vectorstore.docstore.positions(constraints)
+    if len(ids) == 0:
+        return []
+
+    query = np.asarray([embedding], dtype=np.float32)
+    if vectorstore._normalize_L2:
+        faiss.normalize_L2(query)
+    selector = faiss.IDSelectorBatch(ids)
+    distances, indices = vectorstore.index.search(
+        query, min(k, len(ids)), params=_search_params(vectorstore.index, selector)
+    )
+
+    hits = []
+    for distance, i in zip(distances[0], indices[0]):
+        if i == -1:
+            continue
+        doc = vectorstore.docstore.search(int(i))
+        if isinstance(doc, Document):
+            hits.append((doc, float(distance)))
+    return hits
+
+
+# ---------------- CLI: convert save_local output ----------------
+if __name__ == "__main__":
+    import sys
+    from sparse_index import build_for_vectorstore
+
+    class _NoEmbeddings:
+        pass
+
+    for path in sys.argv[1:]:
+        # One-time, trusted conversion: the pickle is read here so it never has to be at serving time
+        vectorstore = FAISS.load_local(path, embeddings=_NoEmbeddings(), allow_dangerous_deserialization=True)
+        save_docstore(vectorstore, path)
+        print(f"Wrote {os.path.join(path, DOCSTORE_FILE)} ({vectorstore.index.ntotal} documents)")
+        build_for_vectorstore(vectorstore, path)